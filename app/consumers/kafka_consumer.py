@@ -1,51 +1,94 @@
 import logging
 import signal
+import threading
 from typing import Any, Callable
 
 from confluent_kafka import Consumer, KafkaException, Message
 from consumers.base_consumer import BaseConsumer
+from consumers.offset_tracker import OffsetTracker
+from consumers.topic_scheduler import TopicScheduler, TopicTask
 from core.config import settings
-from core.consts import consts
-from port_client import get_kafka_credentials
+from core.flight_recorder import flight_recorder
+from core.kafka import get_kafka_connection_config, get_kafka_fetch_config
+from core.metrics import metrics
+from core.shutdown import shutdown_coordinator
+from core.tracing import SPAN_KIND_CONSUMER, tracer
 
 logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+processed_counter = metrics.counter(
+    "port_agent_processed_messages_total", "Messages processed per topic"
+)
+
 
 class KafkaConsumer(BaseConsumer):
     def __init__(
-        self, msg_process: Callable[[Message], None], consumer: Consumer = None
+        self,
+        msg_process: Callable[[Message], None],
+        consumer: Consumer = None,
+        on_tick: Callable[[bool], None] | None = None,
     ) -> None:
         self.running = False
         signal.signal(signal.SIGINT, self.exit_gracefully)
         signal.signal(signal.SIGTERM, self.exit_gracefully)
 
         self.msg_process = msg_process
+        # Called on every poll loop iteration, and with force=True before
+        # partitions are revoked or the consumer is closed, so that messages
+        # held back by the processor can be flushed. With the topic scheduler
+        # the regular ticks run on a changelog worker, the only topic whose
+        # messages are held back, so that flushing never blocks the polling
+        self.on_tick = on_tick
+        self._tick_scheduled = threading.Event()
+        self.offsets = OffsetTracker()
+        self.scheduler = (
+            TopicScheduler(
+                self._process,
+                settings.KAFKA_TOPIC_SCHEDULING,
+                {
+                    settings.KAFKA_RUNS_TOPIC: settings.KAFKA_RUNS_CONCURRENCY,
+                    settings.KAFKA_CHANGE_LOG_TOPIC: (
+                        settings.KAFKA_CHANGE_LOG_CONCURRENCY
+                    ),
+                },
+                {
+                    settings.KAFKA_RUNS_TOPIC: settings.KAFKA_RUNS_WEIGHT,
+                    settings.KAFKA_CHANGE_LOG_TOPIC: settings.KAFKA_CHANGE_LOG_WEIGHT,
+                },
+            )
+            if settings.KAFKA_TOPIC_SCHEDULING != "none"
+            else None
+        )
+        self._paused_topics: set[str] = set()
 
         if consumer:
             self.consumer = consumer
         else:
             conf = {
-                "client.id": consts.KAFKA_CONSUMER_CLIENT_ID,
-                "security.protocol": settings.KAFKA_CONSUMER_SECURITY_PROTOCOL,
-                "sasl.mechanism": settings.KAFKA_CONSUMER_AUTHENTICATION_MECHANISM,
+                **get_kafka_connection_config(),
+                **get_kafka_fetch_config(),
                 "group.id": settings.KAFKA_CONSUMER_GROUP_ID,
                 "session.timeout.ms": settings.KAFKA_CONSUMER_SESSION_TIMEOUT_MS,
                 "auto.offset.reset": settings.KAFKA_CONSUMER_AUTO_OFFSET_RESET,
                 "enable.auto.commit": "false",
             }
-            if not settings.USING_LOCAL_PORT_INSTANCE:
-                logger.info("Getting Kafka credentials")
-                brokers, username, password = get_kafka_credentials()
-                conf["sasl.username"] = username
-                conf["sasl.password"] = password
-                conf["bootstrap.servers"] = ",".join(brokers)
+            if settings.KAFKA_CONSUMER_PARTITION_ASSIGNMENT_STRATEGY:
+                conf["partition.assignment.strategy"] = (
+                    settings.KAFKA_CONSUMER_PARTITION_ASSIGNMENT_STRATEGY
+                )
+            if settings.KAFKA_CONSUMER_GROUP_INSTANCE_ID:
+                conf["group.instance.id"] = settings.KAFKA_CONSUMER_GROUP_INSTANCE_ID
 
             self.consumer = Consumer(conf)
 
     def _on_assign(self, consumer: Consumer, partitions: Any) -> None:
         logger.info("Assignment: %s", partitions)
-        if not partitions:
+        # With the cooperative protocol only the added partitions are passed
+        incremental = "cooperative" in (
+            settings.KAFKA_CONSUMER_PARTITION_ASSIGNMENT_STRATEGY
+        )
+        if not partitions and not (incremental and consumer.assignment()):
             logger.error(
                 "No partitions assigned. This usually means that there is"
                 " already a consumer with the same group id running. To run"
@@ -54,47 +97,202 @@ class KafkaConsumer(BaseConsumer):
                 " value prefixed with your organization id."
             )
             self.exit_gracefully()
+            return
+
+        if incremental:
+            consumer.incremental_assign(partitions)
+        else:
+            consumer.assign(partitions)
+            self._paused_topics.clear()
+        # Keep the backpressure on topics that are paused
+        paused = [
+            partition
+            for partition in partitions
+            if partition.topic in self._paused_topics
+        ]
+        if paused:
+            consumer.pause(paused)
+
+    def _on_revoke(self, consumer: Consumer, partitions: Any) -> None:
+        logger.info("Revocation: %s", partitions)
+        if self.scheduler and not self.scheduler.drain(
+            partitions, settings.KAFKA_CONSUMER_REVOKE_DRAIN_TIMEOUT
+        ):
+            logger.warning(
+                "Revoked partitions still have messages being processed,"
+                " committing what was completed"
+            )
+        self._tick(force=True)
+        self.offsets.forget(partitions)
+
+    def _on_lost(self, consumer: Consumer, partitions: Any) -> None:
+        # The partitions already belong to another member, their offsets
+        # can't be committed anymore
+        logger.warning("Lost partitions: %s", partitions)
+        if self.scheduler:
+            self.scheduler.discard(partitions)
+        self.offsets.forget(partitions)
+
+    def _tick(self, force: bool = False) -> None:
+        if self.scheduler:
+            for msg in self.scheduler.completed():
+                self.offsets.release(msg)
+            self._apply_backpressure()
+        if self.on_tick:
+            if self.scheduler and not force:
+                self._schedule_tick()
+            else:
+                self.on_tick(force)
+        self._commit()
+
+    def _schedule_tick(self) -> None:
+        assert self.scheduler is not None
+        if self._tick_scheduled.is_set():
+            return
+        self._tick_scheduled.set()
+        self.scheduler.submit(
+            TopicTask(settings.KAFKA_CHANGE_LOG_TOPIC, self._run_scheduled_tick)
+        )
+
+    def _run_scheduled_tick(self) -> None:
+        assert self.on_tick is not None
+        try:
+            self.on_tick(False)
+        except Exception as tick_error:
+            logger.error("Failed to flush held back messages: %s", str(tick_error))
+        finally:
+            self._tick_scheduled.clear()
+
+    def _apply_backpressure(self) -> None:
+        """Stop fetching a topic while its work queue is full"""
+        assert self.scheduler is not None
+        max_queued = settings.KAFKA_TOPIC_MAX_QUEUED
+        for topic in self.scheduler.topics:
+            queued = self.scheduler.queued(topic)
+            if topic not in self._paused_topics and queued >= max_queued:
+                action = self.consumer.pause
+                self._paused_topics.add(topic)
+            elif topic in self._paused_topics and queued <= max_queued // 2:
+                action = self.consumer.resume
+                self._paused_topics.discard(topic)
+            else:
+                continue
+            partitions = [
+                partition
+                for partition in self.consumer.assignment()
+                if partition.topic == topic
+            ]
+            if partitions:
+                logger.info(
+                    "%s topic %s - queued: %d",
+                    "Pausing" if action == self.consumer.pause else "Resuming",
+                    topic,
+                    queued,
+                )
+                action(partitions)
+
+    def _process(self, msg: Message) -> None:
+        flight_recorder.begin(msg.topic(), msg.partition(), msg.offset())
+        try:
+            logger.info(
+                "Process message from topic %s, partition %d, offset %d",
+                msg.topic(),
+                msg.partition(),
+                msg.offset(),
+            )
+            with tracer.trace(
+                "kafka.receive",
+                {
+                    "messaging.system": "kafka",
+                    "messaging.destination.name": msg.topic(),
+                    "messaging.kafka.destination.partition": msg.partition(),
+                    "messaging.kafka.message.offset": msg.offset(),
+                },
+                SPAN_KIND_CONSUMER,
+            ):
+                self.msg_process(msg)
+        except Exception as process_error:
+            flight_recorder.end("error")
+            logger.error(
+                "Failed process message from topic %s, partition %d, offset %d: %s",
+                msg.topic(),
+                msg.partition(),
+                msg.offset(),
+                str(process_error),
+            )
+        finally:
+            flight_recorder.end()
+            processed_counter.inc(topic=msg.topic())
+
+    def _commit(self) -> None:
+        offsets = self.offsets.committable()
+        if offsets:
+            with tracer.trace(
+                "kafka.commit", {"messaging.kafka.partitions": len(offsets)}
+            ):
+                self.consumer.commit(offsets=offsets, asynchronous=False)
+            self.offsets.committed(offsets)
+
+    def _fetch(self) -> list[Message]:
+        if settings.KAFKA_CONSUMER_BATCH_SIZE > 1:
+            return self.consumer.consume(
+                num_messages=settings.KAFKA_CONSUMER_BATCH_SIZE,
+                timeout=settings.KAFKA_CONSUMER_BATCH_TIMEOUT,
+            )
+        msg = self.consumer.poll(timeout=1.0)
+        return [msg] if msg is not None else []
 
     def start(self) -> None:
         try:
             self.consumer.subscribe(
                 [settings.KAFKA_RUNS_TOPIC, settings.KAFKA_CHANGE_LOG_TOPIC],
                 on_assign=self._on_assign,
+                on_revoke=self._on_revoke,
+                on_lost=self._on_lost,
             )
+            if self.scheduler:
+                self.scheduler.start()
             self.running = True
             while self.running:
                 try:
-                    msg = self.consumer.poll(timeout=1.0)
-                    if msg is None:
-                        continue
-                    if msg.error():
-                        raise KafkaException(msg.error())
-                    else:
+                    for msg in self._fetch():
+                        if msg.error():
+                            logger.error(str(KafkaException(msg.error())))
+                            continue
+                        self.offsets.retain(msg)
+                        if self.scheduler:
+                            self.scheduler.submit(msg)
+                            continue
                         try:
-                            logger.info(
-                                "Process message"
-                                " from topic %s, partition %d, offset %d",
-                                msg.topic(),
-                                msg.partition(),
-                                msg.offset(),
-                            )
-                            self.msg_process(msg)
-                        except Exception as process_error:
-                            logger.error(
-                                "Failed process message"
-                                " from topic %s, partition %d, offset %d: %s",
-                                msg.topic(),
-                                msg.partition(),
-                                msg.offset(),
-                                str(process_error),
-                            )
+                            self._process(msg)
                         finally:
-                            self.consumer.commit(asynchronous=False)
+                            self.offsets.release(msg)
+                    # Commits once per fetched batch
+                    self._tick()
                 except Exception as message_error:
                     logger.error(str(message_error))
         finally:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        if self.scheduler:
+            with shutdown_coordinator.phase("drain in-flight messages"):
+                if not self.scheduler.stop(shutdown_coordinator.remaining()):
+                    logger.warning(
+                        "Shutdown deadline reached with messages still being"
+                        " processed, they will be consumed again"
+                    )
+                for msg in self.scheduler.completed():
+                    self.offsets.release(msg)
+        if self.on_tick:
+            with shutdown_coordinator.phase("flush held back messages"):
+                self.on_tick(True)
+        with shutdown_coordinator.phase("commit offsets"):
+            self._commit()
+        with shutdown_coordinator.phase("close consumer"):
             self.consumer.close()
 
     def exit_gracefully(self, *_: Any) -> None:
         logger.info("Exiting gracefully...")
         self.running = False
+        shutdown_coordinator.begin()
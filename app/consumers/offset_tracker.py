@@ -0,0 +1,67 @@
+import threading
+from collections import Counter
+
+from confluent_kafka import Message, TopicPartition
+
+
+class OffsetTracker:
+    """
+    Tracks the offsets that are still being worked on per partition so that
+    only offsets below the oldest unfinished message are committed. Every
+    message is retained once when it is received and released once it was
+    processed, a processor that keeps a message for later retains it again
+    and releases it when it is done with it. It is safe to use from the
+    worker threads of the topic scheduler.
+    """
+
+    def __init__(self) -> None:
+        self._retained: dict[tuple[str, int], Counter[int]] = {}
+        self._next_offsets: dict[tuple[str, int], int] = {}
+        self._committed: dict[tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def retain(self, msg: Message) -> None:
+        with self._lock:
+            key = (msg.topic(), msg.partition())
+            self._retained.setdefault(key, Counter())[msg.offset()] += 1
+            self._next_offsets[key] = max(
+                self._next_offsets.get(key, 0), msg.offset() + 1
+            )
+
+    def release(self, msg: Message) -> None:
+        with self._lock:
+            retained = self._retained.get((msg.topic(), msg.partition()))
+            if retained is None or not retained[msg.offset()]:
+                return
+            retained[msg.offset()] -= 1
+            if not retained[msg.offset()]:
+                del retained[msg.offset()]
+
+    def retained(self) -> int:
+        with self._lock:
+            return sum(len(offsets) for offsets in self._retained.values())
+
+    def committable(self) -> list[TopicPartition]:
+        """Offsets that can be committed and weren't committed yet"""
+        with self._lock:
+            offsets = []
+            for key, next_offset in self._next_offsets.items():
+                retained = self._retained.get(key)
+                offset = min(retained) if retained else next_offset
+                if self._committed.get(key) != offset:
+                    offsets.append(TopicPartition(key[0], key[1], offset))
+            return offsets
+
+    def committed(self, offsets: list[TopicPartition]) -> None:
+        with self._lock:
+            for offset in offsets:
+                self._committed[(offset.topic, offset.partition)] = offset.offset
+
+    def forget(self, partitions: list[TopicPartition]) -> None:
+        """Stop tracking partitions that are no longer assigned"""
+        with self._lock:
+            for partition in partitions:
+                key = (partition.topic, partition.partition)
+                self._retained.pop(key, None)
+                self._next_offsets.pop(key, None)
+                self._committed.pop(key, None)
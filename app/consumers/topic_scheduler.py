@@ -0,0 +1,225 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from functools import partial
+from typing import Callable
+
+from confluent_kafka import Message, TopicPartition
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+STRICT = "strict"
+# Tasks of a topic share this partition, so they run one at a time and in order
+TASK_PARTITION = -1
+
+queued_gauge = metrics.gauge(
+    "port_agent_topic_queued_messages", "Messages waiting for a worker per topic"
+)
+in_flight_gauge = metrics.gauge(
+    "port_agent_topic_in_flight_messages", "Messages being processed per topic"
+)
+queue_wait_counter = metrics.counter(
+    "port_agent_topic_queue_wait_seconds_total",
+    "Time messages spent waiting for a worker per topic",
+)
+
+
+class TopicTask:
+    """Work other than a message that is run by the workers of a topic"""
+
+    def __init__(self, topic: str, run: Callable[[], None]) -> None:
+        self._topic = topic
+        self.run = run
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return TASK_PARTITION
+
+
+class TopicScheduler:
+    """
+    Work queue per topic served by a pool of worker threads. Every topic has
+    its own concurrency limit, and when workers are free the next topic is
+    picked either by strict priority, in the order of `concurrency`, or by
+    smooth weighted round robin over the topics that have work. A partition
+    has at most one message being processed, so its messages are processed
+    in order and the concurrency of a topic is spread over its partitions.
+    Finished messages are handed back through `completed` so that the
+    consumer thread releases their offsets and commits. Tasks submitted for
+    a topic take one of its workers like a message does.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Message], None],
+        policy: str,
+        concurrency: dict[str, int],
+        weights: dict[str, int],
+    ) -> None:
+        self.process = process
+        self.policy = policy
+        self.concurrency = {
+            topic: max(limit, 1) for topic, limit in concurrency.items()
+        }
+        self.weights = {topic: max(weights.get(topic, 1), 1) for topic in concurrency}
+        self._queues: dict[str, deque[tuple[Message | TopicTask, float]]] = {
+            topic: deque() for topic in concurrency
+        }
+        self._in_flight = {topic: 0 for topic in concurrency}
+        self._in_flight_partitions: Counter[tuple[str, int]] = Counter()
+        self._current_weights = {topic: 0 for topic in concurrency}
+        self._condition = threading.Condition()
+        self._completed: queue.SimpleQueue[Message] = queue.SimpleQueue()
+        self._threads: list[threading.Thread] = []
+        self._stopped = False
+
+        for topic in concurrency:
+            queued_gauge.set_function(partial(self.queued, topic), topic=topic)
+            in_flight_gauge.set_function(partial(self.in_flight, topic), topic=topic)
+
+    @property
+    def topics(self) -> list[str]:
+        return list(self._queues)
+
+    def queued(self, topic: str) -> int:
+        with self._condition:
+            return len(self._queues[topic])
+
+    def in_flight(self, topic: str) -> int:
+        with self._condition:
+            return self._in_flight[topic]
+
+    def start(self) -> None:
+        self._threads = [
+            threading.Thread(
+                target=self._work, name=f"topic-worker-{index}", daemon=True
+            )
+            for index in range(sum(self.concurrency.values()))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = None) -> bool:
+        """
+        Wait for the messages being processed, queued messages are dropped.
+        Returns False if messages were still being processed at the timeout.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: not any(self._in_flight.values()), timeout
+            )
+
+    def submit(self, msg: Message | TopicTask) -> None:
+        with self._condition:
+            self._queues[msg.topic()].append((msg, time.monotonic()))
+            self._condition.notify()
+
+    def completed(self) -> list[Message]:
+        messages = []
+        while True:
+            try:
+                messages.append(self._completed.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def discard(self, partitions: list[TopicPartition]) -> list[Message]:
+        """Drop the queued messages of partitions that were revoked"""
+        revoked = {(partition.topic, partition.partition) for partition in partitions}
+        discarded = []
+        with self._condition:
+            for topic, messages in self._queues.items():
+                kept: deque[tuple[Message | TopicTask, float]] = deque()
+                for msg, enqueued_at in messages:
+                    if (topic, msg.partition()) in revoked:
+                        assert not isinstance(msg, TopicTask)
+                        discarded.append(msg)
+                    else:
+                        kept.append((msg, enqueued_at))
+                self._queues[topic] = kept
+        return discarded
+
+    def drain(self, partitions: list[TopicPartition], timeout: float) -> bool:
+        """
+        Discard the queued messages of the partitions and wait until their
+        messages being processed are done, returns False on timeout
+        """
+        self.discard(partitions)
+        keys = {(partition.topic, partition.partition) for partition in partitions}
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not any(self._in_flight_partitions[key] for key in keys),
+                timeout,
+            )
+
+    def _ready(self, topic: str) -> int | None:
+        """The position of the first queued message whose partition is idle"""
+        if self._in_flight[topic] >= self.concurrency[topic]:
+            return None
+        for position, (msg, _) in enumerate(self._queues[topic]):
+            if not self._in_flight_partitions[(topic, msg.partition())]:
+                return position
+        return None
+
+    def _pick(self) -> tuple[str, int] | None:
+        ready = {
+            topic: position
+            for topic in self._queues
+            if (position := self._ready(topic)) is not None
+        }
+        if not ready:
+            return None
+        eligible = list(ready)
+        if self.policy == STRICT:
+            return eligible[0], ready[eligible[0]]
+
+        total = 0
+        for topic in eligible:
+            self._current_weights[topic] += self.weights[topic]
+            total += self.weights[topic]
+        picked = max(eligible, key=lambda topic: self._current_weights[topic])
+        self._current_weights[picked] -= total
+        return picked, ready[picked]
+
+    def _next(self) -> tuple[str, Message | TopicTask] | None:
+        with self._condition:
+            while not self._stopped:
+                picked = self._pick()
+                if picked is None:
+                    self._condition.wait()
+                    continue
+                topic, position = picked
+                msg, enqueued_at = self._queues[topic][position]
+                del self._queues[topic][position]
+                self._in_flight[topic] += 1
+                self._in_flight_partitions[(topic, msg.partition())] += 1
+                queue_wait_counter.inc(time.monotonic() - enqueued_at, topic=topic)
+                return topic, msg
+            return None
+
+    def _work(self) -> None:
+        while next_message := self._next():
+            topic, msg = next_message
+            try:
+                if isinstance(msg, TopicTask):
+                    msg.run()
+                else:
+                    self.process(msg)
+            finally:
+                self._release(topic, msg)
+
+    def _release(self, topic: str, msg: Message | TopicTask) -> None:
+        with self._condition:
+            self._in_flight[topic] -= 1
+            self._in_flight_partitions[(topic, msg.partition())] -= 1
+            if not isinstance(msg, TopicTask):
+                self._completed.put(msg)
+            self._condition.notify_all()
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 from dotenv import find_dotenv
 from pydantic import (
@@ -20,6 +20,28 @@ class ActionReport(BaseModel):
     external_run_id: str | None = Field(None, alias="externalRunId")
 
 
+class DestinationPolicy(BaseModel):
+    maxConcurrency: int | None = None
+    acquireTimeout: float | None = None
+    circuitBreakerEnabled: bool | None = None
+    failureRateThreshold: float | None = None
+    slowCallDuration: float | None = None
+    slowCallRateThreshold: float | None = None
+    minimumCalls: int | None = None
+    windowSize: int | None = None
+    openDuration: float | None = None
+    halfOpenMaxCalls: int | None = None
+    adaptiveConcurrency: bool | None = None
+    latencyTarget: float | None = None
+    errorRateTarget: float | None = None
+
+
+class ChangelogBatch(BaseModel):
+    maxEvents: int = 100
+    maxBytes: int = 1024 * 1024
+    lingerTime: float = 0.1
+
+
 class Mapping(BaseModel):
     enabled: bool | str = True
     method: str | None = None
@@ -29,6 +51,20 @@ class Mapping(BaseModel):
     query: dict[str, str] | str | None = None
     report: ActionReport | None = None
     fieldsToDecryptPaths: list[str] = []
+    # Runs older than this many seconds are reported as expired instead of
+    # being invoked, on top of WEBHOOK_RUN_MAX_AGE
+    maxAge: float | None = None
+    # Bytes of the response body that are read, on top of
+    # WEBHOOK_RESPONSE_MAX_SIZE
+    maxResponseSize: int | None = None
+    # A Python handler called in-process instead of sending the request,
+    # `module:function` or the name of a `port_agent.handlers` entry point
+    handler: str | None = None
+    # Send the requests over HTTP/2, overrides WEBHOOK_HTTP2_HOSTS
+    http2: bool | None = None
+    destinationPolicy: DestinationPolicy | None = None
+    # Send changelog events for the same destination together as an array
+    batch: ChangelogBatch | None = None
 
 
 class Settings(BaseSettings):
@@ -41,15 +77,93 @@ class Settings(BaseSettings):
     PORT_API_BASE_URL: AnyHttpUrl = parse_obj_as(AnyHttpUrl, "https://api.getport.io")
     PORT_CLIENT_ID: str
     PORT_CLIENT_SECRET: str
+    # Client side rate limits for the Port API in requests per second, 0
+    # disables a limit. The global limit is shared by all endpoint classes.
+    PORT_API_RATE_LIMIT: float = 20
+    PORT_API_RATE_LIMIT_BURST: int = 40
+    PORT_API_ENDPOINT_RATE_LIMITS: dict[str, float] = {
+        "auth": 5,
+        "status": 10,
+        "response": 10,
+        "logs": 10,
+        "credentials": 1,
+    }
+    PORT_API_MAX_RETRIES: int = 5
+    # Concurrent Port updates (run logs, response and status) of the runs,
+    # 0 sends them one after the other
+    PORT_REPORT_CONCURRENCY: int = 8
+    # When set, run status, response and log reports are written to a local
+    # spool and sent to Port in the background
+    PORT_REPORT_SPOOL_PATH: Path | None = None
+    PORT_REPORT_SPOOL_SEGMENT_BYTES: int = 16 * 1024 * 1024
+    PORT_REPORT_SPOOL_MAX_BYTES: int = 256 * 1024 * 1024
+    PORT_REPORT_SPOOL_FSYNC_INTERVAL: float = 0.2
+    # Runs whose reports are sent concurrently, each run's reports are sent in
+    # order. A report is dead lettered to the spool directory after the
+    # attempts.
+    PORT_REPORT_SPOOL_CONCURRENCY: int = 4
+    PORT_REPORT_SPOOL_MAX_ATTEMPTS: int = 10
     KAFKA_CONSUMER_SECURITY_PROTOCOL: str = "plaintext"
     KAFKA_CONSUMER_AUTHENTICATION_MECHANISM: str = "none"
     KAFKA_CONSUMER_SESSION_TIMEOUT_MS: int = 45000
     KAFKA_CONSUMER_AUTO_OFFSET_RESET: str = "earliest"
     KAFKA_CONSUMER_GROUP_ID: str = ""
+    # e.g. "cooperative-sticky" to only move the partitions that change owner
+    # on a rebalance, every member of the group must use the same strategy
+    KAFKA_CONSUMER_PARTITION_ASSIGNMENT_STRATEGY: str = ""
+    # A stable id per agent instance enables static membership, a restart
+    # within the session timeout then doesn't trigger a rebalance
+    KAFKA_CONSUMER_GROUP_INSTANCE_ID: str = ""
+    # How long a revocation waits for messages of the revoked partitions that
+    # are being processed by the topic scheduler
+    KAFKA_CONSUMER_REVOKE_DRAIN_TIMEOUT: float = 10
+    # Messages are fetched in batches of up to this size with consume() and
+    # committed once per batch, 1 polls them one by one
+    KAFKA_CONSUMER_BATCH_SIZE: int = 1
+    KAFKA_CONSUMER_BATCH_TIMEOUT: float = 1
+    KAFKA_CONSUMER_FETCH_MIN_BYTES: int | None = None
+    KAFKA_CONSUMER_FETCH_WAIT_MAX_MS: int | None = None
+    KAFKA_CONSUMER_FETCH_MAX_BYTES: int | None = None
+    KAFKA_CONSUMER_MAX_PARTITION_FETCH_BYTES: int | None = None
+    KAFKA_CONSUMER_QUEUED_MIN_MESSAGES: int | None = None
+    KAFKA_CONSUMER_QUEUED_MAX_MESSAGES_KBYTES: int | None = None
+    # Any other librdkafka consumer configuration
+    KAFKA_CONSUMER_EXTRA_CONFIG: dict[str, Any] = {}
+
+    # Hold changelog events back for up to the window and only forward the
+    # latest event of every entity
+    KAFKA_CHANGE_LOG_COMPACTION_ENABLED: bool = False
+    KAFKA_CHANGE_LOG_COMPACTION_WINDOW: float = 1
+    KAFKA_CHANGE_LOG_COMPACTION_MAX_SIZE: int = 1000
+
+    # "none" processes messages one by one in poll order, "strict" always
+    # serves the runs topic first and "weighted" shares the workers between
+    # the topics by their weights. Each topic has its own concurrency, spread
+    # over its partitions: a partition's messages are processed in order.
+    KAFKA_TOPIC_SCHEDULING: Literal["none", "strict", "weighted"] = "none"
+    KAFKA_RUNS_CONCURRENCY: int = 4
+    KAFKA_CHANGE_LOG_CONCURRENCY: int = 1
+    KAFKA_RUNS_WEIGHT: int = 4
+    KAFKA_CHANGE_LOG_WEIGHT: int = 1
+    # Fetching a topic is paused while this many of its messages are queued
+    KAFKA_TOPIC_MAX_QUEUED: int = 100
 
     KAFKA_RUNS_TOPIC: str = ""
 
     CONTROL_THE_PAYLOAD_CONFIG_PATH: Path = Path("./control_the_payload_config.json")
+    # Seconds between checks of the config file for changes, 0 only reloads
+    # it on SIGHUP
+    CONTROL_THE_PAYLOAD_CONFIG_RELOAD_INTERVAL: float = 5
+    # Secrets available to the mappings as `$secrets`: the environment
+    # variables listed by name and the ones starting with the prefix, named
+    # without it, then a JSON object file and a directory with a file per
+    # secret. List the GitLab project token variables to keep their names.
+    SECRETS_ENV_PREFIX: str = "SECRET_"
+    SECRETS_ENV_NAMES: list[str] = ["GITLAB_URL"]
+    SECRETS_FILE: Path | None = None
+    SECRETS_DIR: Path | None = None
+    # Seconds between checks of the secret files for changes, 0 disables it
+    SECRETS_REFRESH_INTERVAL: float = 30
 
     @validator("KAFKA_RUNS_TOPIC", always=True)
     def set_kafka_runs_topic(cls, v: Optional[str], values: dict) -> str:
@@ -95,8 +209,109 @@ class Settings(BaseSettings):
             # For all other fields, use default parsing
             return cls.json_loads(raw_val)  # type: ignore
 
+    METRICS_PORT: int = 0
+
+    # Collapsed stacks, stage timings and cProfile captures (SIGUSR1 or
+    # /debug/profile on the metrics port) are written to the profiler path.
+    # Without it nothing is written and the captures are off, the stages and
+    # stacks are still served at /debug/stages and /debug/stacks
+    PROFILER_PATH: Path | None = None
+    # Seconds between stack samples, 0 disables the sampler
+    PROFILER_SAMPLE_INTERVAL: float = 0
+    # Seconds between writes of the stacks and stage timings, 0 only writes
+    # them on shutdown
+    PROFILER_FLUSH_INTERVAL: float = 60
+    # A capture profiles this many messages or this many seconds, whichever
+    # comes first
+    PROFILER_CAPTURE_MESSAGES: int = 1000
+    PROFILER_CAPTURE_SECONDS: float = 30
+    # Messages kept by the flight recorder, served at /debug/flight-recorder
+    # and dumped to the profiler path on SIGUSR2 when it's set, 0 disables it
+    FLIGHT_RECORDER_SIZE: int = 1000
+    # Share of the messages traced, 0 disables tracing. The spans are
+    # appended as OTLP/JSON lines to the export path and sent to the OTLP/HTTP
+    # endpoint of a collector, e.g. http://localhost:4318/v1/traces
+    TRACING_SAMPLE_RATIO: float = 0
+    TRACING_EXPORT_PATH: Path | None = None
+    TRACING_EXPORT_ENDPOINT: str = ""
+    TRACING_EXPORT_INTERVAL: float = 5
+    TRACING_MAX_QUEUED_TRACES: int = 1000
+    TRACING_SERVICE_NAME: str = "port-agent"
+
+    # Deadline for draining in-flight work and flushing reports on shutdown,
+    # keep it below the pod's terminationGracePeriodSeconds
+    SHUTDOWN_TIMEOUT: float = 25
+
     WEBHOOK_INVOKER_TIMEOUT: float = 30
 
+    # Runs triggered more than this many seconds ago are reported as expired
+    # instead of being invoked, 0 disables it. A mapping can set a lower
+    # maxAge for the runs it matches.
+    WEBHOOK_RUN_MAX_AGE: float = 0
+
+    # Response bodies larger than this many bytes are truncated, streaming
+    # stops there. 0 reads the whole body, a mapping can set
+    # maxResponseSize for the destinations it calls.
+    WEBHOOK_RESPONSE_MAX_SIZE: int = 0
+    # Characters of the response body kept in logs and failure summaries
+    WEBHOOK_RESPONSE_PREVIEW_SIZE: int = 1000
+
+    # Hosts the webhooks are sent to over HTTP/2, multiplexed over a
+    # connection per host. Needs the http2 extra (httpx), hosts without
+    # HTTP/2 support fall back to HTTP/1.1.
+    WEBHOOK_HTTP2_HOSTS: list[str] = []
+    WEBHOOK_HTTP2_MAX_CONNECTIONS: int = 100
+
+    # Worker threads for the mappings with a Python handler
+    PYTHON_HANDLER_WORKERS: int = 8
+
+    # Per destination host limits, 0 means unlimited concurrency
+    WEBHOOK_DESTINATION_MAX_CONCURRENCY: int = 0
+    WEBHOOK_DESTINATION_ACQUIRE_TIMEOUT: float = 5
+    WEBHOOK_CIRCUIT_BREAKER_ENABLED: bool = True
+    WEBHOOK_CIRCUIT_BREAKER_FAILURE_RATE_THRESHOLD: float = 0.5
+    WEBHOOK_CIRCUIT_BREAKER_SLOW_CALL_DURATION: float = 10
+    WEBHOOK_CIRCUIT_BREAKER_SLOW_CALL_RATE_THRESHOLD: float = 0.8
+    WEBHOOK_CIRCUIT_BREAKER_MINIMUM_CALLS: int = 10
+    WEBHOOK_CIRCUIT_BREAKER_WINDOW_SIZE: int = 20
+    WEBHOOK_CIRCUIT_BREAKER_OPEN_DURATION: float = 30
+    WEBHOOK_CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS: int = 1
+
+    # AIMD concurrency per destination host, when enabled the max concurrency
+    # above caps the adaptive limit instead of being a fixed limit
+    WEBHOOK_ADAPTIVE_CONCURRENCY_ENABLED: bool = False
+    WEBHOOK_ADAPTIVE_INITIAL_CONCURRENCY: int = 4
+    WEBHOOK_ADAPTIVE_MIN_CONCURRENCY: int = 1
+    WEBHOOK_ADAPTIVE_MAX_CONCURRENCY: int = 64
+    WEBHOOK_ADAPTIVE_LATENCY_TARGET: float | None = None
+    WEBHOOK_ADAPTIVE_ERROR_RATE_TARGET: float = 0.05
+    WEBHOOK_ADAPTIVE_BACKOFF_RATIO: float = 0.5
+
+    @validator("WEBHOOK_ADAPTIVE_LATENCY_TARGET", always=True)
+    def set_webhook_adaptive_latency_target(
+        cls, v: Optional[float], values: dict
+    ) -> float:
+        if v:
+            return v
+        return values.get("WEBHOOK_INVOKER_TIMEOUT", 30) / 10
+
+    # Failed invocations are parked in a delay queue and retried in the
+    # background, 1 attempt means retries are disabled
+    WEBHOOK_RETRY_MAX_ATTEMPTS: int = 1
+    WEBHOOK_RETRY_BASE_DELAY: float = 1
+    WEBHOOK_RETRY_MAX_DELAY: float = 300
+    WEBHOOK_RETRY_MAX_QUEUE_SIZE: int = 10000
+    WEBHOOK_RETRY_QUEUE_PATH: Path | None = None
+    WEBHOOK_DEAD_LETTER_PATH: Path | None = None
+    WEBHOOK_DEAD_LETTER_TOPIC: str = ""
+
+    # Processed runs and changelog messages are remembered for this many
+    # seconds so that messages replayed after a rebalance or a restart are
+    # skipped, 0 disables it. The database path makes it survive restarts.
+    WEBHOOK_IDEMPOTENCY_TTL: float = 0
+    WEBHOOK_IDEMPOTENCY_MAX_ENTRIES: int = 100000
+    WEBHOOK_IDEMPOTENCY_DB_PATH: Path | None = None
+
 
 settings = Settings()
 
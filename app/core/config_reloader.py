@@ -0,0 +1,108 @@
+import logging
+import os
+import signal
+import threading
+from pathlib import Path
+from typing import Any
+
+import pyjq as jq
+from core.config import Mapping, control_the_payload_config, settings
+from pydantic import ValidationError, parse_file_as
+from utils import get_jq_expressions
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+JQ_FIELDS = {"enabled", "method", "url", "body", "headers", "query", "report"}
+
+
+def load_mappings(path: Path) -> list[Mapping]:
+    """Parse the mappings and compile every jq expression they hold"""
+    mappings = parse_file_as(list[Mapping], path)
+    for index, mapping in enumerate(mappings):
+        for expression in get_jq_expressions(
+            mapping.dict(include=JQ_FIELDS, exclude_none=True)
+        ):
+            try:
+                jq.compile(expression, vars={"secrets": {}})
+            except ValueError as e:
+                raise ValueError(
+                    f"Mapping {index} has an invalid jq expression"
+                    f" {expression!r}: {e}"
+                ) from e
+    return mappings
+
+
+class ConfigReloader:
+    """
+    Reloads the control the payload config when the file changes, checked
+    every `interval` seconds, or on SIGHUP. The new mappings are validated
+    and swapped in as a whole, an invalid config leaves the current one in
+    place.
+    """
+
+    def __init__(self, path: Path, interval: float) -> None:
+        self.path = path
+        self.interval = interval
+        self._requested = threading.Event()
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+        self._file_state = self._get_file_state()
+
+    def _get_file_state(self) -> tuple[int, int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def reload(self) -> bool:
+        try:
+            mappings = load_mappings(self.path)
+        except (OSError, ValidationError, ValueError) as e:
+            logger.error(
+                "ConfigReloader - invalid config %s, keeping the current one: %s",
+                self.path,
+                e,
+            )
+            return False
+
+        # A single slice assignment, readers see either the old or the new list
+        control_the_payload_config[:] = mappings
+        logger.info(
+            "ConfigReloader - reloaded %d mappings from %s", len(mappings), self.path
+        )
+        return True
+
+    def request_reload(self, *_: Any) -> None:
+        self._requested.set()
+
+    def start(self) -> None:
+        signal.signal(signal.SIGHUP, self.request_reload)
+        self._thread = threading.Thread(
+            target=self._run, name="config-reloader", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stopped = True
+        self._requested.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            requested = self._requested.wait(self.interval or None)
+            self._requested.clear()
+            if self._stopped:
+                return
+            file_state = self._get_file_state()
+            if requested or file_state != self._file_state:
+                self._file_state = file_state
+                self.reload()
+
+
+config_reloader = ConfigReloader(
+    settings.CONTROL_THE_PAYLOAD_CONFIG_PATH,
+    settings.CONTROL_THE_PAYLOAD_CONFIG_RELOAD_INTERVAL,
+)
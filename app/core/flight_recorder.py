@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from core.config import settings
+from core.metrics_server import metrics_server
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# The stages a record keeps the duration of, other profiler stages are ignored
+STAGES = (
+    "streamer.msg_process",
+    "invoker.invoke",
+    "invoker.request",
+    "port.status",
+    "port.response",
+    "port.logs",
+)
+STAGE_INDEXES = {name: index for index, name in enumerate(STAGES)}
+NO_DURATIONS = (0.0,) * len(STAGES)
+
+
+class FlightRecord:
+    """A slot of the ring buffer, overwritten by every message it records"""
+
+    __slots__ = (
+        "sequence",
+        "started_at",
+        "topic",
+        "partition",
+        "offset",
+        "run_id",
+        "mapping_index",
+        "durations",
+        "outcome",
+        "message_bytes",
+        "response_bytes",
+    )
+
+    def __init__(self) -> None:
+        self.durations = list(NO_DURATIONS)
+        self.reset(-1, "", -1, -1)
+
+    def reset(self, sequence: int, topic: str, partition: int, offset: int) -> None:
+        self.sequence = sequence
+        self.started_at = time.time()
+        self.topic = topic
+        self.partition = partition
+        self.offset = offset
+        self.run_id: str | None = None
+        self.mapping_index = -1
+        self.durations[:] = NO_DURATIONS
+        self.outcome = ""
+        self.message_bytes = -1
+        self.response_bytes = -1
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "sequence": self.sequence,
+            "startedAt": self.started_at,
+            "topic": self.topic,
+            "partition": self.partition,
+            "offset": self.offset,
+            "runId": self.run_id,
+            "mappingIndex": None if self.mapping_index < 0 else self.mapping_index,
+            "stages": {
+                name: round(duration, 6)
+                for name, duration in zip(STAGES, self.durations)
+                if duration
+            },
+            "outcome": self.outcome or "inFlight",
+            "messageBytes": None if self.message_bytes < 0 else self.message_bytes,
+            "responseBytes": None if self.response_bytes < 0 else self.response_bytes,
+        }
+
+
+class FlightRecorder:
+    """
+    Ring buffer of the last `size` messages: where they came from, their run,
+    mapping, stage durations, outcome and sizes. The slots are allocated
+    upfront and overwritten in place, recording a message doesn't build any
+    object. The buffer is served at `/debug/flight-recorder` on the metrics
+    port, and dumped as JSON to `path` on SIGUSR2 when there is a path.
+    """
+
+    def __init__(self, size: int, path: Path | None) -> None:
+        self.size = size
+        self.path = path
+        self._records = [FlightRecord() for _ in range(size)]
+        self._sequence = 0
+        self._lock = threading.Lock()
+        # The record of the message the thread is processing, with its
+        # sequence to tell if the slot was overwritten meanwhile
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def begin(self, topic: str, partition: int, offset: int) -> None:
+        if not self.size:
+            return
+        with self._lock:
+            sequence = self._sequence
+            self._sequence += 1
+        record = self._records[sequence % self.size]
+        record.reset(sequence, topic, partition, offset)
+        self._local.record = record
+        self._local.sequence = sequence
+
+    def end(self, outcome: str = "processed") -> None:
+        record = self._current_record()
+        if record is not None and not record.outcome:
+            record.outcome = outcome
+        self._local.record = None
+
+    def current(self) -> tuple[FlightRecord, int] | None:
+        """The thread's record, to keep recording to it from another thread"""
+        record = self._current_record()
+        return None if record is None else (record, record.sequence)
+
+    def resume(self, current: tuple[FlightRecord, int] | None) -> None:
+        self._local.record, self._local.sequence = current or (None, -1)
+
+    def _current_record(self) -> FlightRecord | None:
+        record = getattr(self._local, "record", None)
+        if record is None or record.sequence != self._local.sequence:
+            return None
+        return record
+
+    def record_stage(self, name: str, duration: float) -> None:
+        index = STAGE_INDEXES.get(name)
+        if index is not None and (record := self._current_record()) is not None:
+            record.durations[index] += duration
+
+    def set_run(self, run_id: str | None, mapping_index: int = -1) -> None:
+        if (record := self._current_record()) is not None:
+            record.run_id = run_id
+            record.mapping_index = mapping_index
+
+    def set_outcome(self, outcome: str) -> None:
+        if (record := self._current_record()) is not None:
+            record.outcome = outcome
+
+    def set_message_bytes(self, size: int) -> None:
+        if (record := self._current_record()) is not None:
+            record.message_bytes = size
+
+    def set_response_bytes(self, size: int) -> None:
+        if (record := self._current_record()) is not None:
+            record.response_bytes = size
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """The recorded messages, oldest first"""
+        with self._lock:
+            last = self._sequence
+        first = max(0, last - self.size)
+        records = [
+            self._records[sequence % self.size] for sequence in range(first, last)
+        ]
+        return [record.to_dict() for record in records if record.sequence >= first]
+
+    def dump(self) -> Path | None:
+        if self.path is None:
+            logger.warning("FlightRecorder - no path to dump to")
+            return None
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path / f"flight-recorder-{os.getpid()}-{int(time.time())}.json"
+        path.write_text(json.dumps(self.snapshot(), indent=2))
+        logger.info("FlightRecorder - dumped - path: %s", path)
+        return path
+
+    def _on_signal(self, *_: Any) -> None:
+        threading.Thread(target=self.dump, daemon=True).start()
+
+    def _route(self, _: dict[str, list[str]]) -> tuple[int, str, bytes]:
+        return 200, "application/json", json.dumps(self.snapshot()).encode()
+
+    def start(self) -> None:
+        if not self.size:
+            return
+        if self.path is not None:
+            signal.signal(signal.SIGUSR2, self._on_signal)
+        metrics_server.add_route("/debug/flight-recorder", self._route)
+
+
+flight_recorder = FlightRecorder(settings.FLIGHT_RECORDER_SIZE, settings.PROFILER_PATH)
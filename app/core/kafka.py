@@ -0,0 +1,44 @@
+import logging
+
+from core.config import settings
+from core.consts import consts
+from port_client import get_kafka_credentials
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def get_kafka_connection_config() -> dict:
+    conf = {
+        "client.id": consts.KAFKA_CONSUMER_CLIENT_ID,
+        "security.protocol": settings.KAFKA_CONSUMER_SECURITY_PROTOCOL,
+        "sasl.mechanism": settings.KAFKA_CONSUMER_AUTHENTICATION_MECHANISM,
+    }
+    if not settings.USING_LOCAL_PORT_INSTANCE:
+        logger.info("Getting Kafka credentials")
+        brokers, username, password = get_kafka_credentials()
+        conf["sasl.username"] = username
+        conf["sasl.password"] = password
+        conf["bootstrap.servers"] = ",".join(brokers)
+
+    return conf
+
+
+def get_kafka_fetch_config() -> dict:
+    """librdkafka fetch tuning, options that aren't set keep their defaults"""
+    options = {
+        "fetch.min.bytes": settings.KAFKA_CONSUMER_FETCH_MIN_BYTES,
+        "fetch.wait.max.ms": settings.KAFKA_CONSUMER_FETCH_WAIT_MAX_MS,
+        "fetch.max.bytes": settings.KAFKA_CONSUMER_FETCH_MAX_BYTES,
+        "max.partition.fetch.bytes": (
+            settings.KAFKA_CONSUMER_MAX_PARTITION_FETCH_BYTES
+        ),
+        "queued.min.messages": settings.KAFKA_CONSUMER_QUEUED_MIN_MESSAGES,
+        "queued.max.messages.kbytes": (
+            settings.KAFKA_CONSUMER_QUEUED_MAX_MESSAGES_KBYTES
+        ),
+    }
+    return {
+        **{key: value for key, value in options.items() if value is not None},
+        **settings.KAFKA_CONSUMER_EXTRA_CONFIG,
+    }
@@ -0,0 +1,69 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# A route gets the parsed query string and returns (status, content type, body)
+Route = Callable[[dict[str, list[str]]], tuple[int, str, bytes]]
+
+
+def _metrics_route(_: dict[str, list[str]]) -> tuple[int, str, bytes]:
+    return 200, "text/plain; version=0.0.4", metrics.render().encode()
+
+
+class MetricsServer:
+    def __init__(self) -> None:
+        self._routes: dict[str, Route] = {"/metrics": _metrics_route}
+        self._server: ThreadingHTTPServer | None = None
+
+    def add_route(self, path: str, route: Route) -> None:
+        self._routes[path] = route
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        routes = self._routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                route = routes.get(url.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                try:
+                    status, content_type, body = route(parse_qs(url.query))
+                except Exception as e:
+                    logger.error("MetricsServer - %s failed: %s", url.path, e)
+                    self.send_error(500)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                logger.debug("MetricsServer - " + format, *args)
+
+        return Handler
+
+    def start(self, port: int) -> None:
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), self._handler())
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+        logger.info("MetricsServer - listening on port %d", port)
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+metrics_server = MetricsServer()
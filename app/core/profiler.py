@@ -0,0 +1,309 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Any, Iterator
+
+from core.config import settings
+from core.flight_recorder import flight_recorder
+from core.metrics_server import metrics_server
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse_stack(thread_name: str, frame: FrameType | None) -> str:
+    """A stack in the collapsed format of flamegraph.pl, root first"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+class StageTimer:
+    """Wall time spent in each instrumented stage"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stages: dict[str, list[float]] = {}
+
+    def record(self, name: str, elapsed: float) -> None:
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                self._stages[name] = [1, elapsed, elapsed]
+            else:
+                stage[0] += 1
+                stage[1] += elapsed
+                stage[2] = max(stage[2], elapsed)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            stages = {name: list(stage) for name, stage in self._stages.items()}
+        return {
+            name: {
+                "count": count,
+                "totalSeconds": round(total, 6),
+                "averageSeconds": round(total / count, 6),
+                "maxSeconds": round(longest, 6),
+            }
+            for name, (count, total, longest) in sorted(stages.items())
+        }
+
+
+class ProfileCapture:
+    """
+    cProfile over the next `messages` messages or `seconds` seconds,
+    whichever comes first. cProfile only profiles the thread that enables
+    it, so every message is profiled on its own thread and the results are
+    merged.
+    """
+
+    def __init__(self, path: Path, messages: int, seconds: float) -> None:
+        self.path = path
+        self.messages = messages
+        self.deadline = time.monotonic() + seconds
+        self.profiled = 0
+        self.stats: pstats.Stats | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.profiled >= self.messages or time.monotonic() >= self.deadline
+
+    def add(self, profile: cProfile.Profile) -> bool:
+        """Merges a message's profile, returns True when the capture is done"""
+        profile.create_stats()
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.profiled += 1
+            return self.done
+
+    def write(self) -> None:
+        with self._lock:
+            if self.stats is None:
+                logger.info("Profiler - no message was profiled")
+                return
+            self.stats.dump_stats(self.path)
+            with open(self.path.with_suffix(".txt"), "w") as report:
+                pstats.Stats(str(self.path), stream=report).sort_stats(
+                    pstats.SortKey.CUMULATIVE
+                ).print_stats(50)
+        logger.info(
+            "Profiler - profiled %d messages, written to %s", self.profiled, self.path
+        )
+
+
+class Profiler:
+    """
+    Profiling that can be turned on in production:
+    - a stack sampler writing collapsed stacks, for flamegraphs, every
+      `sample_interval` seconds, 0 disables it
+    - a cProfile capture over the next messages, started with SIGUSR1 or
+      `/debug/profile?messages=N&seconds=T` on the metrics port
+    - the wall time of the instrumented stages
+    The stacks and stage times are written to `path` every
+    `flush_interval` seconds and on stop. Without a path nothing is written
+    and the captures are off, the stacks and stages are only served.
+    """
+
+    def __init__(
+        self,
+        path: Path | None,
+        sample_interval: float,
+        flush_interval: float,
+        capture_messages: int,
+        capture_seconds: float,
+    ) -> None:
+        self.path = path
+        self.sample_interval = sample_interval
+        self.flush_interval = flush_interval
+        self.capture_messages = capture_messages
+        self.capture_seconds = capture_seconds
+        self.stages = StageTimer()
+        self.stacks: Counter[str] = Counter()
+        self._stacks_lock = threading.Lock()
+        self._capture: ProfileCapture | None = None
+        self._capture_lock = threading.Lock()
+        self._profiling = threading.local()
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Records the wall time of the block, or of the decorated function"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.stages.record(name, elapsed)
+            flight_recorder.record_stage(name, elapsed)
+
+    @contextmanager
+    def message(self) -> Iterator[None]:
+        """Profiles the message's processing while a capture is running"""
+        capture = self._capture
+        if capture is None or getattr(self._profiling, "active", False):
+            yield
+            return
+
+        profile = cProfile.Profile()
+        self._profiling.active = True
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._profiling.active = False
+            if capture.add(profile):
+                self._finish_capture(capture)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def start_capture(
+        self, messages: int | None = None, seconds: float | None = None
+    ) -> Path | None:
+        """Starts a capture, returns None if one is already running"""
+        if self.path is None:
+            return None
+        with self._capture_lock:
+            if self._capture is not None:
+                return None
+            self.path.mkdir(parents=True, exist_ok=True)
+            path = self.path / f"cprofile-{os.getpid()}-{int(time.time())}.prof"
+            self._capture = ProfileCapture(
+                path,
+                messages or self.capture_messages,
+                seconds or self.capture_seconds,
+            )
+        logger.info("Profiler - capture started, writing to %s", path)
+        return path
+
+    def _finish_capture(self, capture: ProfileCapture) -> None:
+        with self._capture_lock:
+            if self._capture is not capture:
+                return
+            self._capture = None
+        capture.write()
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        current = threading.get_ident()
+        frames = sys._current_frames()
+        stacks = [
+            collapse_stack(names.get(ident, str(ident)), frame)
+            for ident, frame in frames.items()
+            if ident != current
+        ]
+        with self._stacks_lock:
+            self.stacks.update(stacks)
+
+    def render_stacks(self) -> str:
+        with self._stacks_lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def flush(self) -> None:
+        if self.path is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        pid = os.getpid()
+        if self.sample_interval:
+            (self.path / f"stacks-{pid}.collapsed").write_text(self.render_stacks())
+        (self.path / f"stages-{pid}.json").write_text(
+            json.dumps(self.stages.snapshot(), indent=2)
+        )
+        capture = self._capture
+        if capture is not None and capture.done:
+            self._finish_capture(capture)
+
+    def _sample_loop(self) -> None:
+        while not self._stopped.wait(self.sample_interval):
+            self.sample()
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error("Profiler - failed to write to %s: %s", self.path, e)
+
+    def _on_signal(self, *_: Any) -> None:
+        threading.Thread(target=self.start_capture, daemon=True).start()
+
+    def _profile_route(self, query: dict[str, list[str]]) -> tuple[int, str, bytes]:
+        messages = int(query.get("messages", ["0"])[0])
+        seconds = float(query.get("seconds", ["0"])[0])
+        path = self.start_capture(messages, seconds)
+        if path is None:
+            return 409, "application/json", b'{"error": "a capture is running"}'
+        return 202, "application/json", json.dumps({"path": str(path)}).encode()
+
+    def _stages_route(self, _: dict[str, list[str]]) -> tuple[int, str, bytes]:
+        return 200, "application/json", json.dumps(self.stages.snapshot()).encode()
+
+    def _stacks_route(self, _: dict[str, list[str]]) -> tuple[int, str, bytes]:
+        return 200, "text/plain", self.render_stacks().encode()
+
+    def start(self) -> None:
+        metrics_server.add_route("/debug/stages", self._stages_route)
+        metrics_server.add_route("/debug/stacks", self._stacks_route)
+        loops = []
+        if self.enabled:
+            signal.signal(signal.SIGUSR1, self._on_signal)
+            metrics_server.add_route("/debug/profile", self._profile_route)
+            if self.flush_interval:
+                loops.append(self._flush_loop)
+        if self.sample_interval:
+            loops.append(self._sample_loop)
+        self._threads = [
+            threading.Thread(target=loop, name="profiler", daemon=True)
+            for loop in loops
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        capture = self._capture
+        if capture is not None:
+            self._finish_capture(capture)
+        if not self.enabled:
+            return
+        try:
+            self.flush()
+        except OSError as e:
+            logger.error("Profiler - failed to write to %s: %s", self.path, e)
+
+
+profiler = Profiler(
+    settings.PROFILER_PATH,
+    settings.PROFILER_SAMPLE_INTERVAL,
+    settings.PROFILER_FLUSH_INTERVAL,
+    settings.PROFILER_CAPTURE_MESSAGES,
+    settings.PROFILER_CAPTURE_SECONDS,
+)
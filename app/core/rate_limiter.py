@@ -0,0 +1,68 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+    Callers waiting for a token are served by priority (lower first) and in
+    arrival order within the same priority, so a burst of low priority calls
+    can't starve the important ones. `pause` stops handing out tokens, e.g.
+    for the duration of a Retry-After. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float) -> None:
+        self.name = name
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def waiting(self) -> int:
+        with self._condition:
+            return len(self._waiters)
+
+    def pause(self, seconds: float) -> None:
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def acquire(self, priority: int = 0) -> None:
+        if self.rate <= 0:
+            return
+
+        with self._condition:
+            waiter = (priority, next(self._counter))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    is_next = self._waiters[0] == waiter
+                    if is_next and now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    if not is_next:
+                        self._condition.wait()
+                        continue
+                    self._condition.wait(
+                        max(
+                            self._paused_until - now,
+                            (1 - self._tokens) / self.rate,
+                        )
+                    )
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
@@ -0,0 +1,145 @@
+import itertools
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from core.config import settings
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Versions are unique across the registries as they share the jq programs cache
+_versions = itertools.count(1)
+
+
+class SecretRegistry:
+    """
+    Secrets exposed to the mappings as the `$secrets` jq variable, e.g. the
+    GitLab trigger tokens. They are loaded from the environment variables
+    starting with `env_prefix` or listed in `env_names`, a JSON file of name
+    to value and a directory of files named after the secret (a mounted
+    Kubernetes secret), later sources win. The file and directory are checked
+    for changes every `refresh_interval` seconds. Every load publishes the
+    secrets with a new version as one `snapshot`, so compiled jq programs are
+    refreshed and never cached with secrets of another version.
+    """
+
+    def __init__(
+        self,
+        secrets_file: Path | None,
+        secrets_dir: Path | None,
+        refresh_interval: float,
+        env_prefix: str = "",
+        env_names: Iterable[str] = (),
+    ) -> None:
+        self.env_prefix = env_prefix
+        self.env_names = tuple(env_names)
+        self.secrets_file = secrets_file
+        self.secrets_dir = secrets_dir
+        self.refresh_interval = refresh_interval
+        self.snapshot: tuple[dict[str, str], int] = ({}, 0)
+        self._sources_state: tuple = ()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.load()
+
+    @property
+    def secrets(self) -> dict[str, str]:
+        return self.snapshot[0]
+
+    @property
+    def version(self) -> int:
+        return self.snapshot[1]
+
+    def _source_files(self) -> list[Path]:
+        files = []
+        if self.secrets_file and self.secrets_file.is_file():
+            files.append(self.secrets_file)
+        if self.secrets_dir and self.secrets_dir.is_dir():
+            files.extend(
+                sorted(
+                    path
+                    for path in self.secrets_dir.iterdir()
+                    if not path.name.startswith(".") and path.is_file()
+                )
+            )
+        return files
+
+    def _get_sources_state(self) -> tuple:
+        state = []
+        for path in self._source_files():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            state.append((str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(state)
+
+    def load(self) -> None:
+        prefix_len = len(self.env_prefix)
+        secrets = {
+            name: os.environ[name] for name in self.env_names if name in os.environ
+        }
+        secrets.update(
+            {
+                name[prefix_len:]: value
+                for name, value in os.environ.items()
+                if self.env_prefix and name.startswith(self.env_prefix)
+            }
+        )
+        if self.secrets_file and self.secrets_file.is_file():
+            try:
+                secrets.update(
+                    {
+                        str(key): str(value)
+                        for key, value in json.loads(
+                            self.secrets_file.read_text("utf-8")
+                        ).items()
+                    }
+                )
+            except (OSError, ValueError, AttributeError) as e:
+                logger.error(
+                    "SecretRegistry - failed to load %s: %s", self.secrets_file, e
+                )
+        if self.secrets_dir and self.secrets_dir.is_dir():
+            for path in self._source_files():
+                if path.parent != self.secrets_dir:
+                    continue
+                try:
+                    secrets[path.name] = path.read_text("utf-8").strip()
+                except OSError as e:
+                    logger.error("SecretRegistry - failed to load %s: %s", path, e)
+
+        self._sources_state = self._get_sources_state()
+        self.snapshot = (secrets, next(_versions))
+        logger.info("SecretRegistry - loaded %d secrets", len(secrets))
+
+    def start(self) -> None:
+        if not (self.secrets_file or self.secrets_dir) or not self.refresh_interval:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="secret-registry", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.refresh_interval):
+            if self._get_sources_state() != self._sources_state:
+                self.load()
+
+
+secret_registry = SecretRegistry(
+    settings.SECRETS_FILE,
+    settings.SECRETS_DIR,
+    settings.SECRETS_REFRESH_INTERVAL,
+    settings.SECRETS_ENV_PREFIX,
+    settings.SECRETS_ENV_NAMES,
+)
@@ -0,0 +1,55 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from core.config import settings
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class ShutdownCoordinator:
+    """
+    Shared deadline for the shutdown phases. The deadline starts when the
+    shutdown begins, every phase waits at most for the `remaining` time and
+    its duration is logged so the termination grace period can be tuned.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self._started_at: float | None = None
+
+    def begin(self) -> None:
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+            logger.info("Shutdown - started, deadline: %.1fs", self.timeout)
+
+    def remaining(self) -> float:
+        self.begin()
+        assert self._started_at is not None
+        return max(self._started_at + self.timeout - time.monotonic(), 0)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.begin()
+        started_at = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            logger.error("Shutdown - %s failed: %s", name, e)
+        finally:
+            logger.info(
+                "Shutdown - %s took %.2fs, %.1fs left",
+                name,
+                time.monotonic() - started_at,
+                self.remaining(),
+            )
+
+    def finish(self) -> None:
+        self.begin()
+        assert self._started_at is not None
+        logger.info("Shutdown - finished in %.2fs", time.monotonic() - self._started_at)
+
+
+shutdown_coordinator = ShutdownCoordinator(settings.SHUTDOWN_TIMEOUT)
@@ -0,0 +1,341 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import requests
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+dropped_spans_counter = metrics.counter(
+    "port_agent_dropped_spans_total", "Spans dropped because the export queue was full"
+)
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_CONSUMER = 5
+STATUS_CODE_ERROR = 2
+# Seconds to wait for the collector
+EXPORT_TIMEOUT = 10
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "kind",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: int,
+        parent_id: str,
+        attributes: dict[str, Any] | None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time = 0
+        # A decorated function passes the same attributes to all its spans
+        self.attributes = dict(attributes) if attributes else {}
+        self.error: str | None = None
+
+
+class Trace:
+    """The spans of a message, tied together by the run ID once it's known"""
+
+    __slots__ = ("trace_id", "sampled", "run_id", "spans")
+
+    def __init__(self, sampled: bool) -> None:
+        self.trace_id = f"{random.getrandbits(128):032x}" if sampled else ""
+        self.sampled = sampled
+        self.run_id: str | None = None
+        self.spans: list[Span] = []
+
+
+UNSAMPLED = Trace(sampled=False)
+
+
+def _to_otlp_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp_attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {"key": key, "value": _to_otlp_value(value)}
+        for key, value in attributes.items()
+    ]
+
+
+def _to_otlp_span(trace: Trace, span: Span) -> dict[str, Any]:
+    attributes = (
+        {**span.attributes, "port.run_id": trace.run_id}
+        if trace.run_id
+        else span.attributes
+    )
+    otlp_span = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_time),
+        "endTimeUnixNano": str(span.end_time),
+        "attributes": _to_otlp_attributes(attributes),
+        "status": (
+            {"code": STATUS_CODE_ERROR, "message": span.error} if span.error else {}
+        ),
+    }
+    if span.parent_id:
+        otlp_span["parentSpanId"] = span.parent_id
+    return otlp_span
+
+
+def to_otlp(traces: list[Trace], service_name: str) -> dict[str, Any]:
+    """An OTLP/JSON ExportTraceServiceRequest"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _to_otlp_attributes({"service.name": service_name})
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "port-agent"},
+                        "spans": [
+                            _to_otlp_span(trace, span)
+                            for trace in traces
+                            for span in trace.spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class SpanExporter:
+    """
+    Sends the finished traces in the background every `interval` seconds,
+    as OTLP/JSON lines appended to `path` and to an OTLP/HTTP collector
+    `endpoint`. Traces are dropped while `max_queued` are waiting.
+    """
+
+    def __init__(
+        self,
+        path: Path | None,
+        endpoint: str,
+        interval: float,
+        max_queued: int,
+        service_name: str,
+    ) -> None:
+        self.path = path
+        self.endpoint = endpoint
+        self.interval = interval
+        self.max_queued = max_queued
+        self.service_name = service_name
+        self._queue: deque[Trace] = deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def export(self, trace: Trace) -> None:
+        with self._lock:
+            if len(self._queue) >= self.max_queued:
+                dropped_spans_counter.inc(len(trace.spans))
+                return
+            self._queue.append(trace)
+
+    def flush(self, timeout: float = EXPORT_TIMEOUT) -> None:
+        with self._lock:
+            traces = list(self._queue)
+            self._queue.clear()
+        if not traces:
+            return
+        payload = json.dumps(to_otlp(traces, self.service_name))
+        if self.path:
+            with open(self.path, "a") as export_file:
+                export_file.write(payload + "\n")
+        if self.endpoint:
+            res = requests.post(
+                self.endpoint,
+                data=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=timeout,
+            )
+            res.raise_for_status()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._flush_logging_errors()
+
+    def _flush_logging_errors(self, timeout: float = EXPORT_TIMEOUT) -> None:
+        try:
+            self.flush(timeout)
+        except (OSError, requests.RequestException) as e:
+            logger.error("SpanExporter - failed to export spans: %s", e)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Exports the traces left, waiting for the collector up to `timeout`"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        remaining = (
+            EXPORT_TIMEOUT
+            if deadline is None
+            else min(deadline - time.monotonic(), EXPORT_TIMEOUT)
+        )
+        if remaining <= 0:
+            logger.warning("SpanExporter - no time left to export the last spans")
+            return
+        self._flush_logging_errors(remaining)
+
+
+class Tracer:
+    """
+    Spans over the lifecycle of the messages, with the decision to trace a
+    message taken when its first span starts (head-based sampling). The
+    trace in progress is kept per thread, `current` and `resume` carry it
+    over to another thread.
+    """
+
+    def __init__(self, sample_ratio: float, exporter: SpanExporter) -> None:
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_ratio > 0
+
+    def _current_trace(self) -> Trace | None:
+        return getattr(self._local, "trace", None)
+
+    @contextmanager
+    def trace(
+        self,
+        name: str,
+        attributes: dict[str, Any] | None = None,
+        kind: int = SPAN_KIND_INTERNAL,
+    ) -> Iterator[None]:
+        """Starts a trace with its root span, a span if one is in progress"""
+        if self._current_trace() is not None:
+            with self.span(name, attributes, kind):
+                yield
+            return
+        if not self.enabled:
+            yield
+            return
+
+        trace = (
+            Trace(sampled=True) if random.random() < self.sample_ratio else UNSAMPLED
+        )
+        self._local.trace = trace
+        self._local.span = None
+        try:
+            with self.span(name, attributes, kind):
+                yield
+        finally:
+            self._local.trace = None
+            if trace.sampled:
+                self.exporter.export(trace)
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: dict[str, Any] | None = None,
+        kind: int = SPAN_KIND_INTERNAL,
+    ) -> Iterator[None]:
+        """Times the block, or the decorated function, in the current trace"""
+        trace = self._current_trace()
+        if trace is None or not trace.sampled:
+            yield
+            return
+
+        parent = self._local.span
+        span = Span(name, kind, parent.span_id if parent else "", attributes)
+        self._local.span = span
+        try:
+            yield
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_time = time.time_ns()
+            self._local.span = parent
+            trace.spans.append(span)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        span = getattr(self._local, "span", None)
+        if span is not None:
+            span.attributes[key] = value
+
+    def set_run_id(self, run_id: str | None) -> None:
+        trace = self._current_trace()
+        if trace is not None and trace.sampled:
+            trace.run_id = run_id
+
+    def inject(self, headers: dict[str, Any]) -> None:
+        """Propagates the current span to a destination (W3C Trace Context)"""
+        trace = self._current_trace()
+        span = getattr(self._local, "span", None)
+        if trace is not None and trace.sampled and span is not None:
+            headers["traceparent"] = f"00-{trace.trace_id}-{span.span_id}-01"
+
+    def current(self) -> tuple[Trace, Span | None] | None:
+        trace = self._current_trace()
+        return None if trace is None else (trace, self._local.span)
+
+    def resume(self, current: tuple[Trace, Span | None] | None) -> None:
+        self._local.trace, self._local.span = current or (None, None)
+
+    def start(self) -> None:
+        if self.enabled:
+            self.exporter.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        if self.enabled:
+            self.exporter.stop(timeout)
+
+
+tracer = Tracer(
+    settings.TRACING_SAMPLE_RATIO,
+    SpanExporter(
+        settings.TRACING_EXPORT_PATH,
+        settings.TRACING_EXPORT_ENDPOINT,
+        settings.TRACING_EXPORT_INTERVAL,
+        settings.TRACING_MAX_QUEUED_TRACES,
+        settings.TRACING_SERVICE_NAME,
+    ),
+)
@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
+from typing import Any
 
 
 class BaseInvoker(ABC):
     @abstractmethod
-    def invoke(self, message: dict, destination: dict) -> None:
+    def invoke(self, message: dict, destination: dict) -> Any:
         pass
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+concurrency_limit_gauge = metrics.gauge(
+    "port_agent_destination_concurrency_limit",
+    "Current concurrency limit of webhook requests per destination host",
+)
+in_flight_gauge = metrics.gauge(
+    "port_agent_destination_in_flight",
+    "Webhook requests currently in flight per destination host",
+)
+
+
+class BaseConcurrencyLimiter(ABC):
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.in_flight = 0
+        self._condition = threading.Condition()
+        concurrency_limit_gauge.set_function(lambda: self.limit, host=host)
+        in_flight_gauge.set_function(lambda: self.in_flight, host=host)
+
+    @property
+    @abstractmethod
+    def limit(self) -> float:
+        pass
+
+    def acquire(self, timeout: float) -> bool:
+        with self._condition:
+            acquired = self._condition.wait_for(
+                lambda: self.in_flight < int(self.limit), timeout
+            )
+            if acquired:
+                self.in_flight += 1
+            return acquired
+
+    def release(self, duration: float, failed: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._on_release(duration, failed)
+            self._condition.notify_all()
+
+    def _on_release(self, duration: float, failed: bool) -> None:
+        pass
+
+
+class UnboundedConcurrencyLimiter(BaseConcurrencyLimiter):
+    @property
+    def limit(self) -> float:
+        return float("inf")
+
+    def acquire(self, timeout: float) -> bool:
+        with self._condition:
+            self.in_flight += 1
+        return True
+
+
+class FixedConcurrencyLimiter(BaseConcurrencyLimiter):
+    def __init__(self, host: str, limit: int) -> None:
+        self._limit = limit
+        super().__init__(host)
+
+    @property
+    def limit(self) -> float:
+        return self._limit
+
+
+class AdaptiveConcurrencyLimiter(BaseConcurrencyLimiter):
+    """
+    Additive increase / multiplicative decrease limiter. Every call that stays
+    within the latency target while the error rate is within its target grows
+    the limit by 1/limit, roughly one slot per limit's worth of calls. A
+    timeout, a 429, a 5xx or a latency or error rate above target shrinks the
+    limit by `backoff_ratio`, at most once per latency target so that a single
+    overload episode doesn't collapse the limit to its minimum. The limit only
+    grows while at least half of it is in use, otherwise an idle destination
+    would drift to the max.
+    """
+
+    ERROR_RATE_SMOOTHING = 0.1
+
+    def __init__(
+        self,
+        host: str,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        error_rate_target: float,
+        backoff_ratio: float,
+    ) -> None:
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.error_rate_target = error_rate_target
+        self.backoff_ratio = backoff_ratio
+        self.error_rate = 0.0
+        self._last_decrease = 0.0
+        super().__init__(host)
+
+    @property
+    def limit(self) -> float:
+        return self._limit
+
+    def _on_release(self, duration: float, failed: bool) -> None:
+        self.error_rate += self.ERROR_RATE_SMOOTHING * (float(failed) - self.error_rate)
+        if (
+            failed
+            or duration > self.latency_target
+            or self.error_rate > self.error_rate_target
+        ):
+            now = time.monotonic()
+            if now - self._last_decrease < self.latency_target:
+                return
+            self._last_decrease = now
+            previous = self._limit
+            self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+            logger.info(
+                "AdaptiveConcurrencyLimiter - host: %s, limit: %.1f -> %.1f,"
+                " latency: %.2fs, error_rate: %.2f",
+                self.host,
+                previous,
+                self._limit,
+                duration,
+                self.error_rate,
+            )
+        elif self.in_flight + 1 >= self._limit / 2:
+            self._limit = min(self.max_limit, self._limit + 1 / self._limit)
@@ -0,0 +1,64 @@
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from confluent_kafka import Producer
+from core.config import settings
+from core.kafka import get_kafka_connection_config
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class BaseDeadLetterSink(ABC):
+    @abstractmethod
+    def send(self, record: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FileDeadLetterSink(BaseDeadLetterSink):
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def send(self, record: dict) -> None:
+        line = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class KafkaDeadLetterSink(BaseDeadLetterSink):
+    def __init__(self, topic: str, producer: Producer = None) -> None:
+        self.topic = topic
+        self.producer = producer or Producer(get_kafka_connection_config())
+
+    def send(self, record: dict) -> None:
+        self.producer.produce(
+            self.topic,
+            key=record.get("runId"),
+            value=json.dumps(record, separators=(",", ":"), ensure_ascii=False),
+            on_delivery=self._on_delivery,
+        )
+        self.producer.poll(0)
+
+    @staticmethod
+    def _on_delivery(err: object, msg: object) -> None:
+        if err is not None:
+            logger.error("DeadLetter - failed to deliver record: %s", err)
+
+    def close(self) -> None:
+        self.producer.flush(settings.WEBHOOK_INVOKER_TIMEOUT)
+
+
+def get_dead_letter_sink() -> BaseDeadLetterSink | None:
+    if settings.WEBHOOK_DEAD_LETTER_TOPIC:
+        return KafkaDeadLetterSink(settings.WEBHOOK_DEAD_LETTER_TOPIC)
+    if settings.WEBHOOK_DEAD_LETTER_PATH:
+        return FileDeadLetterSink(settings.WEBHOOK_DEAD_LETTER_PATH)
+    return None
@@ -0,0 +1,329 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from typing import ContextManager, Iterator, TypeVar
+from urllib.parse import urlparse
+
+from core.config import DestinationPolicy, settings
+from core.metrics import metrics
+from invokers.concurrency_limiters import (
+    AdaptiveConcurrencyLimiter,
+    BaseConcurrencyLimiter,
+    FixedConcurrencyLimiter,
+    UnboundedConcurrencyLimiter,
+)
+from utils import is_retryable_status_code
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+class DestinationUnavailableError(Exception):
+    def __init__(self, host: str, reason: str) -> None:
+        super().__init__(f"Destination {host} is unavailable: {reason}")
+        self.host = host
+        self.reason = reason
+
+
+T = TypeVar("T")
+
+
+def _pick(value: T | None, default: T) -> T:
+    return default if value is None else value
+
+
+class CircuitState(str, Enum):
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
+@dataclass(frozen=True)
+class ResolvedDestinationPolicy:
+    max_concurrency: int
+    acquire_timeout: float
+    circuit_breaker_enabled: bool
+    failure_rate_threshold: float
+    slow_call_duration: float
+    slow_call_rate_threshold: float
+    minimum_calls: int
+    window_size: int
+    open_duration: float
+    half_open_max_calls: int
+    adaptive_concurrency: bool
+    latency_target: float
+    error_rate_target: float
+
+    @classmethod
+    def resolve(cls, policy: DestinationPolicy | None) -> "ResolvedDestinationPolicy":
+        policy = policy or DestinationPolicy()
+        return cls(
+            max_concurrency=_pick(
+                policy.maxConcurrency, settings.WEBHOOK_DESTINATION_MAX_CONCURRENCY
+            ),
+            acquire_timeout=_pick(
+                policy.acquireTimeout, settings.WEBHOOK_DESTINATION_ACQUIRE_TIMEOUT
+            ),
+            circuit_breaker_enabled=_pick(
+                policy.circuitBreakerEnabled, settings.WEBHOOK_CIRCUIT_BREAKER_ENABLED
+            ),
+            failure_rate_threshold=_pick(
+                policy.failureRateThreshold,
+                settings.WEBHOOK_CIRCUIT_BREAKER_FAILURE_RATE_THRESHOLD,
+            ),
+            slow_call_duration=_pick(
+                policy.slowCallDuration,
+                settings.WEBHOOK_CIRCUIT_BREAKER_SLOW_CALL_DURATION,
+            ),
+            slow_call_rate_threshold=_pick(
+                policy.slowCallRateThreshold,
+                settings.WEBHOOK_CIRCUIT_BREAKER_SLOW_CALL_RATE_THRESHOLD,
+            ),
+            minimum_calls=_pick(
+                policy.minimumCalls, settings.WEBHOOK_CIRCUIT_BREAKER_MINIMUM_CALLS
+            ),
+            window_size=_pick(
+                policy.windowSize, settings.WEBHOOK_CIRCUIT_BREAKER_WINDOW_SIZE
+            ),
+            open_duration=_pick(
+                policy.openDuration, settings.WEBHOOK_CIRCUIT_BREAKER_OPEN_DURATION
+            ),
+            half_open_max_calls=_pick(
+                policy.halfOpenMaxCalls,
+                settings.WEBHOOK_CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS,
+            ),
+            adaptive_concurrency=_pick(
+                policy.adaptiveConcurrency,
+                settings.WEBHOOK_ADAPTIVE_CONCURRENCY_ENABLED,
+            ),
+            latency_target=_pick(
+                policy.latencyTarget,
+                settings.WEBHOOK_ADAPTIVE_LATENCY_TARGET,  # type: ignore[arg-type]
+            ),
+            error_rate_target=_pick(
+                policy.errorRateTarget, settings.WEBHOOK_ADAPTIVE_ERROR_RATE_TARGET
+            ),
+        )
+
+
+circuit_state_gauge = metrics.gauge(
+    "port_agent_destination_circuit_state",
+    "Circuit breaker state per destination host (0 closed, 1 half-open, 2 open)",
+)
+CIRCUIT_STATE_VALUES = {
+    CircuitState.CLOSED: 0,
+    CircuitState.HALF_OPEN: 1,
+    CircuitState.OPEN: 2,
+}
+
+
+class CircuitBreaker:
+    """
+    Count based sliding window breaker. The circuit opens when either the
+    failure rate or the slow call rate of the last `window_size` calls crosses
+    its threshold, rejects calls for `open_duration` seconds and then lets up to
+    `half_open_max_calls` trial calls through before deciding to close again.
+    """
+
+    def __init__(self, host: str, policy: ResolvedDestinationPolicy) -> None:
+        self.host = host
+        self.policy = policy
+        self.state = CircuitState.CLOSED
+        self._lock = threading.Lock()
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=policy.window_size)
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+    def before_call(self) -> None:
+        if not self.policy.circuit_breaker_enabled:
+            return
+
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                remaining = (
+                    self._opened_at + self.policy.open_duration - (time.monotonic())
+                )
+                if remaining > 0:
+                    raise DestinationUnavailableError(
+                        self.host,
+                        f"circuit breaker is open, retrying in {remaining:.0f}s",
+                    )
+                self._transition(CircuitState.HALF_OPEN)
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self._half_open_in_flight >= self.policy.half_open_max_calls:
+                    raise DestinationUnavailableError(
+                        self.host, "circuit breaker is half-open and probing"
+                    )
+                self._half_open_in_flight += 1
+
+    def cancel(self) -> None:
+        """Give back the half-open probe slot of a call that never started"""
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+
+    def record(self, failed: bool, duration: float) -> None:
+        if not self.policy.circuit_breaker_enabled:
+            return
+
+        slow = duration >= self.policy.slow_call_duration
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+                if failed or slow:
+                    self._open()
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self.policy.half_open_max_calls:
+                    self._transition(CircuitState.CLOSED)
+                return
+
+            if self.state == CircuitState.OPEN:
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.policy.minimum_calls:
+                return
+            failure_rate = sum(outcome[0] for outcome in self._outcomes) / calls
+            slow_rate = sum(outcome[1] for outcome in self._outcomes) / calls
+            if (
+                failure_rate >= self.policy.failure_rate_threshold
+                or slow_rate >= self.policy.slow_call_rate_threshold
+            ):
+                logger.warning(
+                    "CircuitBreaker - host: %s, failure_rate: %.2f, slow_rate: %.2f",
+                    self.host,
+                    failure_rate,
+                    slow_rate,
+                )
+                self._open()
+
+    def _open(self) -> None:
+        self._opened_at = time.monotonic()
+        self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState) -> None:
+        logger.info(
+            "CircuitBreaker - host: %s, state: %s -> %s",
+            self.host,
+            self.state.value,
+            state.value,
+        )
+        self.state = state
+        circuit_state_gauge.set(CIRCUIT_STATE_VALUES[state], host=self.host)
+        self._outcomes.clear()
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+
+
+class DestinationCall:
+    def __init__(self) -> None:
+        self.failed = False
+
+    def record_status(self, ok: bool, status_code: int) -> None:
+        # Client errors are the caller's fault and say nothing about the
+        # destination's health, only throttling and server errors count
+        self.failed = not ok and is_retryable_status_code(status_code)
+
+
+class DestinationGuard:
+    def __init__(self, host: str, policy: ResolvedDestinationPolicy) -> None:
+        self.host = host
+        self.policy = policy
+        self.breaker = CircuitBreaker(host, policy)
+        self.limiter = self._create_limiter(host, policy)
+
+    @staticmethod
+    def _create_limiter(
+        host: str, policy: ResolvedDestinationPolicy
+    ) -> BaseConcurrencyLimiter:
+        if policy.adaptive_concurrency:
+            return AdaptiveConcurrencyLimiter(
+                host,
+                initial_limit=settings.WEBHOOK_ADAPTIVE_INITIAL_CONCURRENCY,
+                min_limit=settings.WEBHOOK_ADAPTIVE_MIN_CONCURRENCY,
+                max_limit=policy.max_concurrency
+                or settings.WEBHOOK_ADAPTIVE_MAX_CONCURRENCY,
+                latency_target=policy.latency_target,
+                error_rate_target=policy.error_rate_target,
+                backoff_ratio=settings.WEBHOOK_ADAPTIVE_BACKOFF_RATIO,
+            )
+        if policy.max_concurrency > 0:
+            return FixedConcurrencyLimiter(host, policy.max_concurrency)
+        return UnboundedConcurrencyLimiter(host)
+
+    @contextmanager
+    def acquire(self) -> Iterator[DestinationCall]:
+        self.breaker.before_call()
+        if not self.limiter.acquire(self.policy.acquire_timeout):
+            self.breaker.cancel()
+            raise DestinationUnavailableError(
+                self.host,
+                f"max concurrency of {int(self.limiter.limit)} reached",
+            )
+
+        call = DestinationCall()
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            duration = time.monotonic() - start
+            self.limiter.release(duration, call.failed)
+            self.breaker.record(call.failed, duration)
+
+
+class DestinationControls:
+    """
+    One guard per destination host, so every mapping that calls a host shares
+    its concurrency limit and circuit breaker. The first mapping to call a host
+    decides its policy, mappings with a different policy for the same host are
+    logged once and use the existing guard.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._guards: dict[str, DestinationGuard] = {}
+        self._conflicts: set[tuple[str, ResolvedDestinationPolicy]] = set()
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    def get_guard(
+        self, url: str, policy: DestinationPolicy | None = None
+    ) -> DestinationGuard:
+        host = self.get_host(url)
+        resolved = ResolvedDestinationPolicy.resolve(policy)
+        with self._lock:
+            guard = self._guards.get(host)
+            if guard is None:
+                guard = DestinationGuard(host, resolved)
+                self._guards[host] = guard
+            elif guard.policy != resolved and (host, resolved) not in self._conflicts:
+                self._conflicts.add((host, resolved))
+                logger.warning(
+                    "DestinationControls - conflicting policy, using the first one"
+                    " - host: %s, policy: %s, used: %s",
+                    host,
+                    resolved,
+                    guard.policy,
+                )
+            return guard
+
+    def guard(
+        self, url: str, policy: DestinationPolicy | None = None
+    ) -> ContextManager[DestinationCall]:
+        return self.get_guard(url, policy).acquire()
+
+
+destination_controls = DestinationControls()
@@ -0,0 +1,180 @@
+import functools
+import threading
+from typing import Any, Callable
+
+import h2.config
+import h2.connection
+import h2.exceptions
+import httpcore
+import httpx
+
+# Largest stream id of a connection, RFC 9113 section 5.1.1
+MAX_STREAM_ID = 2**31 - 1
+
+
+def _locked(method: Callable) -> Callable:
+    @functools.wraps(method)
+    def locked(self: "LockedH2Connection", *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return locked
+
+
+class LockedH2Connection(h2.connection.H2Connection):
+    """
+    httpcore's sync HTTP/2 connection uses the h2 state from the thread of
+    every request without a common lock. Streams could open out of order:
+    a stream's id is picked and its headers are sent in separate calls, so
+    concurrent requests can send the headers of a higher stream first.
+    Frames could also be lost, when a frame is added to the outgoing
+    buffer while another thread takes it. Both are protocol errors for the
+    server, which then fails every stream of the connection.
+
+    Here every change to the state is made under a lock, stream ids are
+    reserved in order, and the headers of a stream are only sent once the
+    lower streams sent theirs or were closed. The protocol allows the gaps
+    of streams that were closed before they opened.
+    """
+
+    def __init__(self, config: h2.config.H2Configuration) -> None:
+        self._lock = threading.RLock()
+        self._opening = threading.Condition()
+        self._next_stream_id = 1
+        # Reserved streams whose headers weren't sent yet
+        self._unopened: set[int] = set()
+        super().__init__(config=config)
+
+    def get_next_available_stream_id(self) -> int:
+        with self._opening:
+            stream_id = self._next_stream_id
+            if stream_id > MAX_STREAM_ID:
+                raise h2.exceptions.NoAvailableStreamIDError()
+            self._next_stream_id += 2
+            self._unopened.add(stream_id)
+            return stream_id
+
+    def release_stream_id(self, stream_id: int) -> None:
+        with self._opening:
+            self._unopened.discard(stream_id)
+            self._opening.notify_all()
+
+    def send_headers(self, stream_id: int, *args: Any, **kwargs: Any) -> None:
+        with self._opening:
+            self._opening.wait_for(
+                lambda: stream_id not in self._unopened
+                or min(self._unopened) == stream_id
+            )
+        try:
+            with self._lock:
+                super().send_headers(stream_id, *args, **kwargs)
+        finally:
+            self.release_stream_id(stream_id)
+
+    send_data = _locked(h2.connection.H2Connection.send_data)
+    end_stream = _locked(h2.connection.H2Connection.end_stream)
+    receive_data = _locked(h2.connection.H2Connection.receive_data)
+    data_to_send = _locked(h2.connection.H2Connection.data_to_send)
+    initiate_connection = _locked(h2.connection.H2Connection.initiate_connection)
+    close_connection = _locked(h2.connection.H2Connection.close_connection)
+    increment_flow_control_window = _locked(
+        h2.connection.H2Connection.increment_flow_control_window
+    )
+    acknowledge_received_data = _locked(
+        h2.connection.H2Connection.acknowledge_received_data
+    )
+    local_flow_control_window = _locked(
+        h2.connection.H2Connection.local_flow_control_window
+    )
+
+
+class OrderedHTTP2Connection(httpcore.HTTP2Connection):
+    """httpcore's HTTP/2 connection with the state of LockedH2Connection"""
+
+    _h2_state: LockedH2Connection
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._h2_state = LockedH2Connection(config=self.CONFIG)
+
+    def _response_closed(self, stream_id: int) -> None:
+        # Gives up the turn of a stream that failed before its headers
+        self._h2_state.release_stream_id(stream_id)
+        super()._response_closed(stream_id)
+
+
+class OrderedHTTPConnection(httpcore.HTTPConnection):
+    """httpcore's HTTPConnection, using OrderedHTTP2Connection for HTTP/2"""
+
+    def handle_request(self, request: httpcore.Request) -> httpcore.Response:
+        if not self.can_handle_request(request.url.origin):
+            raise RuntimeError(
+                f"Attempted to send request to {request.url.origin!r}"
+                f" on connection to {self._origin!r}"
+            )
+
+        try:
+            with self._request_lock:
+                if self._connection is None:
+                    stream = self._connect(request)
+                    ssl_object = stream.get_extra_info("ssl_object")
+                    http2_negotiated = (
+                        ssl_object is not None
+                        and ssl_object.selected_alpn_protocol() == "h2"
+                    )
+                    if http2_negotiated or (self._http2 and not self._http1):
+                        self._connection = OrderedHTTP2Connection(
+                            origin=self._origin,
+                            stream=stream,
+                            keepalive_expiry=self._keepalive_expiry,
+                        )
+                    else:
+                        self._connection = httpcore.HTTP11Connection(
+                            origin=self._origin,
+                            stream=stream,
+                            keepalive_expiry=self._keepalive_expiry,
+                        )
+        except BaseException:
+            self._connect_failed = True
+            raise
+
+        return self._connection.handle_request(request)
+
+
+class OrderedConnectionPool(httpcore.ConnectionPool):
+    def create_connection(self, origin: httpcore.Origin) -> Any:
+        if self._proxy is not None:
+            return super().create_connection(origin)
+        return OrderedHTTPConnection(
+            origin=origin,
+            ssl_context=self._ssl_context,
+            keepalive_expiry=self._keepalive_expiry,
+            http1=self._http1,
+            http2=self._http2,
+            retries=self._retries,
+            local_address=self._local_address,
+            uds=self._uds,
+            network_backend=self._network_backend,
+            socket_options=self._socket_options,
+        )
+
+
+class OrderedHTTPTransport(httpx.HTTPTransport):
+    """httpx's transport with the connection pool of OrderedHTTPConnection"""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        pool = self._pool
+        self._pool = OrderedConnectionPool(
+            ssl_context=pool._ssl_context,
+            max_connections=pool._max_connections,
+            max_keepalive_connections=pool._max_keepalive_connections,
+            keepalive_expiry=pool._keepalive_expiry,
+            http1=pool._http1,
+            http2=pool._http2,
+            retries=pool._retries,
+            local_address=pool._local_address,
+            uds=pool._uds,
+            network_backend=pool._network_backend,
+            socket_options=pool._socket_options,
+        )
@@ -0,0 +1,137 @@
+import logging
+import threading
+from typing import Any
+from urllib.parse import urlparse
+
+import requests
+from core.config import settings
+from core.metrics import metrics
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_environ_proxies
+from utils import read_capped, set_response_truncated
+
+try:
+    import httpx
+    from invokers.http2_connection import OrderedHTTPTransport
+except ImportError:  # pragma: no cover - httpx is the optional http2 extra
+    httpx = None  # type: ignore[assignment]
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+http_version_counter = metrics.counter(
+    "port_agent_http2_transport_requests_total",
+    "Requests sent with the HTTP/2 transport per negotiated HTTP version",
+)
+
+
+class Http2Transport:
+    """
+    Sends webhooks over a shared httpx client with HTTP/2 enabled, so the
+    requests to a host are multiplexed over one connection. HTTP/2 is
+    negotiated with ALPN, hosts that don't support it fall back to
+    HTTP/1.1 on the same client. The responses are converted to requests
+    responses so they are reported the same way. The connections are the
+    ones of invokers.http2_connection, which open the streams of concurrent
+    requests in order. URLs with a proxy in the environment are left to
+    requests, the transport doesn't use proxies.
+    """
+
+    def __init__(self, hosts: list[str], max_connections: int) -> None:
+        self.hosts = {host.lower() for host in hosts}
+        self.max_connections = max_connections
+        self._client: Any = None
+        self._lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def available(self) -> bool:
+        return httpx is not None
+
+    def is_enabled(self, url: str, http2: bool | None = None) -> bool:
+        """A mapping's `http2` wins over the WEBHOOK_HTTP2_HOSTS list"""
+        if http2 is None:
+            parsed = urlparse(url)
+            http2 = bool(self.hosts) and (
+                parsed.netloc.lower() in self.hosts
+                or (parsed.hostname or "") in self.hosts
+            )
+        if http2 and not self.available:
+            if not self._warned:
+                self._warned = True
+                logger.warning(
+                    "Http2Transport - httpx isn't installed, install the http2"
+                    " extra to use HTTP/2, falling back to HTTP/1.1"
+                )
+            return False
+        if http2 and get_environ_proxies(url):
+            return False
+        return http2
+
+    @property
+    def client(self) -> Any:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    transport=OrderedHTTPTransport(
+                        http2=True,
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections,
+                        ),
+                    )
+                )
+            return self._client
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        json: Any,
+        headers: dict,
+        params: dict,
+        timeout: float,
+        max_size: int = 0,
+    ) -> Response:
+        try:
+            # requests follows redirects by default, httpx doesn't
+            with self.client.stream(
+                method,
+                url,
+                json=json,
+                headers=headers,
+                params=params,
+                timeout=timeout,
+                follow_redirects=True,
+            ) as res:
+                content, truncated = read_capped(res.iter_bytes(), max_size)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e)) from e
+
+        http_version_counter.inc(http_version=res.http_version)
+        response = Response()
+        response.status_code = res.status_code
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.url = str(res.url)
+        response.reason = res.reason_phrase
+        response.encoding = res.charset_encoding
+        response._content = content
+        if truncated:
+            set_response_truncated(response)
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+http2_transport = Http2Transport(
+    settings.WEBHOOK_HTTP2_HOSTS, settings.WEBHOOK_HTTP2_MAX_CONNECTIONS
+)
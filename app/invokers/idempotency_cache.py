@@ -0,0 +1,110 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Expired rows are removed from the on-disk index every this many additions
+PRUNE_INTERVAL = 1000
+
+duplicates_counter = metrics.counter(
+    "port_agent_duplicate_messages_total",
+    "Messages skipped because they were already processed",
+)
+
+
+class IdempotencyCache:
+    """
+    Keys of already processed messages, kept for `ttl` seconds. Lookups are
+    served from a bounded in-memory LRU, and when a database path is set the
+    keys are also written to a SQLite index so that messages replayed after
+    a restart are recognized too. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, path: Path | None = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._additions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _connection(self) -> sqlite3.Connection | None:
+        if self._db is None and self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed"
+                " (key TEXT PRIMARY KEY, expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+        return self._db
+
+    def _remember(self, key: str, expires_at: float) -> None:
+        self._entries[key] = expires_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        if not self.enabled:
+            return False
+
+        now = time.time()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None and (db := self._connection()):
+                row = db.execute(
+                    "SELECT expires_at FROM processed WHERE key = ?", (key,)
+                ).fetchone()
+                expires_at = row[0] if row else None
+
+            if expires_at is None or expires_at <= now:
+                self._entries.pop(key, None)
+                return False
+            self._remember(key, expires_at)
+            return True
+
+    def add(self, key: str) -> None:
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._remember(key, now + self.ttl)
+            if db := self._connection():
+                db.execute(
+                    "INSERT OR REPLACE INTO processed (key, expires_at) VALUES (?, ?)",
+                    (key, now + self.ttl),
+                )
+                self._additions += 1
+                if self._additions % PRUNE_INTERVAL == 0:
+                    db.execute("DELETE FROM processed WHERE expires_at <= ?", (now,))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+idempotency_cache = IdempotencyCache(
+    ttl=settings.WEBHOOK_IDEMPOTENCY_TTL,
+    max_entries=settings.WEBHOOK_IDEMPOTENCY_MAX_ENTRIES,
+    path=settings.WEBHOOK_IDEMPOTENCY_DB_PATH,
+)
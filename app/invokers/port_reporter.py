@@ -0,0 +1,166 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from core.config import settings
+from core.flight_recorder import flight_recorder
+from core.tracing import tracer
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def _copy_outcome(source: Future, target: Future) -> None:
+    if (error := source.exception()) is not None:
+        target.set_exception(error)
+    else:
+        target.set_result(source.result())
+
+
+class ReportGroup:
+    """
+    The Port updates of a run. They are sent concurrently, an update can be
+    ordered `after` another one, and the run logs are kept in order between
+    themselves. Without an executor every update is sent inline. An update
+    that logs to the run should log inline, with the base run logger, as a
+    barrier doesn't cover the updates submitted after it was taken.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor | None) -> None:
+        self.executor = executor
+        # The updates are timed into the flight record and the trace of the
+        # run's message
+        self._flight_record = flight_recorder.current()
+        self._trace = tracer.current()
+        self._futures: list[Future] = []
+        self._last_log: Future | None = None
+        self._lock = threading.Lock()
+
+    def _start(self, fn: Callable[..., Any], *args: Any) -> Future:
+        if self.executor:
+            return self.executor.submit(self._run, fn, *args)
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        flight_recorder.resume(self._flight_record)
+        tracer.resume(self._trace)
+        try:
+            return fn(*args)
+        finally:
+            flight_recorder.resume(None)
+            tracer.resume(None)
+
+    def submit(
+        self, fn: Callable[..., Any], *args: Any, after: Future | None = None
+    ) -> Future:
+        if after is None:
+            future = self._start(fn, *args)
+        else:
+            future = Future()
+            after.add_done_callback(
+                lambda _: self._start(fn, *args).add_done_callback(
+                    lambda done: _copy_outcome(done, future)
+                )
+            )
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def barrier(self) -> Future:
+        """A future that is done once every update sent so far is done"""
+        with self._lock:
+            pending = list(self._futures)
+        barrier: Future = Future()
+        remaining = [len(pending)]
+        remaining_lock = threading.Lock()
+
+        def done(_: Future) -> None:
+            with remaining_lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                barrier.set_result(None)
+
+        if not pending:
+            barrier.set_result(None)
+        for future in pending:
+            future.add_done_callback(done)
+        return barrier
+
+    def run_logger(self, run_logger: Callable[[str], None]) -> Callable[[str], None]:
+        def send(message: str) -> None:
+            with self._lock:
+                after = self._last_log
+            log = self.submit(run_logger, message, after=after)
+            with self._lock:
+                self._last_log = log
+
+        return send
+
+    def wait(self) -> None:
+        """
+        Waits for every update, including the ones submitted meanwhile by
+        the updates, raising the first failure
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                futures = list(self._futures)
+            if len(futures) == waited:
+                break
+            for future in futures[waited:]:
+                future.exception()
+            waited = len(futures)
+        for future in futures:
+            if (error := future.exception()) is not None:
+                raise error
+
+
+class PortReporter:
+    """Worker pool shared by the report groups of the runs"""
+
+    def __init__(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor | None:
+        if not self.concurrency:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="port-reporter"
+                )
+            return self._executor
+
+    @contextmanager
+    def group(self) -> Iterator[ReportGroup]:
+        """Waits for the run's updates on exit"""
+        reports = ReportGroup(self.executor)
+        try:
+            yield reports
+        except BaseException:
+            try:
+                reports.wait()
+            except Exception as e:
+                logger.error("PortReporter - failed to report to Port: %s", e)
+            raise
+        reports.wait()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+port_reporter = PortReporter(settings.PORT_REPORT_CONCURRENCY)
@@ -0,0 +1,167 @@
+import functools
+import importlib
+import json
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from importlib.metadata import entry_points
+from typing import Any, Callable
+
+from core.config import settings
+from core.metrics import metrics
+from invokers.base_invoker import BaseInvoker
+from requests import Response
+from utils import set_response_json
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+HANDLERS_ENTRY_POINT_GROUP = "port_agent.handlers"
+
+handler_calls_counter = metrics.counter(
+    "port_agent_python_handler_calls_total", "Python handler calls per outcome"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_handler(spec: str) -> Callable[[dict], Any]:
+    """
+    Resolves `module:function`, or the name of an entry point in the
+    `port_agent.handlers` group
+    """
+    if ":" in spec:
+        module_name, _, attribute = spec.partition(":")
+        handler = importlib.import_module(module_name)
+        for name in attribute.split("."):
+            handler = getattr(handler, name)
+    else:
+        matches = entry_points(group=HANDLERS_ENTRY_POINT_GROUP, name=spec)
+        if not matches:
+            raise ValueError(f"No {HANDLERS_ENTRY_POINT_GROUP} entry point {spec!r}")
+        handler = next(iter(matches)).load()
+    if not callable(handler):
+        raise ValueError(f"Handler {spec!r} is not callable")
+    return handler
+
+
+def to_response(spec: str, status_code: int, result: Any) -> Response:
+    """
+    A handler's result as an HTTP response, so it's reported the same way.
+    A handler can return a Response to set the status code itself.
+    """
+    if isinstance(result, Response):
+        return result
+    response = Response()
+    response.status_code = status_code
+    response.url = f"python:{spec}"
+    response.encoding = "utf-8"
+    if isinstance(result, str):
+        response._content = result.encode("utf-8")
+        response.headers["Content-Type"] = "text/plain"
+    elif result is not None:
+        response._content = json.dumps(result, default=str).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+        set_response_json(response, result)
+    else:
+        response._content = b""
+    return response
+
+
+class PythonHandlerInvoker(BaseInvoker):
+    """
+    Calls a Python handler that lives in the agent's process instead of
+    sending the request over HTTP. The handler gets the prepared request
+    payload (method, url, body, headers and query) and runs on a worker
+    pool, bounded by WEBHOOK_INVOKER_TIMEOUT. An exception is a 500
+    response, retried and reported like a failed webhook.
+
+    A handler can't be interrupted, one that times out keeps its worker
+    until it returns. The timeout is a 408 which isn't retried, as a retry
+    would run the handler again while it's still running. A handler that
+    timed out before it started is a 503 and is retried. Once the stuck
+    handlers take all the workers, new calls are refused with a 503.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._stuck = 0
+
+    def stuck(self) -> int:
+        """The handlers still running after they timed out"""
+        with self._lock:
+            return self._stuck
+
+    def _on_stuck_done(self, _: Future) -> None:
+        with self._lock:
+            self._stuck -= 1
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="python-handler"
+                )
+            return self._executor
+
+    def invoke(self, message: dict, destination: dict) -> Response:
+        spec = destination["handler"]
+        try:
+            handler = load_handler(spec)
+        except (ImportError, AttributeError, ValueError) as e:
+            logger.error("PythonHandlerInvoker - load - handler: %s, %s", spec, e)
+            handler_calls_counter.inc(handler=spec, outcome="load_error")
+            return to_response(spec, 500, f"Failed to load the handler: {e}")
+
+        if self.stuck() >= self.max_workers:
+            logger.error(
+                "PythonHandlerInvoker - refused, all the workers are stuck"
+                " - handler: %s",
+                spec,
+            )
+            handler_calls_counter.inc(handler=spec, outcome="refused")
+            return to_response(spec, 503, "All the handler workers are stuck")
+
+        future = self.executor.submit(handler, message)
+        try:
+            result = future.result(timeout=settings.WEBHOOK_INVOKER_TIMEOUT)
+        except FutureTimeoutError:
+            if future.cancel():
+                logger.warning(
+                    "PythonHandlerInvoker - no free worker - handler: %s, after: %ss",
+                    spec,
+                    settings.WEBHOOK_INVOKER_TIMEOUT,
+                )
+                handler_calls_counter.inc(handler=spec, outcome="queue_timeout")
+                return to_response(spec, 503, "No handler worker was free")
+            logger.warning(
+                "PythonHandlerInvoker - timeout - handler: %s, after: %ss",
+                spec,
+                settings.WEBHOOK_INVOKER_TIMEOUT,
+            )
+            handler_calls_counter.inc(handler=spec, outcome="timeout")
+            with self._lock:
+                self._stuck += 1
+            future.add_done_callback(self._on_stuck_done)
+            return to_response(spec, 408, "The handler timed out")
+        except Exception as e:
+            logger.exception("PythonHandlerInvoker - error - handler: %s", spec)
+            handler_calls_counter.inc(handler=spec, outcome="error")
+            return to_response(spec, 500, f"The handler failed: {e}")
+
+        handler_calls_counter.inc(handler=spec, outcome="success")
+        return to_response(spec, 200, result)
+
+    def stop(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+python_handler_invoker = PythonHandlerInvoker(settings.PYTHON_HANDLER_WORKERS)
+metrics.gauge(
+    "port_agent_python_handler_stuck_workers",
+    "Handler workers still running a handler that timed out",
+).set_function(python_handler_invoker.stuck)
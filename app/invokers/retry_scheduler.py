@@ -0,0 +1,251 @@
+import heapq
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from core.config import settings
+from core.metrics import metrics
+from invokers.dead_letter import BaseDeadLetterSink, get_dead_letter_sink
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetryTask:
+    msg: dict
+    invocation_method: dict
+    # The attempt number the task will run as once it is due
+    attempt: int
+    due: float
+    error: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    @property
+    def run_id(self) -> str | None:
+        return self.msg.get("context", {}).get("runId")
+
+
+class RetryScheduler:
+    """
+    Delay queue for failed invocations. Tasks wait on a heap ordered by their
+    due time and are handed back to the invoker from a background thread, so
+    the consumer keeps processing while they wait. When a queue path is
+    configured every parked task is also written to its own file, which is
+    removed once the task was handed over, and reloaded on start.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        max_queue_size: int,
+        queue_path: Path | None = None,
+        dead_letter_sink: BaseDeadLetterSink | None = None,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_queue_size = max_queue_size
+        self.queue_path = queue_path
+        self._dead_letter_sink = dead_letter_sink
+        self._dead_letter_sink_resolved = dead_letter_sink is not None
+        self._heap: list[tuple[float, int, RetryTask]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._handler: Callable[[RetryTask], None] | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_attempts > 1
+
+    @property
+    def dead_letter_sink(self) -> BaseDeadLetterSink | None:
+        if not self._dead_letter_sink_resolved:
+            self._dead_letter_sink = get_dead_letter_sink()
+            self._dead_letter_sink_resolved = True
+        return self._dead_letter_sink
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._heap)
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with equal jitter for the given failed attempt"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(
+        self, msg: dict, invocation_method: dict, attempt: int, error: str
+    ) -> bool:
+        """
+        Park a failed attempt for a later retry. Returns False when the task
+        won't be retried, in which case it has been sent to the dead letter
+        sink and the caller should report the final outcome.
+        """
+        if attempt >= self.max_attempts:
+            self.dead_letter(msg, invocation_method, attempt, error)
+            return False
+
+        task = RetryTask(
+            msg=msg,
+            invocation_method=invocation_method,
+            attempt=attempt + 1,
+            due=time.time() + self.backoff(attempt),
+            error=error,
+        )
+        with self._condition:
+            if len(self._heap) >= self.max_queue_size:
+                logger.warning(
+                    "RetryScheduler - queue is full - size: %d", len(self._heap)
+                )
+                full = True
+            else:
+                full = False
+                self._push(task)
+                self._persist(task)
+                self._condition.notify()
+
+        if full:
+            self.dead_letter(
+                msg, invocation_method, attempt, f"{error} (retry queue is full)"
+            )
+            return False
+
+        logger.info(
+            "RetryScheduler - scheduled - run_id: %s, attempt: %d, in: %.1fs",
+            task.run_id,
+            task.attempt,
+            task.due - time.time(),
+        )
+        return True
+
+    def dead_letter(
+        self, msg: dict, invocation_method: dict, attempts: int, error: str
+    ) -> None:
+        sink = self.dead_letter_sink
+        if sink is None:
+            return
+        record = {
+            "runId": msg.get("context", {}).get("runId"),
+            "attempts": attempts,
+            "error": error,
+            "failedAt": int(time.time()),
+            "invocationMethod": invocation_method,
+            "message": msg,
+        }
+        try:
+            sink.send(record)
+        except Exception as e:
+            logger.error(
+                "RetryScheduler - failed to dead letter - run_id: %s, error: %s",
+                record["runId"],
+                e,
+            )
+
+    def start(self, handler: Callable[[RetryTask], None]) -> None:
+        self._handler = handler
+        self._load_persisted()
+        self._thread = threading.Thread(
+            target=self._run, name="retry-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Waits up to `timeout` for the retry being run to finish"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("RetryScheduler - stopped while a retry was running")
+        if self.pending():
+            logger.info(
+                "RetryScheduler - stopped with %d pending retries%s",
+                self.pending(),
+                "" if self.queue_path else " which are lost",
+            )
+        if self._dead_letter_sink:
+            self._dead_letter_sink.close()
+
+    def _push(self, task: RetryTask) -> None:
+        heapq.heappush(self._heap, (task.due, next(self._counter), task))
+
+    def _next_due_task(self) -> RetryTask | None:
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._condition.wait(timeout)
+            return None
+
+    def _run(self) -> None:
+        assert self._handler is not None
+        while task := self._next_due_task():
+            try:
+                self._handler(task)
+            except Exception as e:
+                logger.error(
+                    "RetryScheduler - retry failed - run_id: %s, attempt: %d, %s",
+                    task.run_id,
+                    task.attempt,
+                    e,
+                )
+            finally:
+                self._unpersist(task)
+
+    def _task_file(self, task: RetryTask) -> Path:
+        assert self.queue_path is not None
+        return self.queue_path / f"{task.id}.json"
+
+    def _persist(self, task: RetryTask) -> None:
+        if not self.queue_path:
+            return
+        self.queue_path.mkdir(parents=True, exist_ok=True)
+        tmp_file = self._task_file(task).with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(asdict(task)), encoding="utf-8")
+        tmp_file.replace(self._task_file(task))
+
+    def _unpersist(self, task: RetryTask) -> None:
+        if self.queue_path:
+            self._task_file(task).unlink(missing_ok=True)
+
+    def _load_persisted(self) -> None:
+        if not self.queue_path or not self.queue_path.is_dir():
+            return
+        with self._condition:
+            for task_file in self.queue_path.glob("*.json"):
+                try:
+                    task = RetryTask(**json.loads(task_file.read_text("utf-8")))
+                except (ValueError, TypeError) as e:
+                    logger.warning(
+                        "RetryScheduler - skipping corrupt task %s: %s", task_file, e
+                    )
+                    continue
+                self._push(task)
+            logger.info("RetryScheduler - loaded %d pending retries", len(self._heap))
+
+
+retry_scheduler = RetryScheduler(
+    max_attempts=settings.WEBHOOK_RETRY_MAX_ATTEMPTS,
+    base_delay=settings.WEBHOOK_RETRY_BASE_DELAY,
+    max_delay=settings.WEBHOOK_RETRY_MAX_DELAY,
+    max_queue_size=settings.WEBHOOK_RETRY_MAX_QUEUE_SIZE,
+    queue_path=settings.WEBHOOK_RETRY_QUEUE_PATH,
+)
+metrics.gauge(
+    "port_agent_webhook_retry_queue_size", "Failed invocations waiting for a retry"
+).set_function(retry_scheduler.pending)
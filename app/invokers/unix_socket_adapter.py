@@ -0,0 +1,112 @@
+import logging
+import socket
+import threading
+from typing import Any
+from urllib.parse import quote, unquote, urlparse
+
+import requests
+from core.config import settings
+from requests import PreparedRequest
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+HTTP_UNIX_SCHEME = "http+unix"
+UNIX_SCHEME = "unix"
+
+
+def to_unix_socket_url(url: str) -> str | None:
+    """
+    The `http+unix://` form of a URL to a unix socket, None for other URLs.
+    The socket path is the percent-encoded host, `http+unix://%2Frun%2Fapp.sock
+    /path`, or for `unix://` it's separated from the path by a colon, the
+    same as nginx: `unix:///run/app.sock:/path`.
+    """
+    scheme, _, rest = url.partition("://")
+    scheme = scheme.lower()
+    if scheme == HTTP_UNIX_SCHEME:
+        return url
+    if scheme != UNIX_SCHEME:
+        return None
+    socket_path, _, path = rest.partition(":")
+    return f"{HTTP_UNIX_SCHEME}://{quote(socket_path, safe='')}{path or '/'}"
+
+
+class UnixSocketConnection(HTTPConnection):
+    def __init__(self, *args: Any, socket_path: str, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixSocketConnection
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+    Sends `http+unix://` requests over a pool of keep-alive connections per
+    socket, the pools are sized like the adapter's host pools
+    """
+
+    def __init__(self, pool_maxsize: int = 10, pool_block: bool = False) -> None:
+        super().__init__(pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._pools: dict[str, UnixSocketConnectionPool] = {}
+        self._pools_lock = threading.Lock()
+
+    def _get_pool(self, url: str) -> UnixSocketConnectionPool:
+        socket_path = unquote(urlparse(url).netloc)
+        with self._pools_lock:
+            pool = self._pools.get(socket_path)
+            if pool is None:
+                pool = self._pools[socket_path] = UnixSocketConnectionPool(
+                    "localhost",
+                    maxsize=self.pool_maxsize,
+                    block=self.pool_block,
+                    socket_path=socket_path,
+                )
+            return pool
+
+    def get_connection_with_tls_context(
+        self,
+        request: PreparedRequest,
+        verify: Any,
+        proxies: Any = None,
+        cert: Any = None,
+    ) -> HTTPConnectionPool:
+        return self._get_pool(request.url or "")
+
+    def get_connection(self, url: Any, proxies: Any = None) -> HTTPConnectionPool:
+        return self._get_pool(url)
+
+    def close(self) -> None:
+        super().close()
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+def create_unix_socket_session() -> requests.Session:
+    session = requests.Session()
+    # Proxies from the environment don't apply to local sockets
+    session.trust_env = False
+    session.mount(f"{HTTP_UNIX_SCHEME}://", UnixSocketAdapter())
+    return session
+
+
+unix_socket_session = create_unix_socket_session()
@@ -1,21 +1,51 @@
 import json
 import logging
 import time
+from copy import deepcopy
 from typing import Any, Callable
 
-import pyjq as jq
 import requests
-from core.config import Mapping, control_the_payload_config, settings
+from core.config import (
+    DestinationPolicy,
+    Mapping,
+    control_the_payload_config,
+    settings,
+)
 from core.consts import consts
+from core.flight_recorder import flight_recorder
+from core.metrics import metrics
+from core.profiler import profiler
+from core.secret_registry import secret_registry
+from core.tracing import SPAN_KIND_CLIENT, tracer
 from flatten_dict import flatten, unflatten
 from invokers.base_invoker import BaseInvoker
+from invokers.destination_controls import (
+    DestinationUnavailableError,
+    destination_controls,
+)
+from invokers.http2_transport import http2_transport
+from invokers.idempotency_cache import duplicates_counter, idempotency_cache
+from invokers.port_reporter import port_reporter
+from invokers.python_handler_invoker import python_handler_invoker
+from invokers.retry_scheduler import RetryTask, retry_scheduler
+from invokers.unix_socket_adapter import to_unix_socket_url, unix_socket_session
 from port_client import report_run_response, report_run_status, run_logger_factory
+from port_spool import port_spool
 from pydantic import BaseModel, Field
-from requests import Response
+from requests import RequestException, Response
 from utils import (
+    compile_jq,
     decrypt_payload_fields,
     get_invocation_method_object,
+    get_jq_expressions,
     get_response_body,
+    get_response_fields,
+    get_response_preview,
+    get_response_size,
+    get_run_created_at,
+    is_response_truncated,
+    is_retryable_status_code,
+    read_response_body,
     response_to_dict,
     sign_sha_256,
 )
@@ -23,11 +53,20 @@ from utils import (
 logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+truncated_responses_counter = metrics.counter(
+    "port_agent_truncated_responses_total",
+    "Webhook responses cut at the maximum response size",
+)
+expired_runs_counter = metrics.counter(
+    "port_agent_expired_runs_total",
+    "Runs reported as expired because they waited too long to be processed",
+)
+
 
 class RequestPayload(BaseModel):
     method: str
     url: str
-    body: dict
+    body: dict | list
     headers: dict
     query: dict
 
@@ -41,8 +80,11 @@ class ReportPayload(BaseModel):
 
 class WebhookInvoker(BaseInvoker):
     def _jq_exec(self, expression: str, context: dict) -> dict | None:
+        # Read once, a reload in between must not cache the old secrets with
+        # the new version
+        secrets, version = secret_registry.snapshot
         try:
-            return jq.first(expression, context)
+            return compile_jq(expression, {"secrets": secrets}, version).first(context)
         except Exception as e:
             logger.warning(
                 "WebhookInvoker - jq error - expression: %s, error: %s", expression, e
@@ -63,6 +105,7 @@ class WebhookInvoker(BaseInvoker):
             return self._jq_exec(mapping, body)
         return mapping
 
+    @tracer.span("invoker.prepare_payload")
     def _prepare_payload(
         self, mapping: Mapping, body: dict, invocation_method: dict
     ) -> RequestPayload:
@@ -87,10 +130,9 @@ class WebhookInvoker(BaseInvoker):
             query={},
         )
 
-        raw_mapping: dict = mapping.dict(exclude_none=True)
-        raw_mapping.pop("enabled")
-        raw_mapping.pop("report", None)
-        raw_mapping.pop("fieldsToDecryptPaths", None)
+        raw_mapping: dict = mapping.dict(
+            include=set(RequestPayload.__fields__), exclude_none=True
+        )
         for key, value in raw_mapping.items():
             result = self._apply_jq_on_field(value, body)
             setattr(request_payload, key, result)
@@ -101,7 +143,7 @@ class WebhookInvoker(BaseInvoker):
         self,
         mapping: Mapping | None,
         response_context: Response,
-        request_context: dict,
+        request_context: RequestPayload,
         body_context: dict,
     ) -> ReportPayload:
         # We don't want to update the run status if the request succeeded and the
@@ -110,35 +152,55 @@ class WebhookInvoker(BaseInvoker):
         success_status = "SUCCESS" if is_sync else None
         default_status = success_status if response_context.ok else "FAILURE"
 
-        failure_summary = (
-            f"Failed to invoke the webhook with status code: "
-            f"{response_context.status_code}. Response: {response_context.text}."
+        preview_size = settings.WEBHOOK_RESPONSE_PREVIEW_SIZE
+        default_summary = (
+            None
+            if response_context.ok
+            else (
+                f"Failed to invoke the webhook with status code: "
+                f"{response_context.status_code}. Response: "
+                f"{get_response_preview(response_context, preview_size)}."
+            )
         )
-        default_summary = None if response_context.ok else failure_summary
         report_payload: ReportPayload = ReportPayload(
             status=default_status, summary=default_summary
         )
         if not mapping or not mapping.report:
             return report_payload
 
+        raw_mapping: dict = mapping.report.dict(exclude_none=True)
+        # Only the response fields the report mapping uses are built
+        response_fields = get_response_fields(tuple(get_jq_expressions(raw_mapping)))
         context = {
             "body": body_context,
-            "request": request_context,
-            "response": response_to_dict(response_context),
+            "request": request_context.dict(),
+            "response": response_to_dict(response_context, response_fields),
         }
 
-        raw_mapping: dict = mapping.report.dict(exclude_none=True)
         for key, value in raw_mapping.items():
             result = self._apply_jq_on_field(value, context)
             setattr(report_payload, key, result)
 
         return report_payload
 
+    @staticmethod
+    def _get_mapping_index(mapping: Mapping) -> int:
+        return next(
+            (
+                index
+                for index, action_mapping in enumerate(control_the_payload_config)
+                if action_mapping is mapping
+            ),
+            -1,
+        )
+
+    @tracer.span("invoker.find_mapping")
     def _find_mapping(self, body: dict) -> Mapping | None:
         return next(
             (
                 action_mapping
-                for action_mapping in control_the_payload_config
+                # The config can be swapped by a reload, iterate a snapshot
+                for action_mapping in tuple(control_the_payload_config)
                 if (
                     type(action_mapping.enabled) != bool
                     and self._jq_exec(action_mapping.enabled, body) is True
@@ -150,8 +212,13 @@ class WebhookInvoker(BaseInvoker):
 
     @staticmethod
     def _request(
-        request_payload: RequestPayload, run_logger: Callable[[str], None]
+        request_payload: RequestPayload,
+        run_logger: Callable[[str], None],
+        destination_policy: DestinationPolicy | None = None,
+        max_response_size: int | None = None,
+        http2: bool | None = None,
     ) -> Response:
+        max_size = max_response_size or settings.WEBHOOK_RESPONSE_MAX_SIZE
         logger.info(
             "WebhookInvoker - request - " "method: %s, url: %s, body: %s",
             request_payload.method,
@@ -166,20 +233,52 @@ class WebhookInvoker(BaseInvoker):
             request_payload.headers["X-Port-Timestamp"],
         )
 
-        res = requests.request(
-            request_payload.method,
-            request_payload.url,
-            json=request_payload.body,
-            headers=request_payload.headers,
-            params=request_payload.query,
-            timeout=settings.WEBHOOK_INVOKER_TIMEOUT,
-        )
+        # Only a capped body is streamed, it's read up to the cap
+        request_options: dict[str, Any] = {"stream": True} if max_size else {}
+        # Sidecars on a unix socket are called through a pooled session
+        unix_socket_url = to_unix_socket_url(request_payload.url)
+        send = unix_socket_session.request if unix_socket_url else requests.request
+        url = unix_socket_url or request_payload.url
+        with destination_controls.guard(url, destination_policy) as destination_call:
+            if not unix_socket_url and http2_transport.is_enabled(url, http2):
+                res = http2_transport.request(
+                    request_payload.method,
+                    url,
+                    json=request_payload.body,
+                    headers=request_payload.headers,
+                    params=request_payload.query,
+                    timeout=settings.WEBHOOK_INVOKER_TIMEOUT,
+                    max_size=max_size,
+                )
+            else:
+                res = send(
+                    request_payload.method,
+                    url,
+                    json=request_payload.body,
+                    headers=request_payload.headers,
+                    params=request_payload.query,
+                    timeout=settings.WEBHOOK_INVOKER_TIMEOUT,
+                    **request_options,
+                )
+                if max_size:
+                    read_response_body(res, max_size)
+            destination_call.record_status(res.ok, res.status_code)
 
+        if is_response_truncated(res):
+            truncated_responses_counter.inc()
+            logger.warning(
+                "WebhookInvoker - request - url: %s, response truncated at %d bytes",
+                request_payload.url,
+                max_size,
+            )
+        response_preview = get_response_preview(
+            res, settings.WEBHOOK_RESPONSE_PREVIEW_SIZE
+        )
         if res.ok:
             logger.info(
                 "WebhookInvoker - request - status_code: %s, body: %s",
                 res.status_code,
-                res.text,
+                response_preview,
             )
             run_logger(
                 f"Action invocation has completed successfully with "
@@ -189,19 +288,66 @@ class WebhookInvoker(BaseInvoker):
             logger.warning(
                 "WebhookInvoker - request - status_code: %s, response: %s",
                 res.status_code,
-                res.text,
+                response_preview,
             )
             run_logger(
                 f"Action invocation failed with status code: {res.status_code} "
-                f"and response: {res.text}"
+                f"and response: {response_preview}"
             )
 
         return res
 
+    @profiler.stage("invoker.request")
+    @tracer.span("webhook.request", kind=SPAN_KIND_CLIENT)
+    def _send(
+        self,
+        request_payload: RequestPayload,
+        run_logger: Callable[[str], None],
+        mapping: Mapping,
+    ) -> Response:
+        tracer.set_attribute("http.request.method", request_payload.method)
+        tracer.inject(request_payload.headers)
+        if not mapping.handler:
+            res = self._request(
+                request_payload,
+                run_logger,
+                mapping.destinationPolicy,
+                mapping.maxResponseSize,
+                mapping.http2,
+            )
+            flight_recorder.set_response_bytes(get_response_size(res))
+            tracer.set_attribute("http.response.status_code", res.status_code)
+            return res
+
+        run_logger(f"Calling the handler {mapping.handler}")
+        res = python_handler_invoker.invoke(
+            request_payload.dict(), {"handler": mapping.handler}
+        )
+        if res.ok:
+            run_logger(
+                f"Action invocation has completed successfully with "
+                f"status code: {res.status_code}"
+            )
+        else:
+            run_logger(
+                f"Action invocation failed with status code: {res.status_code} "
+                f"and response: "
+                f"{get_response_preview(res, settings.WEBHOOK_RESPONSE_PREVIEW_SIZE)}"
+            )
+        flight_recorder.set_response_bytes(get_response_size(res))
+        tracer.set_attribute("http.response.status_code", res.status_code)
+        return res
+
     @staticmethod
+    @tracer.span("port.report_status")
     def _report_run_status(
         run_id: str, data_to_patch: dict, run_logger: Callable[[str], None]
-    ) -> Response:
+    ) -> Response | None:
+        if port_spool:
+            port_spool.append("status", run_id, data_to_patch)
+            logger.info("WebhookInvoker - report run - run_id: %s, spooled", run_id)
+            return None
+
         res = report_run_status(run_id, data_to_patch)
 
         if res.ok:
@@ -226,9 +372,10 @@ class WebhookInvoker(BaseInvoker):
         return res
 
     @staticmethod
+    @tracer.span("port.report_response")
     def _report_run_response(
         run_id: str, response_body: dict | str | None, run_logger: Callable[[str], None]
-    ) -> Response:
+    ) -> Response | None:
         logger.info(
             "WebhookInvoker - report run response - run_id: %s, response: %s",
             run_id,
@@ -236,6 +383,10 @@ class WebhookInvoker(BaseInvoker):
         )
         run_logger("Reporting the run response")
 
+        if port_spool:
+            port_spool.append("response", run_id, response_body)
+            return None
+
         res = report_run_response(run_id, response_body)
 
         if res.ok:
@@ -261,40 +412,102 @@ class WebhookInvoker(BaseInvoker):
         return res
 
     def _invoke_run(
-        self, run_id: str, mapping: Mapping, body: dict, invocation_method: dict
+        self,
+        run_id: str,
+        mapping: Mapping,
+        body: dict,
+        invocation_method: dict,
+        attempt: int = 1,
+        retry_msg: dict | None = None,
     ) -> None:
-        run_logger = run_logger_factory(run_id)
-        run_logger("An action message has been received")
-
-        logger.info(
-            "WebhookInvoker - mapping - mapping: %s",
-            mapping.dict() if mapping else None,
+        base_run_logger = (
+            port_spool.run_logger_factory(run_id)
+            if port_spool
+            else run_logger_factory(run_id)
         )
-        run_logger("Preparing the payload for the request")
-        request_payload = self._prepare_payload(mapping, body, invocation_method)
-        res = self._request(request_payload, run_logger)
+        # The Port updates are sent concurrently, in the background of the
+        # invocation, and all of them are acknowledged before returning. The
+        # updates log inline so the final log is sent after their logs
+        with port_reporter.group() as reports:
+            run_logger = reports.run_logger(base_run_logger)
+            if attempt == 1:
+                run_logger("An action message has been received")
+            else:
+                run_logger(f"Retrying the action invocation, attempt {attempt}")
 
-        response_body = get_response_body(res)
-        if invocation_method.get("synchronized") and response_body:
-            self._report_run_response(run_id, response_body, run_logger)
-
-        report_payload = self._prepare_report(
-            mapping, res, request_payload.dict(), body
-        )
-        if report_dict := report_payload.dict(exclude_none=True, by_alias=True):
             logger.info(
-                "WebhookInvoker - report mapping - report_payload: %s",
-                report_payload.dict(exclude_none=True, by_alias=True),
+                "WebhookInvoker - mapping - mapping: %s",
+                mapping.dict() if mapping else None,
             )
-            self._report_run_status(run_id, report_dict, run_logger)
-        else:
-            logger.info(
-                "WebhookInvoker - report mapping "
-                "- no report mapping found - run_id: %s",
-                run_id,
+            run_logger("Preparing the payload for the request")
+            request_payload = self._prepare_payload(mapping, body, invocation_method)
+            try:
+                res = self._send(request_payload, run_logger, mapping)
+            except (DestinationUnavailableError, RequestException) as e:
+                logger.warning("WebhookInvoker - request - run_id: %s, %s", run_id, e)
+                if self._retry_later(retry_msg or body, invocation_method, attempt, e):
+                    run_logger(f"Action invocation failed and will be retried: {e}")
+                    flight_recorder.set_outcome("retry")
+                    return
+                run_logger(f"Action invocation failed: {e}")
+                flight_recorder.set_outcome("failure")
+                reports.submit(
+                    self._report_run_status,
+                    run_id,
+                    {
+                        "status": "FAILURE",
+                        "summary": f"Failed to invoke the webhook. {e}.",
+                    },
+                    base_run_logger,
+                )
+                raise
+
+            if not res.ok and self._retry_later(
+                retry_msg or body,
+                invocation_method,
+                attempt,
+                f"status code: {res.status_code}",
+                is_retryable_status_code(res.status_code),
+            ):
+                run_logger("The action invocation will be retried")
+                flight_recorder.set_outcome("retry")
+                return
+
+            flight_recorder.set_outcome("success" if res.ok else "failure")
+            response_report = None
+            if invocation_method.get("synchronized") and (
+                response_body := get_response_body(res)
+            ):
+                response_report = reports.submit(
+                    self._report_run_response, run_id, response_body, base_run_logger
+                )
+
+            report_payload = self._prepare_report(mapping, res, request_payload, body)
+            if report_dict := report_payload.dict(exclude_none=True, by_alias=True):
+                logger.info(
+                    "WebhookInvoker - report mapping - report_payload: %s",
+                    report_payload.dict(exclude_none=True, by_alias=True),
+                )
+                # Port takes the final status after the response of the run
+                reports.submit(
+                    self._report_run_status,
+                    run_id,
+                    report_dict,
+                    base_run_logger,
+                    after=response_report,
+                )
+            else:
+                logger.info(
+                    "WebhookInvoker - report mapping "
+                    "- no report mapping found - run_id: %s",
+                    run_id,
+                )
+            res.raise_for_status()
+            reports.submit(
+                base_run_logger,
+                "Port agent finished processing the action run",
+                after=reports.barrier(),
             )
-        res.raise_for_status()
-        run_logger("Port agent finished processing the action run")
 
     def validate_incoming_signature(
         self, msg: dict, invocation_method_name: str, invocation_method: dict = None
@@ -359,42 +572,292 @@ class WebhookInvoker(BaseInvoker):
             return False
         return True
 
-    def invoke(self, msg: dict, invocation_method: dict) -> None:
+    @staticmethod
+    def _retry_later(
+        retry_msg: dict,
+        invocation_method: dict,
+        attempt: int,
+        error: Exception | str,
+        retryable: bool = True,
+    ) -> bool:
+        if retryable:
+            return retry_scheduler.schedule(
+                retry_msg, invocation_method, attempt, str(error)
+            )
+        retry_scheduler.dead_letter(retry_msg, invocation_method, attempt, str(error))
+        return False
+
+    def _expire_run(
+        self,
+        run_id: str,
+        created_at: float | None,
+        max_age: float | None,
+        idempotency_key: str | None,
+    ) -> bool:
+        """Report the run as expired if it is older than max_age"""
+        if not max_age or created_at is None:
+            return False
+        age = time.time() - created_at
+        if age <= max_age:
+            return False
+
+        expired_runs_counter.inc()
+        logger.info(
+            "WebhookInvoker - run expired - run_id: %s, age: %.0fs, max_age: %.0fs",
+            run_id,
+            age,
+            max_age,
+        )
+        self._report_run_status(
+            run_id,
+            {
+                "status": "FAILURE",
+                "summary": (
+                    f"The run expired after waiting {age:.0f} seconds to be"
+                    f" processed by the agent, the maximum age is {max_age:.0f}"
+                    " seconds."
+                ),
+            },
+            lambda _: None,
+        )
+        if idempotency_key:
+            idempotency_cache.add(idempotency_key)
+        return True
+
+    def retry(self, task: RetryTask) -> None:
+        with tracer.trace("invoker.retry", {"port.attempt": task.attempt}):
+            self.invoke(task.msg, task.invocation_method, attempt=task.attempt)
+
+    @profiler.stage("invoker.invoke")
+    def invoke(
+        self,
+        msg: dict,
+        invocation_method: dict,
+        attempt: int = 1,
+        idempotency_key: str | None = None,
+        message_timestamp: float | None = None,
+    ) -> None:
         logger.info("WebhookInvoker - start - destination: %s", invocation_method)
         run_id = msg["context"].get("runId")
+        flight_recorder.set_run(run_id)
+        tracer.set_run_id(run_id)
+
+        idempotency_key = idempotency_key or (f"run:{run_id}" if run_id else None)
+        # Retries were scheduled by the first attempt which already marked the
+        # message as processed
+        if (
+            attempt == 1
+            and idempotency_key
+            and idempotency_cache.contains(idempotency_key)
+        ):
+            duplicates_counter.inc()
+            logger.info(
+                "WebhookInvoker - skipping already processed message - key: %s",
+                idempotency_key,
+            )
+            flight_recorder.set_outcome("duplicate")
+            return
 
         invocation_method_name = invocation_method.get("type", "WEBHOOK")
         if not self.validate_incoming_signature(
             msg, invocation_method_name, invocation_method
         ):
+            flight_recorder.set_outcome("rejected")
             return
 
         logger.info("WebhookInvoker - validating signature")
 
+        created_at = get_run_created_at(msg) or message_timestamp
+        if run_id and self._expire_run(
+            run_id, created_at, settings.WEBHOOK_RUN_MAX_AGE, idempotency_key
+        ):
+            flight_recorder.set_outcome("expired")
+            return
+
         mapping = self._find_mapping(msg)
         if mapping is None:
             logger.info(
                 "WebhookInvoker - Could not find suitable mapping for the event"
                 f" - msg: {msg} {', run_id: ' + run_id if run_id else ''}",
             )
+            flight_recorder.set_outcome("unmapped")
             return
+        if flight_recorder.enabled:
+            flight_recorder.set_run(run_id, self._get_mapping_index(mapping))
 
+        if run_id and self._expire_run(
+            run_id, created_at, mapping.maxAge, idempotency_key
+        ):
+            flight_recorder.set_outcome("expired")
+            return
+
+        # Keep the message as it was received so a retry or a dead letter
+        # record never holds decrypted values
+        retry_msg = deepcopy(msg) if mapping.fieldsToDecryptPaths else msg
         self._replace_encrypted_fields(msg, mapping)
 
-        if run_id:
-            self._invoke_run(run_id, mapping, msg, invocation_method)
-        # Used for changelog destination event trigger
-        elif invocation_method.get("url"):
-            request_payload = self._prepare_payload(mapping, msg, invocation_method)
-            res = self._request(request_payload, lambda _: None)
-            res.raise_for_status()
-        else:
-            logger.warning(
-                "WebhookInvoker - Could not find suitable "
-                "invocation method for the event"
-            )
+        try:
+            if run_id:
+                self._invoke_run(
+                    run_id, mapping, msg, invocation_method, attempt, retry_msg
+                )
+            # Used for changelog destination event trigger
+            elif invocation_method.get("url"):
+                self._invoke_changelog(
+                    mapping, msg, invocation_method, attempt, retry_msg
+                )
+            else:
+                logger.warning(
+                    "WebhookInvoker - Could not find suitable "
+                    "invocation method for the event"
+                )
+        finally:
+            # The outcome was reported or handed to the retry scheduler, a
+            # replay of the message must not invoke the destination again
+            if idempotency_key:
+                idempotency_cache.add(idempotency_key)
         logger.info("Finished processing the event")
 
+    def _invoke_changelog(
+        self,
+        mapping: Mapping,
+        msg: dict,
+        invocation_method: dict,
+        attempt: int,
+        retry_msg: dict,
+    ) -> None:
+        request_payload = self._prepare_payload(mapping, msg, invocation_method)
+        try:
+            res = self._send(request_payload, lambda _: None, mapping)
+        except (DestinationUnavailableError, RequestException) as e:
+            if self._retry_later(retry_msg, invocation_method, attempt, e):
+                flight_recorder.set_outcome("retry")
+                return
+            flight_recorder.set_outcome("failure")
+            raise
+        if not res.ok and self._retry_later(
+            retry_msg,
+            invocation_method,
+            attempt,
+            f"status code: {res.status_code}",
+            is_retryable_status_code(res.status_code),
+        ):
+            flight_recorder.set_outcome("retry")
+            return
+        flight_recorder.set_outcome("success" if res.ok else "failure")
+        res.raise_for_status()
+
+    def find_batch_mapping(self, msg: dict) -> Mapping | None:
+        """The mapping of a changelog message if it should be sent in a batch"""
+        if msg["context"].get("runId") or not any(
+            mapping.batch for mapping in control_the_payload_config
+        ):
+            return None
+        mapping = self._find_mapping(msg)
+        return mapping if mapping and mapping.batch else None
+
+    @staticmethod
+    def _get_batch_failures(res: Response, batch_size: int) -> list[int]:
+        """Indexes of the events the destination reported as failed"""
+        try:
+            failed = res.json().get("failed", [])
+        except (ValueError, AttributeError):
+            return []
+        return sorted(
+            {index for index in failed if isinstance(index, int)}
+            & set(range(batch_size))
+        )
+
+    def invoke_batch(
+        self,
+        msgs: list[dict],
+        invocation_method: dict,
+        mapping: Mapping,
+        idempotency_keys: list[str | None],
+    ) -> list[int]:
+        """
+        Send changelog events to their destination in a single request with
+        an array body, or a request per destination when the mapping computes
+        the method, url, headers or query per event. A destination can report
+        the events it failed to process with a `failed` list of indexes in its
+        response, those and the events of a failed request are retried
+        individually. Returns the indexes of the events that failed.
+        """
+        pending = [
+            index
+            for index, key in enumerate(idempotency_keys)
+            if not (key and idempotency_cache.contains(key))
+        ]
+        if len(pending) < len(msgs):
+            duplicates_counter.inc(len(msgs) - len(pending))
+        if not pending:
+            return []
+
+        retry_msgs = {}
+        # The events of a batch share the destination they were computed to
+        destinations: dict[str, list[tuple[int, RequestPayload]]] = {}
+        for index in pending:
+            msg = msgs[index]
+            retry_msgs[index] = deepcopy(msg) if mapping.fieldsToDecryptPaths else msg
+            self._replace_encrypted_fields(msg, mapping)
+            payload = self._prepare_payload(mapping, msg, invocation_method)
+            destination = json.dumps(
+                [payload.method, payload.url, payload.headers, payload.query],
+                sort_keys=True,
+                default=str,
+            )
+            destinations.setdefault(destination, []).append((index, payload))
+
+        failed = []
+        for events in destinations.values():
+            failed += self._send_batch(
+                [index for index, _ in events],
+                [payload for _, payload in events],
+                retry_msgs,
+                invocation_method,
+                mapping,
+            )
+        for index in pending:
+            if key := idempotency_keys[index]:
+                idempotency_cache.add(key)
+        return sorted(failed)
+
+    def _send_batch(
+        self,
+        pending: list[int],
+        bodies: list[RequestPayload],
+        retry_msgs: dict[int, dict],
+        invocation_method: dict,
+        mapping: Mapping,
+    ) -> list[int]:
+        request_payload = RequestPayload(
+            method=bodies[0].method,
+            url=bodies[0].url,
+            body=[payload.body for payload in bodies],
+            headers={**bodies[0].headers, "X-Port-Batch-Size": str(len(bodies))},
+            query=bodies[0].query,
+        )
+        error: Exception | str
+        retryable = True
+        try:
+            res = self._send(request_payload, lambda _: None, mapping)
+        except (DestinationUnavailableError, RequestException) as e:
+            failed, error = pending, e
+        else:
+            if res.ok:
+                failed = [
+                    pending[i] for i in self._get_batch_failures(res, len(pending))
+                ]
+                error = "rejected by the destination in a batch"
+            else:
+                failed, error = pending, f"status code: {res.status_code}"
+                retryable = is_retryable_status_code(res.status_code)
+
+        for index in failed:
+            self._retry_later(retry_msgs[index], invocation_method, 1, error, retryable)
+        return failed
+
+    @tracer.span("invoker.decrypt")
     def _replace_encrypted_fields(self, msg: dict, mapping: Mapping) -> None:
         fields_to_decrypt = getattr(mapping, "fieldsToDecryptPaths", None)
         if not settings.PORT_CLIENT_SECRET or not fields_to_decrypt:
@@ -402,11 +865,7 @@ class WebhookInvoker(BaseInvoker):
         logger.info(
             "WebhookInvoker - decrypting fields - fields: %s", fields_to_decrypt
         )
-        decryption_key = settings.PORT_CLIENT_SECRET
-        decrypted_payload = decrypt_payload_fields(
-            msg, fields_to_decrypt, decryption_key
-        )
-        msg.update(decrypted_payload)
+        decrypt_payload_fields(msg, fields_to_decrypt, settings.PORT_CLIENT_SECRET)
 
 
 webhook_invoker = WebhookInvoker()
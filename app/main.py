@@ -1,6 +1,21 @@
 import logging
 
 from core.config import settings
+from core.config_reloader import config_reloader
+from core.flight_recorder import flight_recorder
+from core.metrics_server import metrics_server
+from core.profiler import profiler
+from core.secret_registry import secret_registry
+from core.shutdown import shutdown_coordinator
+from core.tracing import tracer
+from invokers.http2_transport import http2_transport
+from invokers.idempotency_cache import idempotency_cache
+from invokers.port_reporter import port_reporter
+from invokers.python_handler_invoker import python_handler_invoker
+from invokers.retry_scheduler import retry_scheduler
+from invokers.unix_socket_adapter import unix_socket_session
+from invokers.webhook_invoker import webhook_invoker
+from port_spool import port_spool
 from streamers.streamer_factory import StreamerFactory
 
 logging.basicConfig(level=settings.LOG_LEVEL)
@@ -10,8 +25,47 @@ logger = logging.getLogger(__name__)
 def main() -> None:
     streamer_factory = StreamerFactory()
     streamer = streamer_factory.get_streamer(settings.STREAMER_NAME)
+    if settings.METRICS_PORT:
+        metrics_server.start(settings.METRICS_PORT)
+    if port_spool:
+        port_spool.start()
+    if retry_scheduler.enabled:
+        retry_scheduler.start(webhook_invoker.retry)
+    config_reloader.start()
+    secret_registry.start()
+    profiler.start()
+    flight_recorder.start()
+    tracer.start()
     logger.info("Starting streaming with streamer: %s", settings.STREAMER_NAME)
-    streamer.stream()
+    try:
+        streamer.stream()
+    finally:
+        with shutdown_coordinator.phase("stop config reloaders"):
+            config_reloader.stop(shutdown_coordinator.remaining())
+            secret_registry.stop(shutdown_coordinator.remaining())
+        if port_spool:
+            with shutdown_coordinator.phase("flush Port reports"):
+                if not port_spool.flush(shutdown_coordinator.remaining()):
+                    logger.warning(
+                        "Shutdown deadline reached with Port reports left in"
+                        " the spool, they will be sent after the restart"
+                    )
+        with shutdown_coordinator.phase("stop retry scheduler"):
+            retry_scheduler.stop(shutdown_coordinator.remaining())
+        port_reporter.stop()
+        if port_spool:
+            with shutdown_coordinator.phase("stop Port report spool"):
+                port_spool.stop(shutdown_coordinator.remaining())
+        idempotency_cache.close()
+        unix_socket_session.close()
+        http2_transport.close()
+        python_handler_invoker.stop()
+        profiler.stop()
+        with shutdown_coordinator.phase("export spans"):
+            tracer.stop(shutdown_coordinator.remaining())
+        if settings.METRICS_PORT:
+            metrics_server.stop()
+        shutdown_coordinator.finish()
 
 
 if __name__ == "__main__":
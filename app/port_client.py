@@ -1,21 +1,166 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
 from logging import getLogger
-from typing import Callable
+from typing import Any, Callable
 
 import requests
 from core.config import settings
+from core.metrics import metrics
+from core.profiler import profiler
+from core.rate_limiter import TokenBucket
 from requests import Response
 
 logger = getLogger(__name__)
 
-
-def get_port_api_headers() -> dict[str, str]:
+# Lower values are served first when calls wait for a rate limit, run logs are
+# the least important and must not delay run status or response reports
+ENDPOINT_PRIORITIES = {
+    "auth": 0,
+    "status": 0,
+    "response": 0,
+    "credentials": 0,
+    "logs": 1,
+}
+
+port_api_bucket = TokenBucket(
+    "global", settings.PORT_API_RATE_LIMIT, settings.PORT_API_RATE_LIMIT_BURST
+)
+endpoint_buckets = {
+    endpoint: TokenBucket(endpoint, rate, rate * 2)
+    for endpoint, rate in settings.PORT_API_ENDPOINT_RATE_LIMITS.items()
+}
+
+queue_depth_gauge = metrics.gauge(
+    "port_agent_port_api_queue_depth",
+    "Port API calls waiting for a rate limit token",
+)
+for bucket in [port_api_bucket, *endpoint_buckets.values()]:
+    queue_depth_gauge.set_function(bucket.waiting, bucket=bucket.name)
+# Access tokens are fetched again this many seconds before they expire, and
+# kept for the default lifetime if Port doesn't tell it
+ACCESS_TOKEN_EXPIRY_MARGIN = 60
+ACCESS_TOKEN_DEFAULT_LIFETIME = 300
+_access_token_condition = threading.Condition()
+_access_token: str | None = None
+_access_token_expires_at = 0.0
+# Priorities of the token fetches in flight, callers only wait for a fetch that
+# is at least as urgent as they are and fetch one themselves otherwise
+_access_token_fetches: list[int] = []
+
+throttled_counter = metrics.counter(
+    "port_agent_port_api_throttled_total",
+    "Port API calls that were rejected with 429 Too Many Requests",
+)
+
+
+def _get_retry_after(res: Response, attempt: int) -> float:
+    retry_after = res.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after).timestamp()
+            return max(retry_at - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    return float(2**attempt)
+
+
+def _send(
+    endpoint: str, method: str, url: str, priority: int | None = None, **kwargs: Any
+) -> Response:
+    with profiler.stage(f"port.{endpoint}"):
+        if priority is None:
+            priority = ENDPOINT_PRIORITIES.get(endpoint, 0)
+        endpoint_bucket = endpoint_buckets.get(endpoint)
+        attempt = 0
+        refreshed = False
+        while True:
+            if endpoint_bucket:
+                endpoint_bucket.acquire(priority)
+            port_api_bucket.acquire(priority)
+
+            res = getattr(requests, method)(url, **kwargs)
+            if res.status_code == 401 and endpoint != "auth" and not refreshed:
+                # The cached token was revoked or expired early, send the
+                # call once more with a fresh one
+                headers = kwargs.get("headers") or {}
+                invalidate_access_token(headers.get("Authorization"))
+                kwargs["headers"] = {**headers, **get_port_api_headers(endpoint)}
+                refreshed = True
+                continue
+            if res.status_code != 429 or attempt >= settings.PORT_API_MAX_RETRIES:
+                return res
+
+            retry_after = _get_retry_after(res, attempt)
+            throttled_counter.inc(endpoint=endpoint)
+            logger.warning(
+                "Port API rate limited - endpoint: %s, retrying in %.1fs",
+                endpoint,
+                retry_after,
+            )
+            # Port limits per organization, hold back every call and not only
+            # the ones to the throttled endpoint
+            port_api_bucket.pause(retry_after)
+            attempt += 1
+
+
+def invalidate_access_token(authorization: str | None = None) -> None:
+    """Drop the cached token, only if it is the one in `authorization` if given"""
+    global _access_token
+    with _access_token_condition:
+        if authorization is None or authorization == f"Bearer {_access_token}":
+            _access_token = None
+
+
+def _get_access_token(priority: int) -> str:
+    """
+    The cached access token. The token is fetched outside the lock with the
+    priority of the caller, so a fetch started by a run log never holds up a
+    more urgent status report.
+    """
+    global _access_token, _access_token_expires_at
+    with _access_token_condition:
+        while True:
+            if _access_token and time.monotonic() < _access_token_expires_at:
+                return _access_token
+            if not any(fetch <= priority for fetch in _access_token_fetches):
+                _access_token_fetches.append(priority)
+                break
+            _access_token_condition.wait()
+
+    fetched: tuple[str, float] | None = None
+    try:
+        fetched = _fetch_access_token(priority)
+        return fetched[0]
+    finally:
+        with _access_token_condition:
+            _access_token_fetches.remove(priority)
+            if fetched:
+                token, lifetime = fetched
+                _access_token = token
+                _access_token_expires_at = (
+                    time.monotonic()
+                    + lifetime
+                    - min(ACCESS_TOKEN_EXPIRY_MARGIN, lifetime / 2)
+                )
+            _access_token_condition.notify_all()
+
+
+def _fetch_access_token(priority: int) -> tuple[str, float]:
     credentials = {
         "clientId": settings.PORT_CLIENT_ID,
         "clientSecret": settings.PORT_CLIENT_SECRET,
     }
-
-    token_response = requests.post(
-        f"{settings.PORT_API_BASE_URL}/v1/auth/access_token", json=credentials
+    token_response = _send(
+        "auth",
+        "post",
+        f"{settings.PORT_API_BASE_URL}/v1/auth/access_token",
+        priority,
+        json=credentials,
     )
 
     if not token_response.ok:
@@ -27,28 +172,44 @@ def get_port_api_headers() -> dict[str, str]:
 
     token_response.raise_for_status()
 
+    token = token_response.json()
+    lifetime = float(token.get("expiresIn") or ACCESS_TOKEN_DEFAULT_LIFETIME)
+    return token["accessToken"], lifetime
+
+
+def get_port_api_headers(endpoint: str = "auth") -> dict[str, str]:
     return {
-        "Authorization": f"Bearer {token_response.json()['accessToken']}",
+        "Authorization": (
+            f"Bearer {_get_access_token(ENDPOINT_PRIORITIES.get(endpoint, 0))}"
+        ),
         "User-Agent": "port-agent",
     }
 
 
-def run_logger_factory(run_id: str) -> Callable[[str], None]:
-    def send_run_log(message: str) -> None:
-        headers = get_port_api_headers()
+def send_run_log(run_id: str, message: str) -> Response:
+    headers = get_port_api_headers("logs")
+    res = _send(
+        "logs",
+        "post",
+        f"{settings.PORT_API_BASE_URL}/v1/actions/runs/{run_id}/logs",
+        json={"message": message},
+        headers=headers,
+    )
+    return res
 
-        requests.post(
-            f"{settings.PORT_API_BASE_URL}/v1/actions/runs/{run_id}/logs",
-            json={"message": message},
-            headers=headers,
-        )
 
-    return send_run_log
+def run_logger_factory(run_id: str) -> Callable[[str], None]:
+    def run_logger(message: str) -> None:
+        send_run_log(run_id, message)
+
+    return run_logger
 
 
 def report_run_status(run_id: str, data_to_patch: dict) -> Response:
-    headers = get_port_api_headers()
-    res = requests.patch(
+    headers = get_port_api_headers("status")
+    res = _send(
+        "status",
+        "patch",
         f"{settings.PORT_API_BASE_URL}/v1/actions/runs/{run_id}",
         json=data_to_patch,
         headers=headers,
@@ -57,8 +218,10 @@ def report_run_status(run_id: str, data_to_patch: dict) -> Response:
 
 
 def report_run_response(run_id: str, response: dict | str | None) -> Response:
-    headers = get_port_api_headers()
-    res = requests.patch(
+    headers = get_port_api_headers("response")
+    res = _send(
+        "response",
+        "patch",
         f"{settings.PORT_API_BASE_URL}/v1/actions/runs/{run_id}/response",
         json={"response": response},
         headers=headers,
@@ -67,9 +230,12 @@ def report_run_response(run_id: str, response: dict | str | None) -> Response:
 
 
 def get_kafka_credentials() -> tuple[list[str], str, str]:
-    headers = get_port_api_headers()
-    res = requests.get(
-        f"{settings.PORT_API_BASE_URL}/v1/kafka-credentials", headers=headers
+    headers = get_port_api_headers("credentials")
+    res = _send(
+        "credentials",
+        "get",
+        f"{settings.PORT_API_BASE_URL}/v1/kafka-credentials",
+        headers=headers,
     )
     res.raise_for_status()
     data = res.json()["credentials"]
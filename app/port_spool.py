@@ -0,0 +1,496 @@
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+from typing import Any, BinaryIO, Callable
+
+from core.config import settings
+from core.metrics import metrics
+from invokers.dead_letter import FileDeadLetterSink
+from port_client import report_run_response, report_run_status, send_run_log
+from requests import RequestException, Response
+from utils import is_retryable_status_code
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Every record is prefixed with its length and the crc32 of its payload
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor.json"
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+MAX_SEND_BACKOFF = 30.0
+# The cursor is saved at most this often, the reports sent since are sent
+# again after a crash
+CURSOR_SAVE_INTERVAL = 0.2
+
+SENDERS: dict[str, Callable[[str, Any], Response]] = {
+    "status": report_run_status,
+    "response": report_run_response,
+    "log": send_run_log,
+}
+
+
+class PortReportSpool:
+    """
+    Append-only spool of pending Port reports. Records are appended to
+    numbered segment files and fsynced in batches by a background thread. A
+    reader thread reads them back through mmap and hands them to the queue of
+    their run, `concurrency` sender threads send the runs' reports, each run
+    in the order its reports were written. A report that keeps failing is
+    sent to a dead letter file after `max_attempts`, so it never holds back
+    the other runs for long.
+
+    A cursor file tracks the oldest report that wasn't sent so that the spool
+    is replayed from there after a restart. Reports sent after the cursor was
+    last saved, or ahead of it by another run, are sent again after a crash:
+    status and response patches are idempotent, run logs can be duplicated.
+    `append` only blocks when the spool holds more than `max_bytes` of
+    unsent records.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        segment_bytes: int,
+        max_bytes: int,
+        fsync_interval: float,
+        concurrency: int = 1,
+        max_attempts: int = 10,
+        max_in_flight: int = 1000,
+    ) -> None:
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.concurrency = max(concurrency, 1)
+        self.max_attempts = max_attempts
+        self.max_in_flight = max_in_flight
+        self._condition = threading.Condition()
+        self._pending_bytes = 0
+        self._unsynced = False
+        self._writer: BinaryIO | None = None
+        self._write_segment = 0
+        self._write_offset = 0
+        # The cursor, the oldest record that wasn't sent
+        self._read_segment = 0
+        self._read_offset = 0
+        # The next record to hand to the senders
+        self._scan_segment = 0
+        self._scan_offset = 0
+        self._cursor_saved_at = 0.0
+        # The records handed to the senders, in spool order: position -> size,
+        # done
+        self._in_flight: dict[tuple[int, int], list] = {}
+        self._runs: dict[str, deque[tuple[dict, tuple[int, int]]]] = {}
+        self._ready_runs: queue.Queue[str] = queue.Queue()
+        self._dead_letter_sink: FileDeadLetterSink | None = None
+        self._map: mmap.mmap | None = None
+        self._map_segment = -1
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def pending_bytes(self) -> int:
+        with self._condition:
+            return self._pending_bytes
+
+    def _segment_file(self, segment: int) -> Path:
+        return self.path / f"{segment:010d}{SEGMENT_SUFFIX}"
+
+    def _segments(self) -> list[int]:
+        return sorted(int(file.stem) for file in self.path.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def start(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._dead_letter_sink = FileDeadLetterSink(self.path / DEAD_LETTER_FILE)
+        self._recover()
+        self._threads = [
+            threading.Thread(target=self._drain, name="port-spool-drain", daemon=True),
+            threading.Thread(target=self._sync, name="port-spool-sync", daemon=True),
+            *(
+                threading.Thread(
+                    target=self._send_runs, name="port-spool-send", daemon=True
+                )
+                for _ in range(self.concurrency)
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stops the threads, a report that is being sent when the timeout
+        expires is left to be sent again after the restart
+        """
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        for _ in range(self.concurrency):
+            # Wakes up the idle senders
+            self._ready_runs.put("")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+        if any(thread.is_alive() for thread in self._threads):
+            logger.warning("PortReportSpool - stopped while reports were being sent")
+        with self._condition:
+            if self._writer:
+                self._fsync()
+                self._writer.close()
+            self._save_cursor()
+        self._close_map()
+        if self._pending_bytes:
+            logger.info(
+                "PortReportSpool - stopped with %d bytes of pending reports",
+                self._pending_bytes,
+            )
+
+    def flush(self, timeout: float) -> bool:
+        """Wait until every spooled report was sent, returns False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending_bytes == 0, timeout)
+
+    def append(self, kind: str, run_id: str, data: object) -> None:
+        payload = json.dumps(
+            {"kind": kind, "runId": run_id, "data": data},
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ).encode("utf-8")
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._condition:
+            while self._pending_bytes >= self.max_bytes and not self._stopped.is_set():
+                logger.warning(
+                    "PortReportSpool - spool is full, waiting for the drainer"
+                )
+                self._condition.wait(timeout=1)
+
+            if (
+                self._write_offset
+                and self._write_offset + len(record) > self.segment_bytes
+            ):
+                self._roll_segment()
+            assert self._writer is not None
+            self._writer.write(record)
+            self._writer.flush()
+            self._write_offset += len(record)
+            self._pending_bytes += len(record)
+            self._unsynced = True
+            self._condition.notify_all()
+
+    def run_logger_factory(self, run_id: str) -> Callable[[str], None]:
+        def run_logger(message: str) -> None:
+            self.append("log", run_id, message)
+
+        return run_logger
+
+    def _roll_segment(self) -> None:
+        if self._writer:
+            self._fsync()
+            self._writer.close()
+        self._write_segment += 1
+        self._write_offset = 0
+        self._writer = self._segment_file(self._write_segment).open("ab")
+
+    def _fsync(self) -> None:
+        assert self._writer is not None
+        if self._unsynced:
+            os.fsync(self._writer.fileno())
+            self._unsynced = False
+
+    def _sync(self) -> None:
+        while not self._stopped.wait(self.fsync_interval):
+            with self._condition:
+                if self._writer:
+                    self._fsync()
+
+    def _recover(self) -> None:
+        cursor_file = self.path / CURSOR_FILE
+        cursor = {"segment": 0, "offset": 0}
+        if cursor_file.is_file():
+            cursor = json.loads(cursor_file.read_text("utf-8"))
+
+        segments = self._segments()
+        for segment in segments:
+            if segment < cursor["segment"]:
+                self._segment_file(segment).unlink()
+        segments = [segment for segment in segments if segment >= cursor["segment"]]
+
+        if segments:
+            self._write_segment = segments[-1]
+            self._write_offset = self._truncate_torn_record(segments[-1])
+            self._read_segment = segments[0]
+            self._read_offset = (
+                cursor["offset"] if segments[0] == cursor["segment"] else 0
+            )
+        else:
+            self._write_segment = self._read_segment = cursor["segment"]
+            self._read_offset = self._write_offset = 0
+        self._scan_segment = self._read_segment
+        self._scan_offset = self._read_offset
+
+        self._pending_bytes = (
+            sum(self._segment_file(segment).stat().st_size for segment in segments)
+            - self._read_offset
+        )
+        self._writer = self._segment_file(self._write_segment).open("ab")
+        if self._pending_bytes:
+            logger.info(
+                "PortReportSpool - recovered %d bytes of pending reports",
+                self._pending_bytes,
+            )
+
+    def _truncate_torn_record(self, segment: int) -> int:
+        """Drop a record that was only partially written before a crash"""
+        segment_file = self._segment_file(segment)
+        data = segment_file.read_bytes()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + length
+            if end > len(data) or zlib.crc32(data[start:end]) != crc:
+                break
+            offset = end
+        if offset != len(data):
+            logger.warning(
+                "PortReportSpool - truncating torn record in %s at %d",
+                segment_file,
+                offset,
+            )
+            with segment_file.open("r+b") as f:
+                f.truncate(offset)
+        return offset
+
+    def _save_cursor(self) -> None:
+        cursor_file = self.path / CURSOR_FILE
+        tmp_file = cursor_file.with_suffix(".tmp")
+        tmp_file.write_text(
+            json.dumps({"segment": self._read_segment, "offset": self._read_offset}),
+            encoding="utf-8",
+        )
+        tmp_file.replace(cursor_file)
+        self._cursor_saved_at = time.monotonic()
+
+    def _close_map(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_segment = -1
+
+    def _scan_end(self) -> int:
+        return (
+            self._write_offset
+            if self._scan_segment == self._write_segment
+            else self._segment_file(self._scan_segment).stat().st_size
+        )
+
+    def _read_next(self) -> tuple[dict, tuple[int, int], int] | None:
+        """Read the next record, returns it with its position and size"""
+        with self._condition:
+            while (
+                self._scan_segment < self._write_segment
+                and self._scan_offset >= self._scan_end()
+            ):
+                # The segment was fully read and is no longer written to
+                self._close_map()
+                self._scan_segment += 1
+                self._scan_offset = 0
+
+            readable = self._scan_end()
+            if self._scan_offset >= readable:
+                return None
+            position = (self._scan_segment, self._scan_offset)
+
+        if (
+            self._map is None
+            or self._map_segment != self._scan_segment
+            or (len(self._map) < readable)
+        ):
+            self._close_map()
+            with self._segment_file(self._scan_segment).open("rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._map_segment = self._scan_segment
+
+        length, crc = RECORD_HEADER.unpack_from(self._map, self._scan_offset)
+        start = self._scan_offset + RECORD_HEADER.size
+        end = start + length
+        payload = self._map[start:end]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(
+                f"Corrupt record in segment {self._scan_segment}"
+                f" at {self._scan_offset}"
+            )
+        size = RECORD_HEADER.size + length
+        with self._condition:
+            self._scan_offset += size
+        return json.loads(payload), position, size
+
+    def _complete(self, position: tuple[int, int]) -> None:
+        """Marks a record as sent and moves the cursor past the sent records"""
+        with self._condition:
+            self._in_flight[position][1] = True
+            while self._in_flight:
+                first = next(iter(self._in_flight))
+                size, done = self._in_flight[first]
+                if not done:
+                    break
+                del self._in_flight[first]
+                self._pending_bytes -= size
+
+            segment, offset = (
+                next(iter(self._in_flight))
+                if self._in_flight
+                else (self._scan_segment, self._scan_offset)
+            )
+            for drained in range(self._read_segment, segment):
+                # Fully sent segments are no longer written to
+                self._segment_file(drained).unlink(missing_ok=True)
+            self._read_segment, self._read_offset = segment, offset
+            if time.monotonic() - self._cursor_saved_at >= CURSOR_SAVE_INTERVAL:
+                self._save_cursor()
+            self._condition.notify_all()
+
+    def _skip_segment(self) -> None:
+        with self._condition:
+            position = (self._scan_segment, self._scan_offset)
+            end = self._scan_end()
+            self._in_flight[position] = [end - self._scan_offset, False]
+            self._scan_offset = end
+        self._complete(position)
+
+    def _send(self, record: dict) -> str | None:
+        """Send a record to Port, returns the error if it should be retried"""
+        try:
+            res = SENDERS[record["kind"]](record["runId"], record["data"])
+        except RequestException as e:
+            logger.warning(
+                "PortReportSpool - failed to send %s - run_id: %s, error: %s",
+                record["kind"],
+                record["runId"],
+                e,
+            )
+            return str(e)
+
+        if res.ok:
+            return None
+        if is_retryable_status_code(res.status_code):
+            logger.warning(
+                "PortReportSpool - failed to send %s - run_id: %s, status_code: %s",
+                record["kind"],
+                record["runId"],
+                res.status_code,
+            )
+            return f"status code: {res.status_code}"
+        logger.error(
+            "PortReportSpool - dropping %s - run_id: %s, status_code: %s, response: %s",
+            record["kind"],
+            record["runId"],
+            res.status_code,
+            res.text,
+        )
+        return None
+
+    def _deliver(self, record: dict) -> bool:
+        """Send a record, returns False if the spool stopped in the meantime"""
+        for attempt in range(1, self.max_attempts + 1):
+            error = self._send(record)
+            if error is None:
+                return True
+            if attempt < self.max_attempts and self._stopped.wait(
+                min(MAX_SEND_BACKOFF, 2 ** (attempt - 1))
+            ):
+                return False
+
+        logger.error(
+            "PortReportSpool - dead lettering %s after %d attempts - run_id: %s",
+            record["kind"],
+            self.max_attempts,
+            record["runId"],
+        )
+        if self._dead_letter_sink:
+            self._dead_letter_sink.send(
+                {
+                    **record,
+                    "attempts": self.max_attempts,
+                    "error": error,
+                    "failedAt": int(time.time()),
+                }
+            )
+        return True
+
+    def _send_runs(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                run_id = self._ready_runs.get(timeout=1)
+            except queue.Empty:
+                continue
+            while run_id and not self._stopped.is_set():
+                with self._condition:
+                    run_queue = self._runs[run_id]
+                    if not run_queue:
+                        del self._runs[run_id]
+                        break
+                    record, position = run_queue[0]
+                if not self._deliver(record):
+                    return
+                with self._condition:
+                    run_queue.popleft()
+                self._complete(position)
+
+    def _drain(self) -> None:
+        while not self._stopped.is_set():
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: len(self._in_flight) < self.max_in_flight
+                    or self._stopped.is_set()
+                )
+            try:
+                next_record = self._read_next()
+            except ValueError as e:
+                logger.error("PortReportSpool - %s, skipping the segment", e)
+                self._skip_segment()
+                continue
+
+            if next_record is None:
+                with self._condition:
+                    self._condition.wait(timeout=1)
+                continue
+
+            record, position, size = next_record
+            with self._condition:
+                self._in_flight[position] = [size, False]
+                run_queue = self._runs.get(record["runId"])
+                if run_queue is None:
+                    self._runs[record["runId"]] = deque([(record, position)])
+                    self._ready_runs.put(record["runId"])
+                else:
+                    run_queue.append((record, position))
+
+
+port_spool = (
+    PortReportSpool(
+        settings.PORT_REPORT_SPOOL_PATH,
+        segment_bytes=settings.PORT_REPORT_SPOOL_SEGMENT_BYTES,
+        max_bytes=settings.PORT_REPORT_SPOOL_MAX_BYTES,
+        fsync_interval=settings.PORT_REPORT_SPOOL_FSYNC_INTERVAL,
+        concurrency=settings.PORT_REPORT_SPOOL_CONCURRENCY,
+        max_attempts=settings.PORT_REPORT_SPOOL_MAX_ATTEMPTS,
+    )
+    if settings.PORT_REPORT_SPOOL_PATH
+    else None
+)
+if port_spool:
+    metrics.gauge(
+        "port_agent_port_report_spool_bytes",
+        "Bytes of Port reports waiting in the spool",
+    ).set_function(port_spool.pending_bytes)
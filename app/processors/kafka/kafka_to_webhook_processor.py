@@ -1,7 +1,7 @@
 import json
 import logging
 
-from confluent_kafka import Message
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE, Message
 from core.config import settings
 from invokers.webhook_invoker import webhook_invoker
 
@@ -10,12 +10,29 @@ logger = logging.getLogger(__name__)
 
 
 class KafkaToWebhookProcessor:
+    @staticmethod
+    def get_idempotency_key(msg: Message) -> str | None:
+        # Runs are identified by their run id, changelog messages by their
+        # position in the topic
+        if msg.topic() == settings.KAFKA_CHANGE_LOG_TOPIC:
+            return f"changelog:{msg.topic()}:{msg.partition()}:{msg.offset()}"
+        return None
+
     @staticmethod
     def msg_process(msg: Message, invocation_method: dict, topic: str) -> None:
         logger.info("Raw message value: %s", msg.value())
         msg_value = json.loads(msg.value().decode())
 
-        webhook_invoker.invoke(msg_value, invocation_method)
+        idempotency_key = KafkaToWebhookProcessor.get_idempotency_key(msg)
+        timestamp_type, timestamp = msg.timestamp()
+        webhook_invoker.invoke(
+            msg_value,
+            invocation_method,
+            idempotency_key=idempotency_key,
+            message_timestamp=(
+                timestamp / 1000 if timestamp_type != TIMESTAMP_NOT_AVAILABLE else None
+            ),
+        )
         logger.info(
             "Successfully processed message from topic %s, partition %d, offset %d",
             topic,
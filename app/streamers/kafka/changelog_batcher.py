@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from confluent_kafka import Message
+from consumers.offset_tracker import OffsetTracker
+from core.config import Mapping, settings
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChangelogBatchBuffer:
+    mapping: Mapping
+    invocation_method: dict
+    started_at: float = field(default_factory=time.monotonic)
+    messages: list[Message] = field(default_factory=list)
+    values: list[dict] = field(default_factory=list)
+    size: int = 0
+
+
+class ChangelogBatcher:
+    """
+    Collects changelog events of mappings with a batch policy per destination
+    and hands them to `send` together once the batch reached its max events
+    or bytes, or its linger time passed. `send` returns the indexes of the
+    events that failed so they can be logged with their offsets, the offsets
+    of the whole batch are released once it was sent.
+    """
+
+    def __init__(
+        self,
+        offsets: OffsetTracker,
+        send: Callable[[list[Message], list[dict], dict, Mapping], list[int]],
+    ) -> None:
+        self.offsets = offsets
+        self.send = send
+        self._batches: dict[tuple[str | None, int], ChangelogBatchBuffer] = {}
+        self._lock = threading.RLock()
+
+    def add(
+        self, msg: Message, msg_value: dict, invocation_method: dict, mapping: Mapping
+    ) -> None:
+        with self._lock:
+            assert mapping.batch is not None
+            key = (invocation_method.get("url"), id(mapping))
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = ChangelogBatchBuffer(
+                    mapping, invocation_method
+                )
+
+            self.offsets.retain(msg)
+            batch.messages.append(msg)
+            batch.values.append(msg_value)
+            batch.size += len(msg.value())
+            if (
+                len(batch.messages) >= mapping.batch.maxEvents
+                or batch.size >= mapping.batch.maxBytes
+            ):
+                self._flush(key)
+
+    def tick(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            for key, batch in list(self._batches.items()):
+                assert batch.mapping.batch is not None
+                if force or now - batch.started_at >= batch.mapping.batch.lingerTime:
+                    self._flush(key)
+
+    def _flush(self, key: tuple[str | None, int]) -> None:
+        batch = self._batches.pop(key)
+        try:
+            failed = self.send(
+                batch.messages, batch.values, batch.invocation_method, batch.mapping
+            )
+            for index in failed:
+                msg = batch.messages[index]
+                logger.warning(
+                    "Failed to deliver batched message"
+                    " from topic %s, partition %d, offset %d",
+                    msg.topic(),
+                    msg.partition(),
+                    msg.offset(),
+                )
+        except Exception as e:
+            logger.error(
+                "Failed process batch of %d messages to %s: %s",
+                len(batch.messages),
+                key[0],
+                str(e),
+            )
+        finally:
+            for msg in batch.messages:
+                self.offsets.release(msg)
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from confluent_kafka import Message
+from consumers.offset_tracker import OffsetTracker
+from core.config import settings
+from core.metrics import metrics
+
+logging.basicConfig(level=settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+superseded_counter = metrics.counter(
+    "port_agent_changelog_superseded_total",
+    "Changelog events dropped because a newer event for the entity arrived",
+)
+
+
+def get_entity_key(msg_value: dict, invocation_method: dict) -> tuple | None:
+    """Events with the same key describe the same entity and destination"""
+    context = msg_value.get("context") or {}
+    identifier = context.get("entity") or context.get("runId")
+    if not identifier:
+        after = (msg_value.get("diff") or {}).get("after") or {}
+        identifier = after.get("identifier")
+    if not identifier:
+        return None
+    return (
+        msg_value.get("resourceType"),
+        context.get("blueprint"),
+        identifier,
+        invocation_method.get("url"),
+    )
+
+
+class ChangelogCompactor:
+    """
+    Holds changelog events back for up to `window` seconds and forwards only
+    the latest event of every entity. Events are forwarded in the order of
+    their latest update, superseded events are dropped and their offsets
+    released right away so they don't hold back the commits.
+    """
+
+    def __init__(
+        self,
+        offsets: OffsetTracker,
+        forward: Callable[[Message, dict, dict], None],
+        window: float,
+        max_size: int,
+    ) -> None:
+        self.offsets = offsets
+        self.forward = forward
+        self.window = window
+        self.max_size = max_size
+        self._pending: OrderedDict[tuple, tuple[Message, dict, dict]] = OrderedDict()
+        self._oldest_at = 0.0
+        # Held while events are forwarded, messages and ticks on the topic
+        # scheduler's workers and the forced ticks of the consumer thread may
+        # flush concurrently
+        self._lock = threading.RLock()
+
+    def add(self, msg: Message, msg_value: dict, invocation_method: dict) -> None:
+        with self._lock:
+            key = get_entity_key(msg_value, invocation_method)
+            if key is None:
+                # Keep the order with the events that are held back
+                self.flush()
+                self.forward(msg, msg_value, invocation_method)
+                return
+
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            self.offsets.retain(msg)
+            superseded = self._pending.pop(key, None)
+            self._pending[key] = (msg, msg_value, invocation_method)
+            if superseded:
+                superseded_counter.inc()
+                self.offsets.release(superseded[0])
+
+            if len(self._pending) >= self.max_size:
+                self.flush()
+
+    def tick(self, force: bool = False) -> None:
+        with self._lock:
+            if self._pending and (
+                force or time.monotonic() - self._oldest_at >= self.window
+            ):
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            while self._pending:
+                _, (msg, msg_value, invocation_method) = self._pending.popitem(
+                    last=False
+                )
+                try:
+                    self.forward(msg, msg_value, invocation_method)
+                except Exception as e:
+                    logger.error(
+                        "Failed process message"
+                        " from topic %s, partition %d, offset %d: %s",
+                        msg.topic(),
+                        msg.partition(),
+                        msg.offset(),
+                        str(e),
+                    )
+                finally:
+                    self.offsets.release(msg)
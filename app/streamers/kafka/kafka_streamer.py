@@ -3,9 +3,15 @@ import logging
 
 from confluent_kafka import Consumer, Message
 from consumers.kafka_consumer import KafkaConsumer
-from core.config import settings
+from core.config import Mapping, settings
+from core.flight_recorder import flight_recorder
+from core.profiler import profiler
+from core.tracing import tracer
+from invokers.webhook_invoker import webhook_invoker
 from processors.kafka.kafka_to_webhook_processor import KafkaToWebhookProcessor
 from streamers.base_streamer import BaseStreamer
+from streamers.kafka.changelog_batcher import ChangelogBatcher
+from streamers.kafka.changelog_compactor import ChangelogCompactor
 
 logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -13,14 +19,53 @@ logger = logging.getLogger(__name__)
 
 class KafkaStreamer(BaseStreamer):
     def __init__(self, consumer: Consumer = None) -> None:
-        self.kafka_consumer = KafkaConsumer(self.msg_process, consumer)
+        self.kafka_consumer = KafkaConsumer(self.msg_process, consumer, self.on_tick)
+        self.changelog_compactor = (
+            ChangelogCompactor(
+                self.kafka_consumer.offsets,
+                self.forward,
+                settings.KAFKA_CHANGE_LOG_COMPACTION_WINDOW,
+                settings.KAFKA_CHANGE_LOG_COMPACTION_MAX_SIZE,
+            )
+            if settings.KAFKA_CHANGE_LOG_COMPACTION_ENABLED
+            else None
+        )
 
-    def msg_process(self, msg: Message) -> None:
-        logger.info("Raw message value: %s", msg.value())
-        msg_value = json.loads(msg.value().decode())
-        topic = msg.topic()
-        invocation_method = self.get_invocation_method(msg_value, topic)
+        self.changelog_batcher = ChangelogBatcher(
+            self.kafka_consumer.offsets, self.send_batch
+        )
+
+    def forward(self, msg: Message, msg_value: dict, invocation_method: dict) -> None:
+        mapping = webhook_invoker.find_batch_mapping(msg_value)
+        if mapping:
+            self.changelog_batcher.add(msg, msg_value, invocation_method, mapping)
+            flight_recorder.set_outcome("batched")
+            return
+        KafkaToWebhookProcessor.msg_process(msg, invocation_method, msg.topic())
+
+    @staticmethod
+    def send_batch(
+        messages: list[Message],
+        msg_values: list[dict],
+        invocation_method: dict,
+        mapping: Mapping,
+    ) -> list[int]:
+        return webhook_invoker.invoke_batch(
+            msg_values,
+            invocation_method,
+            mapping,
+            [KafkaToWebhookProcessor.get_idempotency_key(msg) for msg in messages],
+        )
 
+    def on_tick(self, force: bool) -> None:
+        if self.changelog_compactor:
+            self.changelog_compactor.tick(force)
+        self.changelog_batcher.tick(force)
+
+    @staticmethod
+    @tracer.span("message.filter")
+    def should_skip(msg: Message, invocation_method: dict) -> bool:
+        topic = msg.topic()
         if not invocation_method.pop("agent", False):
             logger.info(
                 "Skip process message"
@@ -29,7 +74,7 @@ class KafkaStreamer(BaseStreamer):
                 msg.partition(),
                 msg.offset(),
             )
-            return
+            return True
 
         # Check environment filtering if configured
         if settings.AGENT_ENVIRONMENTS:
@@ -56,7 +101,7 @@ class KafkaStreamer(BaseStreamer):
                     msg.partition(),
                     msg.offset(),
                 )
-                return
+                return True
 
             # Skip if message environment doesn't match agent's allowed environments
             if not any(env in settings.AGENT_ENVIRONMENTS for env in msg_environments):
@@ -70,7 +115,30 @@ class KafkaStreamer(BaseStreamer):
                     msg_environments,
                     settings.AGENT_ENVIRONMENTS,
                 )
-                return
+                return True
+        return False
+
+    @profiler.message()
+    @profiler.stage("streamer.msg_process")
+    def msg_process(self, msg: Message) -> None:
+        logger.info("Raw message value: %s", msg.value())
+        flight_recorder.set_message_bytes(len(msg.value()))
+        with tracer.span("message.decode"):
+            msg_value = json.loads(msg.value().decode())
+            topic = msg.topic()
+            invocation_method = self.get_invocation_method(msg_value, topic)
+
+        if self.should_skip(msg, invocation_method):
+            flight_recorder.set_outcome("skipped")
+            return
+
+        if topic == settings.KAFKA_CHANGE_LOG_TOPIC:
+            if self.changelog_compactor:
+                self.changelog_compactor.add(msg, msg_value, invocation_method)
+                flight_recorder.set_outcome("compacted")
+            else:
+                self.forward(msg, msg_value, invocation_method)
+            return
 
         KafkaToWebhookProcessor.msg_process(msg, invocation_method, topic)
 
@@ -1,43 +1,300 @@
 import base64
+import functools
 import hashlib
 import hmac
 import logging
-from typing import Any, Dict, List
+import re
+import threading
+from datetime import datetime
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List
 
+import pyjq as jq
 from Crypto.Cipher import AES
-from glom import assign, glom
 from requests import Response
 
 logger = logging.getLogger(__name__)
 
+# Compiling a jq program takes milliseconds while running it takes
+# microseconds. Compiled programs can't be shared between threads.
+JQ_CACHE_SIZE = 1024
+_jq_programs = threading.local()
 
-def response_to_dict(response: Response) -> dict:
-    response_dict = {
-        "statusCode": response.status_code,
-        "headers": dict(response.headers),
-        "text": response.text,
-        "json": None,
+
+def compile_jq(expression: str, variables: dict | None = None, version: int = 0) -> Any:
+    """
+    jq variables are bound when the program is compiled, `version` must
+    change whenever `variables` do so the cached programs are recompiled.
+    Variables are only bound to the expressions that reference them.
+    """
+    if getattr(_jq_programs, "version", None) != version:
+        _jq_programs.programs = {}
+        _jq_programs.version = version
+    programs: dict[str, Any] = _jq_programs.programs
+    program = programs.get(expression)
+    if program is None:
+        if len(programs) >= JQ_CACHE_SIZE:
+            programs.clear()
+        bound = {
+            name: value
+            for name, value in (variables or {}).items()
+            if f"${name}" in expression
+        }
+        program = programs[expression] = jq.compile(expression, vars=bound)
+    return program
+
+
+RESPONSE_FIELDS = ("statusCode", "headers", "text", "json", "truncated")
+RESPONSE_CHUNK_SIZE = 64 * 1024
+_NOT_JSON = object()
+_RESPONSE_REFERENCE = re.compile(
+    r"\bresponse\b(?:\s*\.\s*(\w+)|\s*\[\s*\"(\w+)\"\s*\])?"
+)
+# Uses of the whole input which can reach the response without naming it:
+# recursive descent and a bare `.` or `.[...]`
+_WHOLE_INPUT_REFERENCE = re.compile(r"\.\.|(?<!\w)\.(?![A-Za-z_\"])")
+# Filters and formats that aren't a path or a variable, e.g. `tojson` or `@sh`,
+# object keys and the names of function definitions are followed by a colon
+_FILTER = re.compile(r"(?<![\w.$@])@?[A-Za-z_]\w*\b(?!\s*:)")
+_BINDING = re.compile(r"\b(?:as|label)\b")
+# Keywords and builtins that don't read their input
+_JQ_KEYWORDS = frozenset(
+    {
+        "if",
+        "then",
+        "elif",
+        "else",
+        "end",
+        "and",
+        "or",
+        "reduce",
+        "foreach",
+        "try",
+        "catch",
+        "def",
+        "as",
+        "label",
+        "import",
+        "include",
+        "null",
+        "true",
+        "false",
+        "empty",
+        "now",
+        "env",
+    }
+)
+
+
+def _strip_jq_strings(expression: str) -> str | None:
+    """
+    The expression without the text of its string literals and comments,
+    the interpolated expressions are kept in parentheses. None when a string
+    or an interpolation isn't closed.
+    """
+    stripped = []
+    # Open parentheses in every interpolation that is being read
+    interpolations: list[int] = []
+    in_string = False
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        if in_string:
+            if char == "\\" and expression.startswith("(", index + 1):
+                stripped.append("(")
+                interpolations.append(0)
+                in_string = False
+                index += 2
+                continue
+            if char == "\\":
+                index += 2
+                continue
+            if char == '"':
+                stripped.append(char)
+                in_string = False
+            index += 1
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char == "#":
+            newline = expression.find("\n", index)
+            index = len(expression) if newline < 0 else newline
+            continue
+        elif interpolations and char == "(":
+            interpolations[-1] += 1
+        elif interpolations and char == ")":
+            if not interpolations[-1]:
+                interpolations.pop()
+                stripped.append(char)
+                in_string = True
+                index += 1
+                continue
+            interpolations[-1] -= 1
+        stripped.append(char)
+        index += 1
+
+    if in_string or interpolations:
+        return None
+    return "".join(stripped)
+
+
+def _uses_whole_input(expression: str) -> bool:
+    stripped = _strip_jq_strings(expression)
+    if stripped is None or _WHOLE_INPUT_REFERENCE.search(stripped):
+        return True
+    # A filter right after a pipe gets what the left side selected, unless a
+    # variable binding passes the input on to it
+    piped = not _BINDING.search(stripped)
+    for match in _FILTER.finditer(stripped):
+        if match.group().lstrip("@") in _JQ_KEYWORDS:
+            continue
+        if piped and stripped[: match.start()].rstrip().endswith("|"):
+            continue
+        return True
+    return False
+
+
+@functools.lru_cache(maxsize=256)
+def get_response_fields(expressions: tuple[str, ...]) -> frozenset[str] | None:
+    """
+    The `.response` fields the jq expressions use, None when an expression
+    uses the response in a way that needs all of them, e.g. `.response`
+    as a whole, a computed key or the whole input (`..`, `tojson`).
+    """
+    fields = set()
+    for expression in expressions:
+        if _uses_whole_input(expression):
+            return None
+        for match in _RESPONSE_REFERENCE.finditer(expression):
+            field = match.group(1) or match.group(2)
+            if field not in RESPONSE_FIELDS:
+                return None
+            fields.add(field)
+    return frozenset(fields)
+
+
+def _parse_response_json(response: Response) -> Any:
+    """Parses the body once per response, _NOT_JSON if it isn't JSON"""
+    if "_parsed_json" not in response.__dict__:
+        try:
+            response.__dict__["_parsed_json"] = response.json()
+        except ValueError:
+            logger.debug(
+                "Failed to parse response body as JSON: Response is not JSON"
+                " serializable"
+            )
+            response.__dict__["_parsed_json"] = _NOT_JSON
+    return response.__dict__["_parsed_json"]
+
+
+def get_jq_expressions(value: Any) -> Iterator[str]:
+    """The jq expressions of a mapping field, nested in dicts and lists"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from get_jq_expressions(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from get_jq_expressions(item)
+
+
+def set_response_json(response: Response, value: Any) -> None:
+    """Sets the parsed body of a response built from a Python value"""
+    response.__dict__["_parsed_json"] = value
+
+
+def response_to_dict(response: Response, fields: Collection[str] | None = None) -> dict:
+    """The response as the report mapping sees it, limited to `fields`"""
+    builders: dict[str, Callable[[], Any]] = {
+        "statusCode": lambda: response.status_code,
+        "headers": lambda: dict(response.headers),
+        "text": lambda: response.text,
+        "json": lambda: (
+            None if (parsed := _parse_response_json(response)) is _NOT_JSON else parsed
+        ),
+        "truncated": lambda: is_response_truncated(response),
+    }
+    return {
+        field: build()
+        for field, build in builders.items()
+        if fields is None or field in fields
     }
 
+
+def read_response_body(response: Response, max_size: int) -> None:
+    """
+    Reads a streamed response, keeping at most `max_size` bytes of the body.
+    The rest isn't downloaded and the response is flagged as truncated.
+    """
     try:
-        response_dict["json"] = response.json()
-    except ValueError:
-        logger.debug(
-            "Failed to parse response body as JSON: Response is not JSON serializable"
+        content, truncated = read_capped(
+            response.iter_content(RESPONSE_CHUNK_SIZE), max_size
         )
+    finally:
+        response.close()
+    response._content = content
+    if truncated:
+        set_response_truncated(response)
+
+
+def read_capped(chunks: Iterable[bytes], max_size: int) -> tuple[bytes, bool]:
+    """Joins the chunks up to `max_size` bytes, 0 for no limit"""
+    content = bytearray()
+    for chunk in chunks:
+        content += chunk
+        if max_size and len(content) > max_size:
+            del content[max_size:]
+            return bytes(content), True
+    return bytes(content), False
+
+
+def set_response_truncated(response: Response) -> None:
+    response.__dict__["_truncated"] = True
+
 
-    return response_dict
+def is_response_truncated(response: Response) -> bool:
+    return response.__dict__.get("_truncated", False)
+
+
+def get_response_preview(response: Response, size: int) -> str:
+    """The beginning of the body for logs and summaries"""
+    text = response.text
+    if len(text) > size:
+        text = f"{text[:size]}... ({len(text) - size} more characters)"
+    if is_response_truncated(response):
+        text = f"{text} (the response was truncated)"
+    return text
 
 
 def get_invocation_method_object(body: dict) -> dict:
     return body.get("payload", {}).get("action", {}).get("invocationMethod", {})
 
 
+def get_response_size(response: Response) -> int:
+    """Size of the body that was downloaded, -1 if it wasn't read"""
+    content = getattr(response, "_content", None)
+    return len(content) if isinstance(content, bytes) else -1
+
+
 def get_response_body(response: Response) -> dict | str | None:
+    parsed = _parse_response_json(response)
+    return response.text if parsed is _NOT_JSON else parsed
+
+
+def get_run_created_at(body: dict) -> float | None:
+    """Unix time the run was triggered at, if the message holds it"""
+    triggered_at = body.get("trigger", {}).get("at")
+    if not isinstance(triggered_at, str):
+        return None
     try:
-        return response.json()
+        return datetime.fromisoformat(triggered_at).timestamp()
     except ValueError:
-        return response.text
+        return None
+
+
+def is_retryable_status_code(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
 
 
 def sign_sha_256(input: str, secret: str, timestamp: str) -> str:
@@ -48,6 +305,17 @@ def sign_sha_256(input: str, secret: str, timestamp: str) -> str:
     return f"v1, {signed}"
 
 
+DecryptionPlan = dict[str | int, "DecryptionPlan | None"]
+
+
+@functools.lru_cache(maxsize=128)
+def get_key_bytes(key: str) -> bytes:
+    key_bytes = key.encode("utf-8")
+    if len(key_bytes) < 32:
+        raise ValueError("Encryption key must be at least 32 bytes")
+    return key_bytes[:32]
+
+
 def decrypt_field(encrypted_value: str, key: str) -> str:
     encrypted_data = base64.b64decode(encrypted_value)
     if len(encrypted_data) < 32:
@@ -57,25 +325,65 @@ def decrypt_field(encrypted_value: str, key: str) -> str:
     ciphertext = encrypted_data[16:-16]
     tag = encrypted_data[-16:]
 
-    key_bytes = key.encode("utf-8")
-    if len(key_bytes) < 32:
-        raise ValueError("Encryption key must be at least 32 bytes")
-    key_bytes = key_bytes[:32]
-
-    cipher = AES.new(key_bytes, AES.MODE_GCM, nonce=iv)
+    cipher = AES.new(get_key_bytes(key), AES.MODE_GCM, nonce=iv)
     decrypted = cipher.decrypt_and_verify(ciphertext, tag)
     return decrypted.decode("utf-8")
 
 
+@functools.lru_cache(maxsize=256)
+def compile_decryption_plan(fields: tuple[str, ...]) -> DecryptionPlan:
+    """
+    Merge the dotted paths into a tree, so the fields of a payload are all
+    found in one walk and paths sharing a prefix look it up once. Numeric
+    segments also index lists, the same as glom.
+    """
+    plan: DecryptionPlan = {}
+    for path in fields:
+        if not path:
+            continue
+        node = plan
+        *parents, leaf = path.split(".")
+        for segment in parents:
+            child = node.get(segment)
+            if child is None:
+                child = node[segment] = {}
+            node = child
+        if leaf not in node:
+            node[leaf] = None
+    return plan
+
+
+def _get_child(container: Any, segment: str) -> tuple[Any, Any]:
+    """Returns the container key for the segment and its value, if any"""
+    if isinstance(container, dict):
+        return segment, container.get(segment)
+    if isinstance(container, list) and segment.lstrip("-").isdigit():
+        index = int(segment)
+        if -len(container) <= index < len(container):
+            return index, container[index]
+    return None, None
+
+
+def _decrypt_plan(
+    container: Any, plan: DecryptionPlan, key: str, path: str = ""
+) -> None:
+    for segment, children in plan.items():
+        child_key, value = _get_child(container, str(segment))
+        if value is None:
+            continue
+        child_path = f"{path}.{segment}" if path else str(segment)
+        if children is not None:
+            _decrypt_plan(value, children, key, child_path)
+            continue
+        try:
+            container[child_key] = decrypt_field(value, key)
+        except Exception as e:
+            logger.warning(f"Decryption failed for '{child_path}': {e}")
+
+
 def decrypt_payload_fields(
     payload: Dict[str, Any], fields: List[str], key: str
 ) -> Dict[str, Any]:
-    for path in fields:
-        encrypted = glom(payload, path, default=None)
-        if encrypted is not None:
-            try:
-                decrypted = decrypt_field(encrypted, key)
-                assign(payload, path, decrypted)
-            except Exception as e:
-                logger.warning(f"Decryption failed for '{path}': {e}")
+    """Decrypts the fields in place, the payload is returned for convenience"""
+    _decrypt_plan(payload, compile_decryption_plan(tuple(fields)), key)
     return payload
@@ -0,0 +1,54 @@
+"""
+Times decrypt_payload_fields on payloads with many encrypted fields.
+
+    cd ./app && PYTHONPATH=./ python ../scripts/benchmark_decryption.py
+"""
+
+import base64
+import os
+import timeit
+from copy import deepcopy
+
+from Crypto.Cipher import AES
+from utils import decrypt_payload_fields
+
+KEY = "k" * 32
+ROUNDS = 200
+
+
+def encrypt(plain_text: str) -> str:
+    iv = os.urandom(16)
+    cipher = AES.new(KEY.encode("utf-8"), AES.MODE_GCM, nonce=iv)
+    ciphertext, tag = cipher.encrypt_and_digest(plain_text.encode("utf-8"))
+    return base64.b64encode(iv + ciphertext + tag).decode("utf-8")
+
+
+def build_payload(fields: int) -> tuple[dict, list[str]]:
+    secrets = {f"secret_{index}": encrypt(f"value-{index}") for index in range(fields)}
+    payload = {
+        "payload": {
+            "properties": dict(secrets),
+            "entity": {"properties": {"secrets": [dict(secrets)]}},
+        }
+    }
+    paths = [f"payload.properties.{name}" for name in secrets] + [
+        f"payload.entity.properties.secrets.0.{name}" for name in secrets
+    ]
+    return payload, paths
+
+
+def main() -> None:
+    for fields in (5, 25, 50, 100):
+        payload, paths = build_payload(fields)
+        payloads = [deepcopy(payload) for _ in range(ROUNDS)]
+        elapsed = timeit.timeit(
+            lambda: decrypt_payload_fields(payloads.pop(), paths, KEY), number=ROUNDS
+        )
+        print(
+            f"{len(paths):4d} fields: {elapsed / ROUNDS * 1000:.3f}ms per payload,"
+            f" {elapsed / ROUNDS / len(paths) * 1e6:.1f}us per field"
+        )
+
+
+if __name__ == "__main__":
+    main()
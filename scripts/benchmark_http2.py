@@ -0,0 +1,186 @@
+"""
+Compares sending webhooks with requests (the default path) against the
+HTTP/2 transport, over HTTP/1.1 and over a multiplexed HTTP/2 connection,
+against local TLS test servers. HTTP/2 is negotiated with ALPN like with
+a real destination. Needs the http2 extra (httpx[http2]) and openssl to
+create the servers' certificate.
+
+    cd ./app && PYTHONPATH=./ STREAMER_NAME=test PORT_ORG_ID=test \
+        PORT_CLIENT_ID=test PORT_CLIENT_SECRET=test \
+        python ../scripts/benchmark_http2.py
+"""
+
+import json
+import logging
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import h2.config
+import h2.connection
+import h2.events
+import requests
+from invokers.http2_transport import Http2Transport
+
+REQUESTS = 2000
+CONCURRENCY = 32
+BODY = {"action": "deploy", "properties": {f"key_{i}": "value" for i in range(20)}}
+RESPONSE = json.dumps({"status": "ok"}).encode()
+
+
+class Http1Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+class Http1Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def create_certificate(directory: str) -> tuple[str, str]:
+    cert, key = f"{directory}/cert.pem", f"{directory}/key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1"]
+        + ["-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def tls_context(cert: str, key: str, protocol: str) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    context.set_alpn_protocols([protocol])
+    return context
+
+
+def serve_h2_connection(sock: socket.socket) -> None:
+    connection = h2.connection.H2Connection(
+        h2.config.H2Configuration(client_side=False)
+    )
+    connection.initiate_connection()
+    sock.sendall(connection.data_to_send())
+    while data := sock.recv(65535):
+        for event in connection.receive_data(data):
+            if isinstance(event, h2.events.DataReceived):
+                connection.acknowledge_received_data(
+                    event.flow_controlled_length, event.stream_id
+                )
+            elif isinstance(event, h2.events.StreamEnded):
+                connection.send_headers(
+                    event.stream_id,
+                    [
+                        (":status", "200"),
+                        ("content-type", "application/json"),
+                        ("content-length", str(len(RESPONSE))),
+                    ],
+                )
+                connection.send_data(event.stream_id, RESPONSE, end_stream=True)
+        sock.sendall(connection.data_to_send())
+    sock.close()
+
+
+def start_h2_server(context: ssl.SSLContext) -> int:
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(128)
+
+    def serve(sock: socket.socket) -> None:
+        serve_h2_connection(context.wrap_socket(sock, server_side=True))
+
+    def accept() -> None:
+        while True:
+            sock, _ = server.accept()
+            threading.Thread(target=serve, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def run(name: str, send: Callable[[], int]) -> None:
+    latencies = []
+    errors = []
+
+    def timed() -> None:
+        started_at = time.perf_counter()
+        try:
+            status_code = send()
+        except requests.RequestException as e:
+            errors.append(e)
+            return
+        if status_code != 200:
+            errors.append(status_code)
+            return
+        latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(CONCURRENCY) as executor:
+        for future in [executor.submit(timed) for _ in range(REQUESTS)]:
+            future.result()
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    print(
+        f"{name:28s} {len(latencies) / elapsed:8.0f} req/s"
+        f"  p50 {latencies[len(latencies) // 2] * 1000:6.2f}ms"
+        f"  p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.2f}ms"
+        f"  errors {len(errors)}" + (f" (first: {errors[0]!r})" if errors else "")
+    )
+
+
+def main() -> None:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    cert, key = create_certificate(tempfile.mkdtemp())
+    # Trusted by httpx, passed to requests as `verify`
+    os.environ["SSL_CERT_FILE"] = cert
+
+    http1_server = Http1Server(("127.0.0.1", 0), Http1Handler)
+    # The handshakes run in the handler threads instead of the accept loop
+    http1_server.socket = tls_context(cert, key, "http/1.1").wrap_socket(
+        http1_server.socket, server_side=True, do_handshake_on_connect=False
+    )
+    threading.Thread(target=http1_server.serve_forever, daemon=True).start()
+    http1_url = f"https://127.0.0.1:{http1_server.server_port}/webhook"
+    h2_url = (
+        f"https://127.0.0.1:{start_h2_server(tls_context(cert, key, 'h2'))}/webhook"
+    )
+
+    http1_transport = Http2Transport([], max_connections=CONCURRENCY)
+    h2_transport = Http2Transport([], max_connections=CONCURRENCY)
+
+    def send_with(transport: Http2Transport, url: str) -> Callable[[], int]:
+        return lambda: transport.request(
+            "POST", url, json=BODY, headers={}, params={}, timeout=10
+        ).status_code
+
+    run(
+        "requests.request (HTTP/1.1)",
+        lambda: requests.request(
+            "POST", http1_url, json=BODY, timeout=10, verify=cert
+        ).status_code,
+    )
+    run("transport, HTTP/1.1 pool", send_with(http1_transport, http1_url))
+    run("transport, HTTP/2", send_with(h2_transport, h2_url))
+
+
+if __name__ == "__main__":
+    main()
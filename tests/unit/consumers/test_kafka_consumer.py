@@ -0,0 +1,119 @@
+from typing import Any
+from unittest import mock
+
+from confluent_kafka import TopicPartition
+from consumers.kafka_consumer import KafkaConsumer
+from consumers.topic_scheduler import TopicTask
+from core.config import settings
+
+
+class FakeMessage:
+    def __init__(self, offset: int, error: Any = None) -> None:
+        self._offset = offset
+        self._error = error
+
+    def error(self) -> Any:
+        return self._error
+
+    def topic(self) -> str:
+        return "test_org.runs"
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+
+def test_batch_is_processed_with_per_message_isolation_and_one_commit() -> None:
+    processed: list[int] = []
+    consumer = mock.MagicMock()
+    consumer.consume.return_value = [
+        FakeMessage(0),
+        FakeMessage(1),
+        FakeMessage(2, error="broker error"),
+        FakeMessage(3),
+    ]
+
+    def msg_process(msg: Any) -> None:
+        processed.append(msg.offset())
+        if msg.offset() == 1:
+            raise ValueError("bad message")
+        if msg.offset() == 3:
+            kafka_consumer.exit_gracefully()
+
+    kafka_consumer = KafkaConsumer(msg_process, consumer)
+    with mock.patch("consumers.kafka_consumer.settings.KAFKA_CONSUMER_BATCH_SIZE", 100):
+        kafka_consumer.start()
+
+    assert processed == [0, 1, 3]
+    consumer.consume.assert_called_once_with(num_messages=100, timeout=1)
+    consumer.poll.assert_not_called()
+    assert consumer.commit.call_count == 1
+    (committed,) = consumer.commit.call_args.kwargs["offsets"]
+    assert committed.offset == 4
+
+
+def test_cooperative_assignment_is_incremental_and_keeps_paused_topics() -> None:
+    consumer = mock.MagicMock()
+    consumer.assignment.return_value = [TopicPartition("test_org.runs", 0)]
+    kafka_consumer = KafkaConsumer(lambda _: None, consumer)
+    kafka_consumer._paused_topics.add("test_org.change.log")
+    added = [
+        TopicPartition("test_org.runs", 1),
+        TopicPartition("test_org.change.log", 1),
+    ]
+
+    with mock.patch.object(
+        settings, "KAFKA_CONSUMER_PARTITION_ASSIGNMENT_STRATEGY", "cooperative-sticky"
+    ), mock.patch.object(kafka_consumer, "exit_gracefully") as exit_gracefully:
+        kafka_consumer._on_assign(consumer, added)
+        # A rebalance that doesn't add partitions to this member
+        kafka_consumer._on_assign(consumer, [])
+
+    exit_gracefully.assert_not_called()
+    consumer.incremental_assign.assert_any_call(added)
+    consumer.assign.assert_not_called()
+    consumer.pause.assert_called_once_with([added[1]])
+
+
+def test_revoke_commits_processed_offsets_and_forgets_partitions() -> None:
+    consumer = mock.MagicMock()
+    kafka_consumer = KafkaConsumer(lambda _: None, consumer)
+    msg: Any = FakeMessage(5)
+    kafka_consumer.offsets.retain(msg)
+    kafka_consumer.offsets.release(msg)
+
+    kafka_consumer._on_revoke(consumer, [TopicPartition("test_org.runs", 0)])
+
+    (committed,) = consumer.commit.call_args.kwargs["offsets"]
+    assert committed.offset == 6
+    assert kafka_consumer.offsets.committable() == []
+
+
+def test_ticks_run_on_a_changelog_worker_once_at_a_time() -> None:
+    consumer = mock.MagicMock()
+    on_tick = mock.MagicMock()
+    with mock.patch.object(settings, "KAFKA_TOPIC_SCHEDULING", "strict"):
+        kafka_consumer = KafkaConsumer(lambda _: None, consumer, on_tick)
+    scheduler = kafka_consumer.scheduler
+    assert scheduler is not None
+
+    kafka_consumer._tick()
+    kafka_consumer._tick()
+
+    on_tick.assert_not_called()
+    assert scheduler.queued(settings.KAFKA_CHANGE_LOG_TOPIC) == 1
+    next_task = scheduler._next()
+    assert next_task is not None
+    topic, task = next_task
+    assert isinstance(task, TopicTask)
+    task.run()
+    scheduler._release(topic, task)
+    on_tick.assert_called_once_with(False)
+    assert scheduler.completed() == []
+
+    kafka_consumer._tick(force=True)
+    on_tick.assert_called_with(True)
+    kafka_consumer._tick()
+    assert scheduler.queued(settings.KAFKA_CHANGE_LOG_TOPIC) == 1
@@ -0,0 +1,107 @@
+import threading
+from typing import Any
+
+from consumers.topic_scheduler import TopicScheduler
+
+
+class FakeMessage:
+    def __init__(self, topic: str, offset: int, partition: int = 0) -> None:
+        self._topic = topic
+        self._offset = offset
+        self._partition = partition
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+
+def _scheduler(policy: str, weights: dict[str, int] | None = None) -> TopicScheduler:
+    return TopicScheduler(
+        lambda _: None,
+        policy,
+        {"runs": 1, "changelog": 1},
+        weights or {"runs": 1, "changelog": 1},
+    )
+
+
+def _submit(scheduler: TopicScheduler, topic: str, count: int) -> None:
+    for offset in range(count):
+        message: Any = FakeMessage(topic, offset)
+        scheduler.submit(message)
+
+
+def _order(scheduler: TopicScheduler, count: int) -> list[str]:
+    order = []
+    for _ in range(count):
+        next_message = scheduler._next()
+        assert next_message is not None
+        topic, msg = next_message
+        order.append(topic)
+        scheduler._release(topic, msg)
+    return order
+
+
+def test_strict_priority_serves_runs_first() -> None:
+    scheduler = _scheduler("strict")
+    _submit(scheduler, "changelog", 3)
+    _submit(scheduler, "runs", 2)
+
+    assert _order(scheduler, 5) == [
+        "runs",
+        "runs",
+        "changelog",
+        "changelog",
+        "changelog",
+    ]
+
+
+def test_weighted_sharing_follows_weights() -> None:
+    scheduler = _scheduler("weighted", {"runs": 3, "changelog": 1})
+    _submit(scheduler, "changelog", 10)
+    _submit(scheduler, "runs", 10)
+
+    order = _order(scheduler, 8)
+
+    assert order.count("runs") == 6
+    assert order.count("changelog") == 2
+
+
+def test_workers_process_and_complete_messages() -> None:
+    processed = []
+    done = threading.Event()
+
+    def process(msg: Any) -> None:
+        processed.append(msg.offset())
+        if len(processed) == 3:
+            done.set()
+
+    scheduler = TopicScheduler(process, "strict", {"runs": 2}, {})
+    scheduler.start()
+    _submit(scheduler, "runs", 3)
+    assert done.wait(timeout=5)
+    scheduler.stop()
+
+    assert sorted(processed) == [0, 1, 2]
+    assert sorted(msg.offset() for msg in scheduler.completed()) == [0, 1, 2]
+
+
+def test_partition_has_one_message_in_flight() -> None:
+    scheduler = TopicScheduler(lambda _: None, "strict", {"runs": 3}, {})
+    for offset, partition in enumerate([0, 0, 1, 0]):
+        message: Any = FakeMessage("runs", offset, partition)
+        scheduler.submit(message)
+
+    first = scheduler._next()
+    second = scheduler._next()
+    assert first is not None and second is not None
+    assert [first[1].offset(), second[1].offset()] == [0, 2]
+    assert scheduler._pick() is None
+
+    scheduler._release(*first)
+    third = scheduler._next()
+    assert third is not None and third[1].offset() == 1
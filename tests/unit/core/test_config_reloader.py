@@ -0,0 +1,33 @@
+import json
+from pathlib import Path
+from unittest import mock
+
+from core.config import Mapping
+from core.config_reloader import ConfigReloader
+
+
+def test_reload_swaps_mappings_in_place(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps([{"enabled": '.action == "a"', "url": ".url"}]))
+    config = [Mapping()]
+
+    with mock.patch("core.config_reloader.control_the_payload_config", config):
+        assert ConfigReloader(config_path, interval=0).reload()
+
+    assert len(config) == 1
+    assert config[0].url == ".url"
+
+
+def test_invalid_config_keeps_the_current_one(tmp_path: Path) -> None:
+    config_path = tmp_path / "config.json"
+    current = Mapping(url=".url")
+    config = [current]
+    reloader = ConfigReloader(config_path, interval=0)
+
+    with mock.patch("core.config_reloader.control_the_payload_config", config):
+        config_path.write_text(json.dumps([{"body": {"foo": ".bar +"}}]))
+        assert not reloader.reload()
+        config_path.write_text(json.dumps([{"report": {"status": 1}}, "x"]))
+        assert not reloader.reload()
+
+    assert config == [current]
@@ -0,0 +1,99 @@
+import json
+import threading
+from pathlib import Path
+
+from core.flight_recorder import FlightRecorder
+
+
+def record_message(recorder: FlightRecorder, offset: int, outcome: str) -> None:
+    recorder.begin("runs", 0, offset)
+    recorder.set_message_bytes(100 + offset)
+    recorder.set_run(f"r_{offset}", 1)
+    recorder.record_stage("invoker.request", 0.5)
+    recorder.record_stage("invoker.request", 0.25)
+    recorder.record_stage("unknown", 1)
+    if outcome:
+        recorder.set_outcome(outcome)
+    recorder.end()
+
+
+def test_keeps_the_last_messages_oldest_first(tmp_path: Path) -> None:
+    recorder = FlightRecorder(2, tmp_path)
+    slots = list(recorder._records)
+
+    for offset, outcome in enumerate(["success", "failure", ""]):
+        record_message(recorder, offset, outcome)
+
+    assert recorder._records == slots
+    assert recorder.snapshot() == [
+        {
+            "sequence": 1,
+            "startedAt": slots[1].started_at,
+            "topic": "runs",
+            "partition": 0,
+            "offset": 1,
+            "runId": "r_1",
+            "mappingIndex": 1,
+            "stages": {"invoker.request": 0.75},
+            "outcome": "failure",
+            "messageBytes": 101,
+            "responseBytes": None,
+        },
+        {
+            "sequence": 2,
+            "startedAt": slots[0].started_at,
+            "topic": "runs",
+            "partition": 0,
+            "offset": 2,
+            "runId": "r_2",
+            "mappingIndex": 1,
+            "stages": {"invoker.request": 0.75},
+            "outcome": "processed",
+            "messageBytes": 102,
+            "responseBytes": None,
+        },
+    ]
+
+
+def test_records_from_another_thread_and_dumps(tmp_path: Path) -> None:
+    recorder = FlightRecorder(4, tmp_path)
+
+    recorder.begin("runs", 3, 7)
+    current = recorder.current()
+
+    def report() -> None:
+        recorder.resume(current)
+        recorder.record_stage("port.status", 0.1)
+        recorder.resume(None)
+
+    thread = threading.Thread(target=report)
+    thread.start()
+    thread.join()
+    in_flight = recorder.snapshot()
+    recorder.end("error")
+    recorder.set_outcome("ignored once the message ended")
+
+    assert in_flight[0]["outcome"] == "inFlight"
+    dump = recorder.dump()
+    assert dump is not None
+    records = json.loads(dump.read_text())
+    assert records[0]["stages"] == {"port.status": 0.1}
+    assert records[0]["outcome"] == "error"
+
+
+def test_disabled_recorder_records_nothing(tmp_path: Path) -> None:
+    recorder = FlightRecorder(0, tmp_path)
+
+    record_message(recorder, 0, "success")
+
+    assert not recorder.enabled
+    assert recorder.snapshot() == []
+
+
+def test_dump_needs_a_path() -> None:
+    recorder = FlightRecorder(2, None)
+
+    record_message(recorder, 0, "success")
+
+    assert recorder.dump() is None
+    assert len(recorder.snapshot()) == 1
@@ -0,0 +1,106 @@
+import json
+import pstats
+import signal
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from core.profiler import Profiler
+
+
+def make_profiler(path: Path, **kwargs: float) -> Profiler:
+    options: dict[str, float] = dict(
+        sample_interval=0,
+        flush_interval=0,
+        capture_messages=2,
+        capture_seconds=30,
+    )
+    options.update(kwargs)
+    return Profiler(path, **options)  # type: ignore[arg-type]
+
+
+def handle_message() -> None:
+    sum(i * i for i in range(1000))
+
+
+def test_capture_profiles_the_next_messages(tmp_path: Path) -> None:
+    profiler = make_profiler(tmp_path)
+    handler = profiler.message()(handle_message)
+
+    handler()
+    path = profiler.start_capture()
+    assert path is not None
+    assert profiler.start_capture() is None
+    threads = [threading.Thread(target=handler) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    handler()
+
+    stats = pstats.Stats(str(path))
+    calls = [
+        stat[0]
+        for func, stat in stats.stats.items()  # type: ignore[attr-defined]
+        if func[2] == "handle_message"
+    ]
+    assert calls == [2]
+    assert path.with_suffix(".txt").exists()
+    assert profiler.start_capture() is not None
+
+
+def test_stages_and_stacks_are_written(tmp_path: Path) -> None:
+    profiler = make_profiler(tmp_path, sample_interval=0.001)
+
+    @profiler.stage("invoker.invoke")
+    def invoke() -> None:
+        time.sleep(0.01)
+
+    invoke()
+    with profiler.stage("invoker.invoke"):
+        pass
+    waiting = threading.Event()
+    sleeper = threading.Thread(target=waiting.wait, name="sleeper")
+    sleeper.start()
+    profiler.sample()
+    waiting.set()
+    sleeper.join()
+    profiler.stop()
+
+    stages = json.loads(next(tmp_path.glob("stages-*.json")).read_text())
+    assert stages["invoker.invoke"]["count"] == 2
+    assert stages["invoker.invoke"]["maxSeconds"] >= 0.01
+    stacks = next(tmp_path.glob("stacks-*.collapsed")).read_text().splitlines()
+    assert any(line.startswith("sleeper;") and line.endswith(" 1") for line in stacks)
+
+
+def test_profile_route_starts_a_capture(tmp_path: Path) -> None:
+    profiler = make_profiler(tmp_path)
+
+    status, _, body = profiler._profile_route({"messages": ["5"]})
+    conflict, _, _ = profiler._profile_route({})
+
+    assert status == 202
+    assert json.loads(body)["path"].startswith(str(tmp_path))
+    assert conflict == 409
+    assert profiler._capture is not None and profiler._capture.messages == 5
+
+
+def test_profiler_without_path_writes_nothing(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    profiler = Profiler(None, 0, 60, 2, 30)
+    handler = signal.getsignal(signal.SIGUSR1)
+
+    profiler.start()
+    with profiler.stage("invoker.request"):
+        pass
+    assert profiler.start_capture() is None
+    profiler.stop()
+
+    assert signal.getsignal(signal.SIGUSR1) is handler
+    assert profiler._threads == []
+    assert "invoker.request" in profiler.stages.snapshot()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+from pathlib import Path
+from unittest import mock
+
+from core.secret_registry import SecretRegistry
+from utils import compile_jq
+
+GITLAB_TOKEN = (
+    ".payload.action.invocationMethod.groupName as $gitlab_group"
+    " | .payload.action.invocationMethod.projectName as $gitlab_project"
+    ' | $secrets[($gitlab_group | gsub("/"; "_")) + "_" + $gitlab_project]'
+)
+
+
+def test_later_sources_override_the_environment(tmp_path: Path) -> None:
+    secrets_file = tmp_path / "secrets.json"
+    secrets_file.write_text(json.dumps({"group_a": "from-file", "group_b": "b"}))
+    secrets_dir = tmp_path / "secrets"
+    secrets_dir.mkdir()
+    (secrets_dir / "group_a").write_text("from-dir\n")
+
+    with mock.patch.dict(
+        os.environ,
+        {
+            "SECRET_group_a": "from-env",
+            "SECRET_group_c": "c",
+            "group_d": "d",
+            "group_e": "e",
+        },
+    ):
+        registry = SecretRegistry(
+            secrets_file,
+            secrets_dir,
+            refresh_interval=0,
+            env_prefix="SECRET_",
+            env_names=["group_e", "group_f"],
+        )
+
+    assert registry.secrets["group_a"] == "from-dir"
+    assert registry.secrets["group_b"] == "b"
+    assert registry.secrets["group_c"] == "c"
+    assert "group_d" not in registry.secrets
+    assert registry.secrets["group_e"] == "e"
+    assert "group_f" not in registry.secrets
+    assert "SECRET_group_c" not in registry.secrets
+
+
+def test_mappings_read_refreshed_secrets(tmp_path: Path) -> None:
+    (tmp_path / "sub_group_project").write_text("token-1")
+    registry = SecretRegistry(None, tmp_path, refresh_interval=0)
+    body = {
+        "payload": {
+            "action": {
+                "invocationMethod": {"groupName": "sub/group", "projectName": "project"}
+            }
+        }
+    }
+
+    def token() -> str:
+        return compile_jq(
+            GITLAB_TOKEN, {"secrets": registry.secrets}, registry.version
+        ).first(body)
+
+    assert token() == "token-1"
+
+    (tmp_path / "sub_group_project").write_text("token-22")
+    assert registry._get_sources_state() != registry._sources_state
+    registry.load()
+
+    assert token() == "token-22"
+
+
+def test_registries_do_not_share_compiled_programs(tmp_path: Path) -> None:
+    registries = []
+    for token in ["token-a", "token-b"]:
+        secrets_file = tmp_path / f"{token}.json"
+        secrets_file.write_text(json.dumps({"group_project": token}))
+        registries.append(SecretRegistry(secrets_file, None, refresh_interval=0))
+
+    tokens = [
+        compile_jq(
+            '$secrets["group_project"]', {"secrets": registry.secrets}, registry.version
+        ).first({})
+        for registry in registries
+    ]
+
+    assert tokens == ["token-a", "token-b"]
+
+
+def test_default_gitlab_mapping_reads_the_registry(tmp_path: Path) -> None:
+    config = json.loads(
+        (
+            Path(__file__).parents[3] / "app" / "control_the_payload_config.json"
+        ).read_text()
+    )
+    (gitlab,) = [
+        mapping for mapping in config if '"GITLAB"' in str(mapping.get("enabled"))
+    ]
+    assert not re.search(r"\benv\b", json.dumps(gitlab))
+    body = {
+        "payload": {
+            "action": {
+                "invocationMethod": {"groupName": "sub/group", "projectName": "project"}
+            }
+        }
+    }
+
+    with mock.patch.dict(
+        os.environ,
+        {"GITLAB_URL": "https://gitlab.example.com/", "sub_group_project": "token"},
+    ):
+        registry = SecretRegistry(
+            None,
+            None,
+            refresh_interval=0,
+            env_names=["GITLAB_URL", "sub_group_project"],
+        )
+    secrets, version = registry.snapshot
+
+    def evaluate(expression: str) -> str:
+        return compile_jq(expression, {"secrets": secrets}, version).first(body)
+
+    assert evaluate(gitlab["url"]) == (
+        "https://gitlab.example.com/api/v4/projects/sub%2Fgroup%2Fproject"
+        "/trigger/pipeline"
+    )
+    assert evaluate(gitlab["body"]["token"]) == "token"
@@ -0,0 +1,29 @@
+from unittest import mock
+
+from core.shutdown import ShutdownCoordinator
+
+
+def test_phases_share_the_deadline() -> None:
+    coordinator = ShutdownCoordinator(timeout=10)
+
+    with mock.patch("core.shutdown.time.monotonic", return_value=100):
+        coordinator.begin()
+    with mock.patch("core.shutdown.time.monotonic", return_value=104):
+        assert coordinator.remaining() == 6
+        # A second signal doesn't move the deadline
+        coordinator.begin()
+    with mock.patch("core.shutdown.time.monotonic", return_value=112):
+        assert coordinator.remaining() == 0
+
+
+def test_failing_phase_does_not_stop_the_shutdown() -> None:
+    coordinator = ShutdownCoordinator(timeout=10)
+    phases = []
+
+    with coordinator.phase("flush"):
+        phases.append("flush")
+        raise RuntimeError("broker is gone")
+    with coordinator.phase("close"):
+        phases.append("close")
+
+    assert phases == ["flush", "close"]
@@ -0,0 +1,129 @@
+import json
+import threading
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from core.tracing import SPAN_KIND_CONSUMER, SpanExporter, Tracer
+
+
+def make_tracer(
+    tmp_path: Path, sample_ratio: float = 1, max_queued: int = 10
+) -> Tracer:
+    return Tracer(
+        sample_ratio,
+        SpanExporter(tmp_path / "spans.jsonl", "", 60, max_queued, "port-agent"),
+    )
+
+
+def read_spans(path: Path) -> list[dict]:
+    return [
+        span
+        for line in path.read_text().splitlines()
+        for resource_spans in json.loads(line)["resourceSpans"]
+        for scope_spans in resource_spans["scopeSpans"]
+        for span in scope_spans["spans"]
+    ]
+
+
+def test_spans_are_exported_as_otlp_and_tied_by_run_id(tmp_path: Path) -> None:
+    tracer = make_tracer(tmp_path)
+    headers: dict[str, str] = {}
+
+    @tracer.span("invoker.find_mapping")
+    def find_mapping() -> str:
+        return "mapping"
+
+    with tracer.trace(
+        "kafka.receive", {"messaging.kafka.message.offset": 3}, SPAN_KIND_CONSUMER
+    ):
+        tracer.set_run_id("r_1")
+        assert find_mapping() == "mapping"
+        with tracer.span("webhook.request"):
+            tracer.inject(headers)
+            tracer.set_attribute("http.response.status_code", 200)
+        current = tracer.current()
+
+        def report_status() -> None:
+            tracer.resume(current)
+            with tracer.span("port.report_status"):
+                pass
+            tracer.resume(None)
+
+        thread = threading.Thread(target=report_status)
+        thread.start()
+        thread.join()
+    tracer.stop()
+
+    spans = {span["name"]: span for span in read_spans(tmp_path / "spans.jsonl")}
+    root = spans["kafka.receive"]
+    assert set(spans) == {
+        "kafka.receive",
+        "invoker.find_mapping",
+        "webhook.request",
+        "port.report_status",
+    }
+    assert "parentSpanId" not in root
+    assert root["kind"] == SPAN_KIND_CONSUMER
+    assert {
+        "key": "messaging.kafka.message.offset",
+        "value": {"intValue": "3"},
+    } in root["attributes"]
+    for name in ["invoker.find_mapping", "webhook.request", "port.report_status"]:
+        assert spans[name]["traceId"] == root["traceId"]
+        assert spans[name]["parentSpanId"] == root["spanId"]
+        assert {"key": "port.run_id", "value": {"stringValue": "r_1"}} in spans[name][
+            "attributes"
+        ]
+    request = spans["webhook.request"]
+    assert headers == {"traceparent": f"00-{root['traceId']}-{request['spanId']}-01"}
+    assert int(request["endTimeUnixNano"]) >= int(request["startTimeUnixNano"])
+
+
+def test_failed_span_has_error_status(tmp_path: Path) -> None:
+    tracer = make_tracer(tmp_path)
+
+    with pytest.raises(ValueError):
+        with tracer.trace("kafka.receive"):
+            raise ValueError("bad message")
+    tracer.exporter.flush()
+
+    [span] = read_spans(tmp_path / "spans.jsonl")
+    assert span["status"] == {"code": 2, "message": "ValueError: bad message"}
+
+
+def test_unsampled_traces_record_nothing(tmp_path: Path) -> None:
+    tracer = make_tracer(tmp_path, sample_ratio=0.000001)
+    headers: dict[str, str] = {}
+
+    with tracer.trace("kafka.receive"):
+        with tracer.span("webhook.request"):
+            tracer.inject(headers)
+    tracer.exporter.flush()
+
+    assert headers == {}
+    assert not (tmp_path / "spans.jsonl").exists()
+
+
+def test_traces_are_dropped_when_the_queue_is_full(tmp_path: Path) -> None:
+    tracer = make_tracer(tmp_path, max_queued=1)
+
+    for _ in range(3):
+        with tracer.trace("kafka.receive"):
+            pass
+    tracer.exporter.flush()
+
+    assert len(read_spans(tmp_path / "spans.jsonl")) == 1
+
+
+def test_stop_bounds_the_last_export_by_the_timeout(tmp_path: Path) -> None:
+    tracer = Tracer(1, SpanExporter(None, "http://collector/v1/traces", 60, 10, "a"))
+    with tracer.trace("kafka.receive"):
+        pass
+
+    with mock.patch("core.tracing.requests.post") as post:
+        tracer.stop(timeout=0)
+        assert not post.called
+        tracer.stop(timeout=2)
+
+    assert 0 < post.call_args.kwargs["timeout"] <= 2
@@ -0,0 +1,75 @@
+from unittest import mock
+
+from core.metrics import metrics
+from invokers.concurrency_limiters import (
+    AdaptiveConcurrencyLimiter,
+    FixedConcurrencyLimiter,
+)
+
+
+def _limiter(**kwargs: float) -> AdaptiveConcurrencyLimiter:
+    defaults: dict = {
+        "initial_limit": 4,
+        "min_limit": 1,
+        "max_limit": 8,
+        "latency_target": 1.0,
+        "error_rate_target": 0.5,
+        "backoff_ratio": 0.5,
+    }
+    return AdaptiveConcurrencyLimiter("api.example.com", **{**defaults, **kwargs})
+
+
+def _call(limiter: AdaptiveConcurrencyLimiter, duration: float, failed: bool) -> None:
+    assert limiter.acquire(timeout=0)
+    limiter.release(duration, failed)
+
+
+def test_adaptive_limit_grows_additively_while_saturated() -> None:
+    limiter = _limiter(initial_limit=2)
+
+    for _ in range(10):
+        _call(limiter, 0.1, False)
+
+    assert 2 < limiter.limit <= 8
+
+
+def test_adaptive_limit_backs_off_once_per_latency_target() -> None:
+    limiter = _limiter()
+
+    with mock.patch("invokers.concurrency_limiters.time.monotonic") as monotonic:
+        monotonic.return_value = 100.0
+        _call(limiter, 0.1, True)
+        assert limiter.limit == 2
+        # A burst of failures within the same latency target backs off once
+        _call(limiter, 0.1, True)
+        assert limiter.limit == 2
+
+        monotonic.return_value = 102.0
+        _call(limiter, 5.0, False)
+        assert limiter.limit == 1
+
+
+def test_adaptive_limit_rejects_above_limit_and_exposes_metrics() -> None:
+    limiter = _limiter(initial_limit=1)
+
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0)
+    assert (
+        metrics.gauge("port_agent_destination_in_flight", "").get(
+            host="api.example.com"
+        )
+        == 1
+    )
+    assert 'port_agent_destination_concurrency_limit{host="api.example.com"} 1.0' in (
+        metrics.render()
+    )
+
+
+def test_fixed_limiter() -> None:
+    limiter = FixedConcurrencyLimiter("fixed.example.com", 2)
+
+    assert limiter.acquire(timeout=0)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0)
+    limiter.release(0.1, False)
+    assert limiter.acquire(timeout=0)
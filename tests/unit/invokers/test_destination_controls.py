@@ -0,0 +1,138 @@
+from typing import Any
+from unittest import mock
+
+import pytest
+from core.config import DestinationPolicy, Mapping
+from invokers.destination_controls import (
+    CircuitState,
+    DestinationControls,
+    DestinationUnavailableError,
+)
+from invokers.webhook_invoker import RequestPayload, WebhookInvoker
+
+
+def _policy(**overrides: Any) -> DestinationPolicy:
+    defaults: dict[str, Any] = {
+        "minimumCalls": 2,
+        "windowSize": 4,
+        "failureRateThreshold": 0.5,
+        "openDuration": 60,
+        "halfOpenMaxCalls": 1,
+    }
+    return DestinationPolicy(**{**defaults, **overrides})
+
+
+def _fail(controls: DestinationControls, url: str, policy: DestinationPolicy) -> None:
+    with controls.guard(url, policy) as call:
+        call.record_status(False, 503)
+
+
+def test_circuit_opens_on_failure_rate_and_fast_fails() -> None:
+    controls = DestinationControls()
+    policy = _policy()
+    url = "https://gitlab.example.com/api/v4/projects/1/trigger/pipeline"
+
+    _fail(controls, url, policy)
+    _fail(controls, url, policy)
+
+    assert controls.get_guard(url, policy).breaker.state == CircuitState.OPEN
+    with pytest.raises(DestinationUnavailableError, match="circuit breaker is open"):
+        with controls.guard(url, policy):
+            pass
+
+    # Other hosts are not affected by the open circuit
+    with controls.guard("https://other.example.com/hook", policy) as call:
+        call.record_status(True, 200)
+
+
+def test_client_errors_do_not_open_circuit() -> None:
+    controls = DestinationControls()
+    policy = _policy()
+    url = "https://api.example.com/hook"
+
+    for _ in range(4):
+        with controls.guard(url, policy) as call:
+            call.record_status(False, 404)
+
+    assert controls.get_guard(url, policy).breaker.state == CircuitState.CLOSED
+
+
+def test_half_open_probe_closes_circuit() -> None:
+    controls = DestinationControls()
+    policy = _policy(openDuration=10)
+    url = "https://api.example.com/hook"
+
+    with mock.patch("invokers.destination_controls.time.monotonic") as monotonic:
+        monotonic.return_value = 100.0
+        _fail(controls, url, policy)
+        _fail(controls, url, policy)
+        breaker = controls.get_guard(url, policy).breaker
+        assert breaker.state == CircuitState.OPEN
+
+        monotonic.return_value = 111.0
+        with controls.guard(url, policy) as call:
+            assert breaker.state == CircuitState.HALF_OPEN
+            # Only a single probe is allowed while half-open
+            with pytest.raises(DestinationUnavailableError, match="half-open"):
+                with controls.guard(url, policy):
+                    pass
+            call.record_status(True, 200)
+
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_max_concurrency_fast_fails() -> None:
+    controls = DestinationControls()
+    policy = _policy(maxConcurrency=1, acquireTimeout=0)
+    url = "https://api.example.com/hook"
+
+    with controls.guard(url, policy):
+        with pytest.raises(DestinationUnavailableError, match="max concurrency"):
+            with controls.guard(url, policy):
+                pass
+
+
+def test_mappings_with_different_policies_share_the_host_guard() -> None:
+    controls = DestinationControls()
+    url = "https://api.example.com/hook"
+
+    with controls.guard(url, _policy(maxConcurrency=1, acquireTimeout=0)):
+        with pytest.raises(DestinationUnavailableError, match="max concurrency"):
+            with controls.guard(url, _policy(maxConcurrency=5, acquireTimeout=0)):
+                pass
+
+    assert (
+        controls.get_guard(url, _policy(maxConcurrency=5)).policy.max_concurrency == 1
+    )
+
+
+def test_invoke_run_reports_failure_when_destination_unavailable() -> None:
+    invoker = WebhookInvoker()
+    mapping = Mapping(url='"https://api.example.com/hook"')
+    error = DestinationUnavailableError("api.example.com", "circuit breaker is open")
+
+    with mock.patch.object(
+        invoker, "_prepare_payload"
+    ) as prepare_payload, mock.patch.object(
+        invoker, "_request", side_effect=error
+    ), mock.patch.object(
+        invoker, "_report_run_status"
+    ) as report_run_status, mock.patch(
+        "invokers.webhook_invoker.run_logger_factory"
+    ):
+        prepare_payload.return_value = RequestPayload(
+            method="POST",
+            url="https://api.example.com/hook",
+            body={},
+            headers={},
+            query={},
+        )
+        with pytest.raises(DestinationUnavailableError):
+            invoker._invoke_run("r_1", mapping, {}, {})
+
+    report_run_status.assert_called_once()
+    assert report_run_status.call_args.args[1] == {
+        "status": "FAILURE",
+        "summary": "Failed to invoke the webhook. Destination api.example.com is"
+        " unavailable: circuit breaker is open.",
+    }
@@ -0,0 +1,262 @@
+import json
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+from unittest import mock
+
+import pytest
+from invokers.http2_transport import Http2Transport, http_version_counter
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/moved":
+            self.send_response(307)
+            self.send_header("Location", "/hook")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        response = json.dumps({"echo": json.loads(body), "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JsonHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def serve_h2_connection(sock: socket.socket) -> None:
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    connection = h2.connection.H2Connection(
+        h2.config.H2Configuration(client_side=False)
+    )
+    connection.initiate_connection()
+    sock.sendall(connection.data_to_send())
+    paths: dict[int, str] = {}
+    while data := sock.recv(65535):
+        for event in connection.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                paths[event.stream_id] = dict(event.headers)[b":path"].decode()
+            elif isinstance(event, h2.events.StreamEnded):
+                response = json.dumps({"path": paths.pop(event.stream_id)}).encode()
+                connection.send_headers(
+                    event.stream_id,
+                    [
+                        (":status", "200"),
+                        ("content-type", "application/json"),
+                        ("content-length", str(len(response))),
+                    ],
+                )
+                connection.send_data(event.stream_id, response, end_stream=True)
+        sock.sendall(connection.data_to_send())
+    sock.close()
+
+
+@pytest.fixture
+def h2_server_url(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    """An HTTP/2 only server over TLS, negotiated with ALPN"""
+    pytest.importorskip("h2")
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed to create the server certificate")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-keyout", str(key), "-out", str(cert), "-subj", "/CN=127.0.0.1"]
+        + ["-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    monkeypatch.setenv("SSL_CERT_FILE", str(cert))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    context.set_alpn_protocols(["h2"])
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def accept() -> None:
+        while True:
+            try:
+                sock, _ = server.accept()
+                tls_sock = context.wrap_socket(sock, server_side=True)
+            except OSError:
+                return
+            threading.Thread(
+                target=serve_h2_connection, args=(tls_sock,), daemon=True
+            ).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"https://127.0.0.1:{server.getsockname()[1]}"
+    server.close()
+
+
+@pytest.mark.parametrize(
+    "url, http2, enabled",
+    [
+        ("https://gateway.internal/api", None, True),
+        ("https://gateway.internal:8443/api", None, True),
+        ("https://other.internal/api", None, False),
+        ("https://other.internal/api", True, True),
+        ("https://gateway.internal/api", False, False),
+    ],
+)
+def test_is_enabled_per_host_and_mapping(
+    url: str, http2: bool | None, enabled: bool
+) -> None:
+    transport = Http2Transport(["gateway.internal"], max_connections=10)
+
+    with mock.patch.object(Http2Transport, "available", True):
+        assert transport.is_enabled(url, http2) is enabled
+
+
+def test_falls_back_when_httpx_is_missing() -> None:
+    transport = Http2Transport(["gateway.internal"], max_connections=10)
+
+    with mock.patch.object(Http2Transport, "available", False):
+        assert not transport.is_enabled("https://gateway.internal/api")
+
+
+def test_proxied_urls_are_left_to_requests(monkeypatch: pytest.MonkeyPatch) -> None:
+    transport = Http2Transport(["gateway.internal"], max_connections=10)
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.internal:3128")
+    monkeypatch.setenv("NO_PROXY", "direct.internal")
+
+    with mock.patch.object(Http2Transport, "available", True):
+        assert not transport.is_enabled("https://gateway.internal/api")
+        assert transport.is_enabled("https://direct.internal/api", True)
+
+
+def test_streams_open_in_the_order_of_their_ids() -> None:
+    pytest.importorskip("httpx")
+    import h2.config
+    from invokers.http2_connection import LockedH2Connection
+
+    state = LockedH2Connection(h2.config.H2Configuration(client_side=True))
+    state.initiate_connection()
+    first, second, third = [state.get_next_available_stream_id() for _ in range(3)]
+    headers = [(":method", "GET"), (":authority", "x"), (":scheme", "https")]
+    opened = []
+
+    def open_stream(stream_id: int) -> None:
+        state.send_headers(stream_id, headers + [(":path", "/")], end_stream=True)
+        opened.append(stream_id)
+
+    waiting = threading.Thread(target=open_stream, args=(third,))
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive()
+
+    # The first stream failed before sending its headers
+    state.release_stream_id(first)
+    open_stream(second)
+    waiting.join(5)
+
+    assert opened == [second, third]
+
+
+def test_request_falls_back_to_http1(server_url: str) -> None:
+    pytest.importorskip("httpx")
+    transport = Http2Transport([], max_connections=10)
+
+    res = transport.request(
+        "POST",
+        f"{server_url}/hook",
+        json={"runId": "r_1"},
+        headers={"X-Port-Signature": "v1, sig"},
+        params={"a": "b"},
+        timeout=5,
+    )
+    truncated = transport.request(
+        "POST", server_url, json={}, headers={}, params={}, timeout=5, max_size=10
+    )
+    transport.close()
+
+    assert res.ok
+    assert res.json() == {"echo": {"runId": "r_1"}, "path": "/hook?a=b"}
+    assert res.headers["content-type"] == "application/json"
+    assert len(truncated.content) == 10
+
+
+def test_request_follows_redirects(server_url: str) -> None:
+    pytest.importorskip("httpx")
+    transport = Http2Transport([], max_connections=10)
+
+    res = transport.request(
+        "POST",
+        f"{server_url}/moved",
+        json={"runId": "r_1"},
+        headers={},
+        params={},
+        timeout=5,
+    )
+    transport.close()
+
+    assert res.status_code == 200
+    assert res.json() == {"echo": {"runId": "r_1"}, "path": "/hook"}
+    assert res.url == f"{server_url}/hook"
+
+
+def test_request_negotiates_http2(h2_server_url: str) -> None:
+    transport = Http2Transport([], max_connections=10)
+    sent_before = http_version_counter.get(http_version="HTTP/2")
+
+    responses = [
+        transport.request(
+            "POST",
+            f"{h2_server_url}/hook/{index}",
+            json={},
+            headers={},
+            params={},
+            timeout=5,
+        )
+        for index in range(3)
+    ]
+    transport.close()
+
+    assert [res.json() for res in responses] == [
+        {"path": f"/hook/{index}"} for index in range(3)
+    ]
+    assert http_version_counter.get(http_version="HTTP/2") == sent_before + 3
+
+
+def test_concurrent_requests_share_the_http2_connection(h2_server_url: str) -> None:
+    transport = Http2Transport([], max_connections=10)
+    start = threading.Barrier(16)
+
+    def send(index: int) -> dict:
+        start.wait()
+        return transport.request(
+            "POST",
+            f"{h2_server_url}/hook/{index}",
+            json={"index": index},
+            headers={},
+            params={},
+            timeout=5,
+        ).json()
+
+    with ThreadPoolExecutor(16) as executor:
+        responses = list(executor.map(send, range(64)))
+    transport.close()
+
+    assert responses == [{"path": f"/hook/{index}"} for index in range(64)]
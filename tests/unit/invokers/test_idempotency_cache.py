@@ -0,0 +1,71 @@
+from pathlib import Path
+from unittest import mock
+
+from invokers.idempotency_cache import IdempotencyCache
+from invokers.webhook_invoker import WebhookInvoker
+from pytest_mock import MockFixture
+
+RUN_MSG = {"context": {"runId": "r_1"}, "payload": {}}
+INVOCATION_METHOD = {"type": "WEBHOOK", "url": "https://api.example.com/hook"}
+
+
+def test_entries_expire_after_ttl() -> None:
+    cache = IdempotencyCache(ttl=10, max_entries=10)
+
+    with mock.patch("invokers.idempotency_cache.time.time", return_value=100):
+        cache.add("run:r_1")
+    with mock.patch("invokers.idempotency_cache.time.time", return_value=105):
+        assert cache.contains("run:r_1")
+    with mock.patch("invokers.idempotency_cache.time.time", return_value=111):
+        assert not cache.contains("run:r_1")
+
+
+def test_least_recently_used_entries_are_evicted() -> None:
+    cache = IdempotencyCache(ttl=60, max_entries=2)
+    cache.add("run:r_1")
+    cache.add("run:r_2")
+    assert cache.contains("run:r_1")
+    cache.add("run:r_3")
+
+    assert cache.contains("run:r_1")
+    assert not cache.contains("run:r_2")
+    assert cache.contains("run:r_3")
+
+
+def test_entries_survive_restart(tmp_path: Path) -> None:
+    db_path = tmp_path / "idempotency.db"
+    cache = IdempotencyCache(ttl=60, max_entries=1, path=db_path)
+    cache.add("run:r_1")
+    cache.add("run:r_2")
+    cache.close()
+
+    cache = IdempotencyCache(ttl=60, max_entries=1, path=db_path)
+    assert cache.contains("run:r_1")
+    assert cache.contains("run:r_2")
+    assert not cache.contains("run:r_3")
+
+
+def test_disabled_cache_never_matches() -> None:
+    cache = IdempotencyCache(ttl=0, max_entries=10)
+    cache.add("run:r_1")
+
+    assert not cache.contains("run:r_1")
+
+
+def test_invoke_skips_replayed_run(mocker: MockFixture) -> None:
+    mocker.patch(
+        "invokers.webhook_invoker.idempotency_cache",
+        IdempotencyCache(ttl=60, max_entries=10),
+    )
+    mocker.patch.object(
+        WebhookInvoker, "validate_incoming_signature", return_value=True
+    )
+    mocker.patch.object(WebhookInvoker, "_find_mapping", return_value=mock.MagicMock())
+    invoke_run = mocker.patch.object(WebhookInvoker, "_invoke_run")
+    invoker = WebhookInvoker()
+
+    invoker.invoke(dict(RUN_MSG), INVOCATION_METHOD)
+    invoker.invoke(dict(RUN_MSG), INVOCATION_METHOD)
+    invoker.invoke(dict(RUN_MSG), INVOCATION_METHOD, attempt=2)
+
+    assert invoke_run.call_count == 2
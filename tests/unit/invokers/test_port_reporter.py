@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+from invokers.port_reporter import PortReporter
+
+
+def test_updates_are_concurrent_and_status_follows_the_response() -> None:
+    reporter = PortReporter(concurrency=4)
+    events: list[str] = []
+    logged = threading.Event()
+    release_response = threading.Event()
+
+    def report_response() -> None:
+        assert release_response.wait(5)
+        events.append("response")
+
+    def report_status() -> None:
+        events.append("status")
+
+    def log(message: str) -> None:
+        events.append(message)
+        if message == "log 2":
+            logged.set()
+
+    with reporter.group() as reports:
+        run_logger = reports.run_logger(log)
+        response = reports.submit(report_response)
+        run_logger("log 1")
+        run_logger("log 2")
+        reports.submit(report_status, after=response)
+        reports.submit(events.append, "finished", after=reports.barrier())
+        # The logs don't wait for the response patch
+        assert logged.wait(5)
+        assert events == ["log 1", "log 2"]
+        release_response.set()
+
+    assert events == ["log 1", "log 2", "response", "status", "finished"]
+    reporter.stop()
+
+
+@pytest.mark.parametrize("concurrency", [0, 2])
+def test_group_raises_the_first_failure(concurrency: int) -> None:
+    reporter = PortReporter(concurrency)
+    sent: list[str] = []
+
+    def fail() -> None:
+        raise ConnectionError("Port is unreachable")
+
+    with pytest.raises(ConnectionError):
+        with reporter.group() as reports:
+            failed = reports.submit(fail)
+            reports.submit(sent.append, "status", after=failed)
+
+    assert sent == ["status"]
+    reporter.stop()
+
+
+def test_wait_covers_the_updates_submitted_by_updates() -> None:
+    reporter = PortReporter(concurrency=2)
+    events: list[str] = []
+
+    with reporter.group() as reports:
+        run_logger = reports.run_logger(events.append)
+
+        def report_status() -> None:
+            reports.submit(run_logger, "status failed to be reported")
+
+        reports.submit(report_status)
+
+    assert events == ["status failed to be reported"]
+    reporter.stop()
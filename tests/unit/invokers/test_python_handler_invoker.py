@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from typing import Any
+from unittest import mock
+
+from core.config import Mapping
+from invokers.python_handler_invoker import PythonHandlerInvoker, load_handler
+from invokers.webhook_invoker import RequestPayload, WebhookInvoker
+
+from app.utils import get_response_body, is_retryable_status_code
+
+
+def test_load_handler_from_module_path() -> None:
+    assert load_handler("json:dumps") is json.dumps
+    assert load_handler("json:JSONDecoder.decode") is json.JSONDecoder.decode
+
+
+def test_invoke_reports_the_handler_result() -> None:
+    calls = []
+
+    def handler(request: dict) -> dict:
+        calls.append(request)
+        return {"id": request["body"]["runId"], "url": "http://ci/1"}
+
+    invoker = WebhookInvoker()
+    mapping = Mapping(
+        handler="ci:trigger",
+        report={"link": ".response.json.url", "externalRunId": ".response.json.id"},
+    )
+    request = RequestPayload(
+        method="POST", url="", body={"runId": "r_1"}, headers={}, query={}
+    )
+
+    with mock.patch(
+        "invokers.python_handler_invoker.load_handler", return_value=handler
+    ), mock.patch("requests.request") as send:
+        res = invoker._send(request, lambda _: None, mapping)
+        report = invoker._prepare_report(mapping, res, request, {})
+
+    send.assert_not_called()
+    assert calls[0]["body"] == {"runId": "r_1"}
+    assert res.ok
+    assert get_response_body(res) == {"id": "r_1", "url": "http://ci/1"}
+    assert report.link == "http://ci/1"
+    assert report.external_run_id == "r_1"
+
+
+def test_failures_and_timeouts_are_error_responses() -> None:
+    def failing(_: Any) -> None:
+        raise RuntimeError("boom")
+
+    def slow(_: Any) -> None:
+        time.sleep(0.5)
+
+    invoker = PythonHandlerInvoker(max_workers=2)
+    with mock.patch(
+        "invokers.python_handler_invoker.load_handler", return_value=failing
+    ):
+        failed = invoker.invoke({}, {"handler": "failing"})
+    with mock.patch(
+        "invokers.python_handler_invoker.load_handler", return_value=slow
+    ), mock.patch(
+        "invokers.python_handler_invoker.settings.WEBHOOK_INVOKER_TIMEOUT", 0.05
+    ):
+        timed_out = invoker.invoke({}, {"handler": "slow"})
+    missing = invoker.invoke({}, {"handler": "not_a_module_xyz:run"})
+    invoker.stop()
+
+    assert (failed.status_code, failed.text) == (500, "The handler failed: boom")
+    assert timed_out.status_code == 408
+    assert missing.status_code == 500
+
+
+def test_timed_out_handler_is_not_retried_and_holds_its_worker() -> None:
+    calls = []
+    release = threading.Event()
+
+    def blocking(_: Any) -> None:
+        calls.append(1)
+        release.wait()
+
+    invoker = PythonHandlerInvoker(max_workers=1)
+    with mock.patch(
+        "invokers.python_handler_invoker.load_handler", return_value=blocking
+    ), mock.patch(
+        "invokers.python_handler_invoker.settings.WEBHOOK_INVOKER_TIMEOUT", 0.05
+    ):
+        timed_out = invoker.invoke({}, {"handler": "blocking"})
+        refused = invoker.invoke({}, {"handler": "blocking"})
+        stuck = invoker.stuck()
+        release.set()
+        invoker.executor.shutdown(wait=True)
+
+    assert timed_out.status_code == 408
+    assert not is_retryable_status_code(timed_out.status_code)
+    assert refused.status_code == 503
+    assert calls == [1]
+    assert stuck == 1
+    assert invoker.stuck() == 0
+
+
+def test_concurrent_calls_share_one_executor() -> None:
+    invoker = PythonHandlerInvoker(max_workers=2)
+    start = threading.Barrier(8)
+    executors = []
+
+    def get_executor() -> None:
+        start.wait()
+        executors.append(invoker.executor)
+
+    def slow_executor(**_: Any) -> object:
+        time.sleep(0.01)
+        return object()
+
+    threads = [threading.Thread(target=get_executor) for _ in range(8)]
+    with mock.patch(
+        "invokers.python_handler_invoker.ThreadPoolExecutor", side_effect=slow_executor
+    ):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len({id(executor) for executor in executors}) == 1
@@ -0,0 +1,90 @@
+import json
+import threading
+from pathlib import Path
+from unittest import mock
+
+from core.config import Mapping
+from invokers.dead_letter import FileDeadLetterSink
+from invokers.retry_scheduler import RetryScheduler, RetryTask
+from invokers.webhook_invoker import WebhookInvoker
+
+RUN_MSG = {"context": {"runId": "r_1"}, "payload": {}}
+INVOCATION_METHOD = {"type": "WEBHOOK", "url": "https://api.example.com/hook"}
+
+
+def _scheduler(tmp_path: Path, **kwargs: object) -> RetryScheduler:
+    defaults: dict = {
+        "max_attempts": 3,
+        "base_delay": 0,
+        "max_delay": 0,
+        "max_queue_size": 10,
+        "dead_letter_sink": FileDeadLetterSink(tmp_path / "dead_letter.jsonl"),
+    }
+    return RetryScheduler(**{**defaults, **kwargs})
+
+
+def test_backoff_is_exponential_and_capped(tmp_path: Path) -> None:
+    scheduler = _scheduler(tmp_path, base_delay=1, max_delay=5)
+
+    assert 0.5 <= scheduler.backoff(1) <= 1
+    assert 2 <= scheduler.backoff(3) <= 4
+    assert 2.5 <= scheduler.backoff(10) <= 5
+
+
+def test_exhausted_task_is_dead_lettered(tmp_path: Path) -> None:
+    scheduler = _scheduler(tmp_path)
+
+    assert scheduler.schedule(RUN_MSG, INVOCATION_METHOD, 1, "status code: 503")
+    assert scheduler.schedule(RUN_MSG, INVOCATION_METHOD, 2, "status code: 503")
+    assert not scheduler.schedule(RUN_MSG, INVOCATION_METHOD, 3, "status code: 503")
+
+    records = (tmp_path / "dead_letter.jsonl").read_text().splitlines()
+    assert len(records) == 1
+    record = json.loads(records[0])
+    assert record["runId"] == "r_1"
+    assert record["attempts"] == 3
+    assert record["message"] == RUN_MSG
+
+
+def test_persisted_tasks_survive_restart(tmp_path: Path) -> None:
+    queue_path = tmp_path / "retries"
+    _scheduler(tmp_path, queue_path=queue_path).schedule(
+        RUN_MSG, INVOCATION_METHOD, 1, "timeout"
+    )
+    assert len(list(queue_path.glob("*.json"))) == 1
+
+    handled: list[RetryTask] = []
+    done = threading.Event()
+
+    def handler(task: RetryTask) -> None:
+        handled.append(task)
+        done.set()
+
+    scheduler = _scheduler(tmp_path, queue_path=queue_path)
+    scheduler.start(handler)
+    assert done.wait(timeout=5)
+    scheduler.stop()
+
+    assert handled[0].msg == RUN_MSG
+    assert handled[0].attempt == 2
+    assert not list(queue_path.glob("*.json"))
+
+
+def test_retryable_failure_is_parked_without_reporting(tmp_path: Path) -> None:
+    invoker = WebhookInvoker()
+    scheduler = _scheduler(tmp_path)
+    response = mock.MagicMock(ok=False, status_code=503)
+
+    with mock.patch(
+        "invokers.webhook_invoker.retry_scheduler", scheduler
+    ), mock.patch.object(invoker, "_request", return_value=response), mock.patch.object(
+        invoker, "_report_run_status"
+    ) as report_run_status, mock.patch(
+        "invokers.webhook_invoker.run_logger_factory"
+    ):
+        invoker._invoke_run(
+            "r_1", Mapping(), RUN_MSG, INVOCATION_METHOD, retry_msg=RUN_MSG
+        )
+
+    report_run_status.assert_not_called()
+    assert scheduler.pending() == 1
@@ -0,0 +1,93 @@
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from invokers.unix_socket_adapter import create_unix_socket_session, to_unix_socket_url
+from invokers.webhook_invoker import RequestPayload, WebhookInvoker
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: list[tuple[str, dict, dict]] = []
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append((self.path, dict(self.headers), body))
+        response = json.dumps({"ok": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path) -> Iterator[str]:
+    path = str(tmp_path / "sidecar.sock")
+    RecordingHandler.requests = []
+    server = UnixHTTPServer(path, RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("unix:///run/app.sock:/api/run", "http+unix://%2Frun%2Fapp.sock/api/run"),
+        ("unix:///run/app.sock", "http+unix://%2Frun%2Fapp.sock/"),
+        ("http+unix://%2Frun%2Fapp.sock/x", "http+unix://%2Frun%2Fapp.sock/x"),
+        ("http://localhost:8080/api", None),
+    ],
+)
+def test_to_unix_socket_url(url: str, expected: str | None) -> None:
+    assert to_unix_socket_url(url) == expected
+
+
+def test_requests_reuse_the_socket_connection(socket_path: str) -> None:
+    session = create_unix_socket_session()
+    url = to_unix_socket_url(f"unix://{socket_path}:/api/run")
+    assert url
+
+    for index in range(3):
+        assert session.post(url, json={"index": index}).json() == {"ok": True}
+
+    pool = session.get_adapter(url)._get_pool(url)  # type: ignore[attr-defined]
+    assert pool.num_connections == 1
+    assert [body for _, _, body in RecordingHandler.requests] == [
+        {"index": 0},
+        {"index": 1},
+        {"index": 2},
+    ]
+    session.close()
+
+
+def test_invoker_signs_requests_to_a_socket(socket_path: str) -> None:
+    request = RequestPayload(
+        method="POST",
+        url=f"unix://{socket_path}:/api/run",
+        body={"runId": "r_1"},
+        headers={},
+        query={"source": "port"},
+    )
+
+    res = WebhookInvoker._request(request, lambda _: None)
+
+    assert res.ok
+    path, headers, body = RecordingHandler.requests[0]
+    assert path == "/api/run?source=port"
+    assert body == {"runId": "r_1"}
+    assert headers["X-Port-Signature"] == request.headers["X-Port-Signature"]
@@ -1,13 +1,22 @@
+import io
 from typing import Any, Dict, List
 from unittest import mock
 
 import pytest
 from glom import assign, glom
 from glom.core import PathAssignError
-from invokers.webhook_invoker import WebhookInvoker
+from invokers.webhook_invoker import RequestPayload, WebhookInvoker
+from requests import Response
 
 from app.core.config import Mapping
-from app.utils import decrypt_field, decrypt_payload_fields
+from app.utils import (
+    compile_decryption_plan,
+    decrypt_field,
+    decrypt_payload_fields,
+    get_response_body,
+    get_response_fields,
+    get_response_preview,
+)
 
 
 def inplace_decrypt_mock(
@@ -144,6 +153,40 @@ def test_decrypt_payload_fields_complex() -> None:
     assert result["level1"]["list"][1]["deep"]["not_secret"] == "foo"
 
 
+def test_decryption_plan_shares_prefixes() -> None:
+    key = "a" * 32
+    payload = {
+        "properties": {
+            "list": [{"secret": encrypt_field("first", key)}],
+            "secret": encrypt_field("second", key),
+            "missing": None,
+        },
+    }
+    fields = [
+        "properties.list.0.secret",
+        "properties.secret",
+        "properties.missing",
+        "properties.list.3.secret",
+        "unknown.secret",
+    ]
+
+    assert compile_decryption_plan(tuple(fields)) == {
+        "properties": {
+            "list": {"0": {"secret": None}, "3": {"secret": None}},
+            "secret": None,
+            "missing": None,
+        },
+        "unknown": {"secret": None},
+    }
+    assert decrypt_payload_fields(payload, fields, key) == {
+        "properties": {
+            "list": [{"secret": "first"}],
+            "secret": "second",
+            "missing": None,
+        },
+    }
+
+
 def test_decrypt_field_too_short() -> None:
     with pytest.raises(ValueError, match="Encrypted data is too short"):
         decrypt_field("aGVsbG8=", "a" * 32)
@@ -198,3 +241,179 @@ def test_get_nested_and_set_nested() -> None:
         assign(data, "a.b.2", "fail")
     assign(data, "a.b.1.d", "fail")
     assert dict(data["a"]["b"][1])["d"] == "fail"
+
+
+@pytest.mark.parametrize(
+    "global_max_age, mapping_max_age, expired",
+    [(0, None, False), (3600, None, True), (0, 3600, True), (7200, None, False)],
+)
+def test_expired_runs_are_reported_without_invoking(
+    global_max_age: float, mapping_max_age: float | None, expired: bool
+) -> None:
+    invoker = WebhookInvoker()
+    msg = {
+        "context": {"runId": "r_1"},
+        "trigger": {"at": "2024-04-16T12:00:00.000Z"},
+    }
+    mapping = Mapping(maxAge=mapping_max_age)
+
+    with mock.patch.object(
+        WebhookInvoker, "validate_incoming_signature", return_value=True
+    ), mock.patch.object(
+        WebhookInvoker, "_find_mapping", return_value=mapping
+    ), mock.patch.object(
+        WebhookInvoker, "_invoke_run"
+    ) as invoke_run, mock.patch.object(
+        WebhookInvoker, "_report_run_status"
+    ) as report_run_status, mock.patch(
+        "invokers.webhook_invoker.settings.WEBHOOK_RUN_MAX_AGE", global_max_age
+    ), mock.patch(
+        # 1.5 hours after the run was triggered
+        "invokers.webhook_invoker.time.time",
+        return_value=1713274200,
+    ):
+        invoker.invoke(msg, {"type": "WEBHOOK"})
+
+    assert invoke_run.called is not expired
+    assert report_run_status.called is expired
+    if expired:
+        assert report_run_status.call_args.args[1]["status"] == "FAILURE"
+
+
+def test_invoke_batch_retries_events_the_destination_rejected() -> None:
+    invoker = WebhookInvoker()
+    msgs = [{"context": {}, "index": index} for index in range(3)]
+    response = mock.MagicMock(ok=True, status_code=207)
+    response.json.return_value = {"failed": [1, 7]}
+
+    with mock.patch.object(
+        WebhookInvoker, "_request", return_value=response
+    ) as request, mock.patch.object(WebhookInvoker, "_retry_later") as retry_later:
+        failed = invoker.invoke_batch(
+            msgs,
+            {"type": "WEBHOOK", "url": "http://localhost/api/batch"},
+            Mapping(body=".index"),
+            [None, None, None],
+        )
+
+    request_payload = request.call_args.args[0]
+    assert request_payload.body == [0, 1, 2]
+    assert request_payload.headers["X-Port-Batch-Size"] == "3"
+    assert failed == [1]
+    assert retry_later.call_args.args[0] == msgs[1]
+
+
+def test_invoke_batch_sends_a_request_per_computed_destination() -> None:
+    invoker = WebhookInvoker()
+    msgs = [
+        {"context": {}, "index": index, "team": team}
+        for index, team in [(0, "a"), (1, "b"), (2, "a")]
+    ]
+    response = mock.MagicMock(ok=True, status_code=200)
+    response.json.return_value = {}
+
+    with mock.patch.object(
+        WebhookInvoker, "_request", return_value=response
+    ) as request, mock.patch.object(WebhookInvoker, "_retry_later") as retry_later:
+        failed = invoker.invoke_batch(
+            msgs,
+            {"type": "WEBHOOK", "url": "http://localhost/api/batch"},
+            Mapping(
+                url='"http://localhost/api/" + .team',
+                body=".index",
+                headers={"X-Team": ".team"},
+            ),
+            [None, None, None],
+        )
+
+    requests = {call.args[0].url: call.args[0] for call in request.call_args_list}
+    assert set(requests) == {"http://localhost/api/a", "http://localhost/api/b"}
+    assert requests["http://localhost/api/a"].body == [0, 2]
+    assert requests["http://localhost/api/a"].headers["X-Team"] == "a"
+    assert requests["http://localhost/api/b"].body == [1]
+    assert requests["http://localhost/api/b"].headers["X-Port-Batch-Size"] == "1"
+    assert failed == []
+    assert not retry_later.called
+
+
+@pytest.mark.parametrize(
+    "expressions, fields",
+    [
+        ((".response.statusCode", '.response["json"].id'), {"statusCode", "json"}),
+        ((".body.runId",), set()),
+        ((".response | tostring",), None),
+        ((".response.statusCode", ".response[.body.key]"), None),
+        (('if .response.statusCode == 200 then "SUCCESS" end',), {"statusCode"}),
+        (('.response.json.id | tostring | split(".")',), {"json"}),
+        (("now | todate",), set()),
+        (("..",), None),
+        (("tojson",), None),
+        ((".body as $body | to_entries",), None),
+        ((". as $context | $context.response.json",), None),
+        (('.["response"].json',), None),
+        (('"\\(tojson)"',), None),
+        (('"id: \\(.response.json.id | tostring)"',), {"json"}),
+        ((".body + (tojson)",), None),
+        (("[paths] | length",), None),
+        ((".status // (to_entries|length)",), None),
+        ((".response.json.id | @base64",), {"json"}),
+        (("@base64",), None),
+        ((".body.id as $id | tostring",), None),
+        (('{status: .response.statusCode, url: "x"}',), {"statusCode"}),
+        (("{response}",), None),
+        (('.response.json.id | "unterminated',), None),
+    ],
+)
+def test_get_response_fields(
+    expressions: tuple[str, ...], fields: set[str] | None
+) -> None:
+    assert get_response_fields(expressions) == fields
+
+
+def test_report_builds_and_parses_only_the_used_response_fields() -> None:
+    invoker = WebhookInvoker()
+    response = mock.MagicMock(ok=True, status_code=200)
+    response.json.return_value = {"id": "build-1"}
+    mapping = Mapping(
+        report={"externalRunId": ".response.json.id", "link": ".response.json.url"}
+    )
+
+    request = RequestPayload(method="POST", url="", body={}, headers={}, query={})
+
+    report = invoker._prepare_report(mapping, response, request, {})
+
+    assert report.external_run_id == "build-1"
+    assert get_response_body(response) == {"id": "build-1"}
+    response.json.assert_called_once()
+    response.headers.__iter__.assert_not_called()
+
+
+def test_request_truncates_responses_over_the_mapping_size() -> None:
+    response = Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(b'{"log": "' + b"x" * 300_000 + b'"}')
+    request = RequestPayload(
+        method="POST", url="http://localhost/api", body={}, headers={}, query={}
+    )
+
+    with mock.patch(
+        "invokers.webhook_invoker.requests.request", return_value=response
+    ) as send, mock.patch(
+        "invokers.webhook_invoker.settings.WEBHOOK_RESPONSE_PREVIEW_SIZE", 10
+    ):
+        res = WebhookInvoker._request(request, lambda _: None, None, 100_000)
+        summary = (
+            WebhookInvoker()
+            ._prepare_report(
+                Mapping(report={"summary": ".response.truncated"}), res, request, {}
+            )
+            .summary
+        )
+
+    assert send.call_args.kwargs["stream"] is True
+    assert len(res.content) == 100_000
+    assert get_response_body(res) == res.text
+    assert get_response_preview(res, 10) == (
+        '{"log": "x... (99990 more characters) (the response was truncated)'
+    )
+    assert summary is True
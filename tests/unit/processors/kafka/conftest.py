@@ -8,6 +8,7 @@ import port_client
 import pytest
 import requests
 from _pytest.monkeypatch import MonkeyPatch
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
 from confluent_kafka import Consumer as _Consumer
 from core.config import Mapping
 from pydantic import parse_obj_as
@@ -81,6 +82,9 @@ def mock_kafka(monkeypatch: MonkeyPatch, request: Any) -> None:
         def offset(self, *args: Any, **kwargs: Any) -> int:
             return 0
 
+        def timestamp(self, *args: Any, **kwargs: Any) -> tuple[int, int]:
+            return TIMESTAMP_NOT_AVAILABLE, -1
+
         def value(self) -> bytes:
             return request.getfixturevalue(request.param[0])(request.param[1])
 
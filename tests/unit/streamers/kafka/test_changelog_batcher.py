@@ -0,0 +1,50 @@
+from typing import Any
+
+from consumers.offset_tracker import OffsetTracker
+from core.config import ChangelogBatch, Mapping
+from streamers.kafka.changelog_batcher import ChangelogBatcher
+
+DESTINATION = {"type": "WEBHOOK", "url": "http://localhost:80/api/test"}
+
+
+class FakeMessage:
+    def __init__(self, offset: int) -> None:
+        self._offset = offset
+
+    def topic(self) -> str:
+        return "test_org.change.log"
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+    def value(self) -> bytes:
+        return b"{}"
+
+
+def test_batch_is_sent_when_full_and_offsets_are_released() -> None:
+    offsets = OffsetTracker()
+    sent: list[list[int]] = []
+
+    def send(messages: list, values: list, *_: Any) -> list[int]:
+        sent.append([msg.offset() for msg in messages])
+        return [1]
+
+    batcher = ChangelogBatcher(offsets, send)
+    mapping = Mapping(batch=ChangelogBatch(maxEvents=3, lingerTime=60))
+
+    for offset in range(4):
+        msg: Any = FakeMessage(offset)
+        offsets.retain(msg)
+        batcher.add(msg, {"offset": offset}, DESTINATION, mapping)
+        offsets.release(msg)
+
+    assert sent == [[0, 1, 2]]
+    assert [tp.offset for tp in offsets.committable()] == [3]
+
+    batcher.tick(force=True)
+
+    assert sent == [[0, 1, 2], [3]]
+    assert [tp.offset for tp in offsets.committable()] == [4]
@@ -0,0 +1,82 @@
+from typing import Any
+
+from consumers.offset_tracker import OffsetTracker
+from streamers.kafka.changelog_compactor import ChangelogCompactor
+
+DESTINATION = {"type": "WEBHOOK", "url": "http://localhost:80/api/test"}
+
+
+class FakeMessage:
+    def __init__(self, offset: int) -> None:
+        self._offset = offset
+
+    def topic(self) -> str:
+        return "test_org.change.log"
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+
+def _event(entity: str | None) -> dict:
+    return {
+        "resourceType": "entity",
+        "context": {"blueprint": "service", "entity": entity},
+    }
+
+
+def _consume(
+    offsets: OffsetTracker, compactor: ChangelogCompactor, offset: int, msg_value: dict
+) -> None:
+    msg: Any = FakeMessage(offset)
+    offsets.retain(msg)
+    compactor.add(msg, msg_value, DESTINATION)
+    offsets.release(msg)
+
+
+def test_only_latest_event_per_entity_is_forwarded() -> None:
+    offsets = OffsetTracker()
+    forwarded: list[int] = []
+    compactor = ChangelogCompactor(
+        offsets, lambda msg, *_: forwarded.append(msg.offset()), window=60, max_size=10
+    )
+
+    for offset, entity in enumerate(["a", "b", "a", "c", "a"]):
+        _consume(offsets, compactor, offset, _event(entity))
+
+    assert forwarded == []
+    assert [tp.offset for tp in offsets.committable()] == [1]
+
+    compactor.tick(force=True)
+
+    assert forwarded == [1, 3, 4]
+    assert [tp.offset for tp in offsets.committable()] == [5]
+
+
+def test_events_without_entity_keep_their_order() -> None:
+    offsets = OffsetTracker()
+    forwarded: list[int] = []
+    compactor = ChangelogCompactor(
+        offsets, lambda msg, *_: forwarded.append(msg.offset()), window=60, max_size=10
+    )
+
+    _consume(offsets, compactor, 0, _event("a"))
+    _consume(offsets, compactor, 1, _event(None))
+
+    assert forwarded == [0, 1]
+
+
+def test_flushes_when_full() -> None:
+    offsets = OffsetTracker()
+    forwarded: list[int] = []
+    compactor = ChangelogCompactor(
+        offsets, lambda msg, *_: forwarded.append(msg.offset()), window=60, max_size=2
+    )
+
+    _consume(offsets, compactor, 0, _event("a"))
+    _consume(offsets, compactor, 1, _event("b"))
+
+    assert forwarded == [0, 1]
+    assert offsets.retained() == 0
@@ -0,0 +1,108 @@
+import threading
+import time
+from typing import Any
+from unittest import mock
+
+import port_client
+from core.rate_limiter import TokenBucket
+from pytest_mock import MockFixture
+
+
+def _response(status_code: int, headers: dict | None = None) -> Any:
+    return mock.MagicMock(status_code=status_code, headers=headers or {})
+
+
+def test_report_run_status_retries_after_429(mocker: MockFixture) -> None:
+    mocker.patch("port_client.get_port_api_headers", return_value={})
+    patch_mock = mocker.patch(
+        "requests.patch",
+        side_effect=[_response(429, {"Retry-After": "0"}), _response(200)],
+    )
+    pause = mocker.spy(port_client.port_api_bucket, "pause")
+
+    res = port_client.report_run_status("r_1", {"status": "SUCCESS"})
+
+    assert res.status_code == 200
+    assert patch_mock.call_count == 2
+    pause.assert_called_once_with(0)
+
+
+def test_retry_after_http_date() -> None:
+    res = _response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+
+    with mock.patch("port_client.time.time", return_value=1445412470):
+        assert port_client._get_retry_after(res, 0) == 10
+
+
+def test_token_bucket_serves_higher_priority_first() -> None:
+    bucket = TokenBucket("test", rate=20, capacity=1)
+    bucket.acquire()
+    served: list[str] = []
+
+    def acquire(name: str, priority: int) -> None:
+        bucket.acquire(priority)
+        served.append(name)
+
+    low = threading.Thread(target=acquire, args=("logs", 1))
+    low.start()
+    while not bucket.waiting():
+        time.sleep(0.001)
+    high = threading.Thread(target=acquire, args=("status", 0))
+    high.start()
+    low.join()
+    high.join()
+
+    assert served == ["status", "logs"]
+
+
+def test_access_token_is_cached_until_it_expires(mocker: MockFixture) -> None:
+    mocker.patch.object(port_client, "_access_token", None)
+    token = _response(200)
+    token.json.return_value = {"accessToken": "token", "expiresIn": 3600}
+    post_mock = mocker.patch("requests.post", return_value=token)
+    patch_mock = mocker.patch("requests.patch", return_value=_response(200))
+    acquire = mocker.spy(port_client.port_api_bucket, "acquire")
+
+    port_client.report_run_status("r_1", {"status": "SUCCESS"})
+    port_client.report_run_status("r_2", {"status": "SUCCESS"})
+    assert post_mock.call_count == 1
+    assert acquire.call_count == 3
+    assert patch_mock.call_args.kwargs["headers"]["Authorization"] == "Bearer token"
+
+    tokens = [_response(200), _response(200)]
+    tokens[0].json.return_value = {"accessToken": "fresh", "expiresIn": 3600}
+    tokens[1].json.return_value = {"accessToken": "low", "expiresIn": 3600}
+    post_mock.side_effect = [*tokens, _response(200)]
+    patch_mock.side_effect = [_response(401), _response(200)]
+    # A rejected token is fetched again and the call sent once more with it
+    assert port_client.report_run_status("r_3", {"status": "SUCCESS"}).ok
+    assert patch_mock.call_args.kwargs["headers"]["Authorization"] == "Bearer fresh"
+
+    port_client.invalidate_access_token()
+    port_client.run_logger_factory("r_3")("log")
+    assert post_mock.call_args.kwargs["headers"]["Authorization"] == "Bearer low"
+    # The token is fetched with the priority of the call that needs it
+    assert acquire.call_args_list[-2] == mock.call(1)
+
+
+def test_urgent_calls_do_not_wait_for_a_less_urgent_token_fetch(
+    mocker: MockFixture,
+) -> None:
+    mocker.patch.object(port_client, "_access_token", None)
+    low_fetching = threading.Event()
+    release_low = threading.Event()
+
+    def fetch(priority: int) -> tuple[str, float]:
+        if priority:
+            low_fetching.set()
+            release_low.wait(5)
+        return f"token-{priority}", 3600
+
+    mocker.patch.object(port_client, "_fetch_access_token", side_effect=fetch)
+    low = threading.Thread(target=port_client._get_access_token, args=(1,))
+    low.start()
+    assert low_fetching.wait(5)
+
+    assert port_client._get_access_token(0) == "token-0"
+    release_low.set()
+    low.join()
@@ -0,0 +1,130 @@
+import json
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+from port_spool import PortReportSpool
+
+
+def _spool(
+    path: Path, segment_bytes: int = 1024, max_attempts: int = 10
+) -> PortReportSpool:
+    return PortReportSpool(
+        path,
+        segment_bytes=segment_bytes,
+        max_bytes=1024 * 1024,
+        fsync_interval=0.01,
+        concurrency=2,
+        max_attempts=max_attempts,
+    )
+
+
+def _recording_senders(sent: list[tuple[str, str, Any]], status_code: int) -> dict:
+    def sender(kind: str) -> Any:
+        def send(run_id: str, data: Any) -> Any:
+            sent.append((kind, run_id, data))
+            return mock.MagicMock(ok=200 <= status_code < 300, status_code=status_code)
+
+        return send
+
+    return {kind: sender(kind) for kind in ("status", "response", "log")}
+
+
+def test_spool_drains_in_order_across_segments(tmp_path: Path) -> None:
+    sent: list[tuple[str, str, Any]] = []
+    spool = _spool(tmp_path, segment_bytes=128)
+
+    with mock.patch.dict("port_spool.SENDERS", _recording_senders(sent, 200)):
+        spool.start()
+        for i in range(10):
+            spool.run_logger_factory("r_1")(f"log line {i}")
+        spool.append("response", "r_1", {"id": 1})
+        spool.append("status", "r_1", {"status": "SUCCESS"})
+        assert spool.flush(timeout=5)
+        spool.stop()
+
+    assert sent == [("log", "r_1", f"log line {i}") for i in range(10)] + [
+        ("response", "r_1", {"id": 1}),
+        ("status", "r_1", {"status": "SUCCESS"}),
+    ]
+    assert len(list(tmp_path.glob("*.seg"))) == 1
+
+
+def test_spool_survives_restart(tmp_path: Path) -> None:
+    failed: list[tuple[str, str, Any]] = []
+    spool = _spool(tmp_path)
+    with mock.patch.dict("port_spool.SENDERS", _recording_senders(failed, 503)):
+        spool.start()
+        spool.append("status", "r_1", {"status": "FAILURE"})
+        spool.append("status", "r_2", {"status": "SUCCESS"})
+        assert not spool.flush(timeout=0.1)
+        spool.stop()
+
+    sent: list[tuple[str, str, Any]] = []
+    spool = _spool(tmp_path)
+    with mock.patch.dict("port_spool.SENDERS", _recording_senders(sent, 200)):
+        spool.start()
+        assert spool.flush(timeout=5)
+        spool.stop()
+
+    # The runs are sent concurrently, each run in order
+    assert ("status", "r_1", {"status": "FAILURE"}) in failed
+    assert sorted(sent) == [
+        ("status", "r_1", {"status": "FAILURE"}),
+        ("status", "r_2", {"status": "SUCCESS"}),
+    ]
+
+
+def test_torn_record_is_truncated_on_recovery(tmp_path: Path) -> None:
+    spool = _spool(tmp_path)
+    with mock.patch.dict("port_spool.SENDERS", _recording_senders([], 503)):
+        spool.start()
+        spool.append("status", "r_1", {"status": "SUCCESS"})
+        spool.stop()
+    segment_file = next(tmp_path.glob("*.seg"))
+    valid_size = segment_file.stat().st_size
+    with segment_file.open("ab") as f:
+        f.write(b"\x00\x00\x01\x00partial")
+
+    spool = _spool(tmp_path)
+    spool._recover()
+
+    assert segment_file.stat().st_size == valid_size
+    assert spool.pending_bytes() == valid_size
+
+
+def test_failing_run_is_dead_lettered_without_blocking_others(tmp_path: Path) -> None:
+    sent: list[tuple[str, str, Any]] = []
+    senders = _recording_senders(sent, 200)
+    failing = _recording_senders([], 503)["status"]
+    spool = _spool(tmp_path, max_attempts=2)
+
+    def send_status(run_id: str, data: Any) -> Any:
+        if run_id == "r_1":
+            return failing(run_id, data)
+        return senders["status"](run_id, data)
+
+    with mock.patch.dict("port_spool.SENDERS", {**senders, "status": send_status}):
+        spool.start()
+        spool.append("status", "r_1", {"status": "FAILURE"})
+        spool.append("log", "r_1", "after the failed status")
+        spool.append("status", "r_2", {"status": "SUCCESS"})
+        spool.run_logger_factory("r_2")("log line")
+        # r_2 isn't held back by the backoff of r_1
+        assert not spool.flush(timeout=0.5)
+        assert sent == [
+            ("status", "r_2", {"status": "SUCCESS"}),
+            ("log", "r_2", "log line"),
+        ]
+        assert spool.flush(timeout=5)
+        spool.stop()
+
+    assert sent[-1] == ("log", "r_1", "after the failed status")
+    [dead_letter] = [
+        json.loads(line)
+        for line in (tmp_path / "dead-letter.jsonl").read_text().splitlines()
+    ]
+    assert dead_letter["runId"] == "r_1"
+    assert dead_letter["attempts"] == 2
+    assert dead_letter["error"] == "status code: 503"
+    assert list(tmp_path.glob("*.seg")) and spool.pending_bytes() == 0